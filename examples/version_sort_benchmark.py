@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+Time sorting every version in an ebuild repository via CPV comparisons
+against sorting by CPV sort keys.
+
+Each run sorts freshly created CPV instances so the key timings include
+computing the keys; the cached row reuses instances whose keys exist.
+"""
+
+import os
+import random
+import sys
+import time
+
+try:
+    from pkgcore.ebuild import cpv
+    from pkgcore.util import argparse
+    from pkgcore.util.packages import sort_key_getter
+except ImportError:
+    print >> sys.stderr, 'Cannot import pkgcore!'
+    print >> sys.stderr, 'Verify it is properly installed and/or ' \
+        'PYTHONPATH is set correctly.'
+    if '--debug' not in sys.argv:
+        print >> sys.stderr, 'Add --debug to the commandline for a traceback.'
+    else:
+        raise
+    sys.exit(1)
+
+
+def iter_cpvstrs(location):
+    for category in sorted(os.listdir(location)):
+        cat_path = os.path.join(location, category)
+        if category.startswith('.') or not os.path.isdir(cat_path):
+            continue
+        for package in os.listdir(cat_path):
+            pkg_path = os.path.join(cat_path, package)
+            if not os.path.isdir(pkg_path):
+                continue
+            for fn in os.listdir(pkg_path):
+                if fn.endswith('.ebuild'):
+                    yield '%s/%s' % (category, fn[:-7])
+
+
+def best_of(runs, cls, cpvstrs, func):
+    best = None
+    for x in xrange(runs):
+        objs = [cls(s, versioned=True) for s in cpvstrs]
+        start = time.time()
+        func(objs)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('location',
+        help='ebuild repository to pull versions from')
+    parser.add_argument('--runs', type=int, default=5,
+        help='runs per timing; the best is reported')
+    parser.add_argument('--native', action='store_true',
+        help='use the python CPV implementation even if the extension '
+             'is available')
+    options = parser.parse_args(argv)
+
+    cls = cpv.native_CPV if options.native else cpv.CPV
+    cpvstrs = []
+    for cpvstr in iter_cpvstrs(options.location):
+        try:
+            cls(cpvstr, versioned=True)
+        except cpv.InvalidCPV:
+            continue
+        cpvstrs.append(cpvstr)
+    random.shuffle(cpvstrs)
+    print "%i versions, %s CPV" % (len(cpvstrs),
+        'native' if cls is cpv.native_CPV else 'extension')
+
+    cached = [cls(s, versioned=True) for s in cpvstrs]
+    for obj in cached:
+        obj.sort_key
+    timings = [
+        ('sorted()', best_of(options.runs, cls, cpvstrs, sorted)),
+        ('sorted(key=sort_key)', best_of(options.runs, cls, cpvstrs,
+            lambda objs: sorted(objs, key=sort_key_getter))),
+        ('sorted(key=sort_key), cached', best_of(options.runs, cls, cpvstrs,
+            lambda objs: sorted(cached, key=sort_key_getter))),
+    ]
+    base = timings[0][1]
+    for label, elapsed in timings:
+        print "%-32s %8.4fs  %5.2fx" % (label, elapsed, base / elapsed)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -7,21 +7,338 @@ cache subsystem, typically used for storing package metadata
 
 __all__ = ("base", "bulk")
 
+import errno
 import itertools
 import math
 import os
 import operator
 from pkgcore.cache import errors
+from pkgcore.util.file_index import FileIndex
 from snakeoil.mappings import (ProtectedDict, autoconvert_py3k_methods_metaclass,
     make_SlottedDict_kls)
 from snakeoil import klass
 from snakeoil.compatibility import raise_from
+from snakeoil.demandload import demandload
+demandload(globals(), 'pkgcore.ebuild:cpv')
 
 # temp hack for .2
 from pkgcore.ebuild.const import metadata_keys
 metadata_keys = tuple(metadata_keys)
 
 
+class _eclass_entries(tuple):
+    """Reconstructed _eclasses_ data; see :obj:`base.reconstruct_eclasses`."""
+
+
+def _iter_dep_atoms(depstring):
+    """Yield (package key, atom string) for each atom in a dependency string.
+
+    Only as much of the atom is parsed as is needed to get at its key; use
+    conditionals and groupings are skipped, since the index is of every atom
+    an entry may depend on.
+    """
+    for token in depstring.split():
+        if token in ('(', ')', '||') or token[-1] == '?':
+            continue
+        key = token.lstrip('!')
+        versioned = key[:1] in '<>=~'
+        key = key.lstrip('<>=~').split('[', 1)[0].split(':', 1)[0]
+        if versioned:
+            try:
+                key = cpv.versioned_CPV(key.rstrip('*')).key
+            except cpv.InvalidCPV:
+                continue
+        elif '/' not in key:
+            continue
+        yield key, token
+
+
+class _eclass_index(dict):
+
+    """Reverse eclass index; see :obj:`base.eclass_consumers`.
+
+    Maps eclasses to {cpv: serialized eclass chfs} of the entries inheriting
+    them.  The serialized ebuild chf of every entry indexed (inheriting
+    eclasses or not) is tracked too, so an entry's eclasses can be taken
+    from the index once it's checked against the ebuild and eclasses, as a
+    normal lookup would do.  Stored form is a line of ``<cpv>:<chf>``
+    pairs, then a line per eclass and set of chfs::
+
+        <eclass>\t<chf>\t<chf>...\t<cpv> <cpv>...
+    """
+
+    magic = 'pkgcore-eclass-index-2'
+    description = 'reverse eclass index'
+
+    def __init__(self, chfs=None):
+        dict.__init__(self)
+        # cpv -> serialized ebuild chf of the entry indexed.
+        self.chfs = {} if chfs is None else chfs
+        # cpv -> ((eclass, chfs), ...); built on first use.
+        self._inherits = None
+
+    @classmethod
+    def from_lines(cls, lines):
+        lines = iter(lines)
+        index = cls(dict(x.rsplit(':', 1)
+                         for x in next(lines, '').split()))
+        for line in lines:
+            chunks = line.rstrip('\n').split('\t')
+            consumers = index.setdefault(chunks[0], {})
+            chfs = tuple(chunks[1:-1])
+            for cpv in chunks[-1].split():
+                consumers[cpv] = chfs
+        return index
+
+    def iterlines(self):
+        yield '%s\n' % (' '.join('%s:%s' % x
+                                 for x in sorted(self.chfs.iteritems())),)
+        for eclass, consumers in sorted(self.iteritems()):
+            grouped = {}
+            for cpv, chfs in consumers.iteritems():
+                grouped.setdefault(chfs, []).append(cpv)
+            for chfs, cpvs in sorted(grouped.iteritems()):
+                yield '\t'.join((eclass,) + chfs +
+                                (' '.join(sorted(cpvs)),)) + '\n'
+
+    def inherits(self, cpv):
+        """Return the sorted (eclass, chfs) pairs of cpv's indexed entry."""
+        inherits = self._inherits
+        if inherits is None:
+            inherits = {}
+            for eclass, consumers in self.iteritems():
+                for cpvstr, chfs in consumers.iteritems():
+                    inherits.setdefault(cpvstr, []).append((eclass, chfs))
+            inherits = self._inherits = dict(
+                (cpvstr, tuple(sorted(l))) for cpvstr, l in inherits.iteritems())
+        return inherits.get(cpv, ())
+
+    def update_entry(self, cpv, chf, eclasses):
+        """Replace an entry's eclasses.
+
+        :param chf: serialized ebuild chf of the entry, None if the entry was
+            removed
+        :param eclasses: iterable of (eclass, serialized chfs) pairs
+        """
+        self._inherits = None
+        for consumers in self.itervalues():
+            consumers.pop(cpv, None)
+        if chf is None:
+            self.chfs.pop(cpv, None)
+            return
+        self.chfs[cpv] = chf
+        for eclass, chfs in eclasses:
+            self.setdefault(eclass, {})[cpv] = chfs
+
+
+class _revdep_index(object):
+
+    """Reverse dependency index; see :obj:`base.revdeps`.
+
+    Maps package keys to the entries depending on them, and tracks every
+    entry indexed (dependencies or not).  Stored form is a line of all
+    cpvs, then a line per key::
+
+        <key>\t<cpv> <cache key> <atom>\t<cpv> <cache key> <atom>...
+
+    Lines read are only parsed once their key is looked up.
+    """
+
+    magic = 'pkgcore-revdep-index-1'
+    description = 'reverse dependency index'
+
+    def __init__(self, cpvs=(), consumers=None):
+        self.cpvs = set(cpvs)
+        # key -> {cpv: ((cache key, atom), ...)}, or the unparsed line.
+        self._consumers = {} if consumers is None else consumers
+        # cpv -> keys it depends on; built when the index is first updated.
+        self._forward = None
+
+    @classmethod
+    def from_lines(cls, lines):
+        lines = iter(lines)
+        cpvs = next(lines, '').rstrip('\n').split()
+        consumers = {}
+        for line in lines:
+            key, sep, rest = line.rstrip('\n').partition('\t')
+            if rest:
+                consumers[key] = rest
+        return cls(cpvs, consumers)
+
+    def iterlines(self):
+        yield '%s\n' % (' '.join(sorted(self.cpvs)),)
+        for key, consumers in sorted(self._consumers.iteritems()):
+            if not isinstance(consumers, basestring):
+                consumers = '\t'.join('%s %s %s' % (cpv, attr, atom)
+                    for cpv, deps in sorted(consumers.iteritems())
+                    for attr, atom in deps)
+            yield '%s\t%s\n' % (key, consumers)
+
+    def get(self, key):
+        consumers = self._consumers.get(key)
+        if consumers is None:
+            return {}
+        if isinstance(consumers, basestring):
+            d = {}
+            for entry in consumers.split('\t'):
+                cpvstr, attr, atom = entry.split(' ')
+                d.setdefault(cpvstr, []).append((attr, atom))
+            consumers = self._consumers[key] = dict(
+                (cpvstr, tuple(deps)) for cpvstr, deps in d.iteritems())
+        return consumers
+
+    def update(self, cpvstr, deps):
+        """Replace an entry's dependencies.
+
+        :param deps: None if the entry was removed, else a mapping of key to
+            the (cache key, atom) pairs depending on it
+        """
+        forward = self._forward
+        if forward is None:
+            forward = self._forward = {}
+            for key in self._consumers.keys():
+                for x in self.get(key):
+                    forward.setdefault(x, set()).add(key)
+        for key in forward.pop(cpvstr, ()):
+            consumers = self._consumers[key]
+            del consumers[cpvstr]
+            if not consumers:
+                del self._consumers[key]
+        if deps is None:
+            self.cpvs.discard(cpvstr)
+            return
+        self.cpvs.add(cpvstr)
+        for key, l in deps.iteritems():
+            self.get(key)
+            self._consumers.setdefault(key, {})[cpvstr] = l
+        forward[cpvstr] = set(deps)
+
+
+class _stored_index(FileIndex):
+
+    """One of a cache's reverse indexes, and where it's stored.
+
+    The index is loaded on first use, or if there's no stored copy, built by
+    :obj:`base._scan_indexes`; it's kept up to date as entries change, and
+    written back by :obj:`base.commit` once it's been built or changed.
+
+    Caches are written to without being committed (autocommitting backends
+    in particular), so rather than the stored index being rewritten on every
+    change, the cpvs of changed entries are appended to it, one per line
+    prefixed with :obj:`changed_prefix`.  Those entries are indexed afresh
+    when it's loaded; the next save drops the list.
+
+    :ivar index: the index, None till it's loaded or built
+    :ivar index_kls: class of the index
+    :ivar indexer: callable taking the index, a cpv and its entry (None if
+        the entry was removed), updating the index to match
+    :ivar getitem: callable returning a cpv's entry, raising KeyError if
+        there isn't one
+    """
+
+    # no line of the index itself starts with this.
+    changed_prefix = '-'
+
+    def __init__(self, index_kls, indexer, getitem, header, path=None,
+                 readonly=True):
+        FileIndex.__init__(self, path, readonly)
+        self.index_kls = index_kls
+        self.indexer = indexer
+        self.getitem = getitem
+        self.description = index_kls.description
+        self._header = header
+        self.index = None
+        # set once a stored index was looked for and not found.
+        self._unstored = False
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def unsaved(self):
+        """True if the index was built or changed, and is to be stored."""
+        return self._dirty and self.path is not None and not self.readonly
+
+    def _read_entries(self, f):
+        lines = f.readlines()
+        if lines and not lines[-1].endswith('\n'):
+            raise ValueError("truncated index")
+        changed = set()
+        while len(lines) > 1 and lines[-1].startswith(self.changed_prefix):
+            changed.add(lines.pop()[len(self.changed_prefix):-1])
+        index = self.index_kls.from_lines(lines)
+        for cpv in changed:
+            self._reindex(index, cpv)
+        if changed:
+            # write it out without the list on the next save.
+            self._dirty = True
+        return index
+
+    def _write(self):
+        FileIndex._write(self)
+        self._unstored = False
+
+    def _reindex(self, index, cpv):
+        try:
+            self.indexer(index, cpv, self.getitem(cpv))
+        except (KeyError, ValueError, errors.CacheError):
+            # removed or corrupt; either way, nothing to index.
+            self.indexer(index, cpv, None)
+
+    def _write_entries(self, f, cutoff):
+        # built from the cache entries rather than files; nothing is racy.
+        f.writelines(self.index.iterlines())
+
+    def peek(self):
+        """Return the index if it's loaded or stored, without a scan."""
+        if self.index is None and not self._unstored:
+            self.index = self._read()
+            self._unstored = self.index is None
+        return self.index
+
+    def forget(self):
+        """Drop the index, so it's read or built afresh when next used."""
+        self.index = None
+        self._unstored = False
+
+    def built(self, index):
+        """Use an index built from the entries, storing it on the next save."""
+        self.index = index
+        self._dirty = True
+
+    def update(self, cpv, values):
+        """Record cpv's new entry (None if the entry was removed)."""
+        if self.index is not None:
+            self.indexer(self.index, cpv, values)
+        # otherwise, it's loaded or built from scratch when needed.
+        self._dirty = True
+        if self.path is None or self.readonly or self._unstored:
+            return
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._unstored = self.index is None
+            return
+        try:
+            os.write(fd, '%s%s\n' % (self.changed_prefix, cpv))
+        except EnvironmentError:
+            # can't mark it stale; drop it instead.
+            os.close(fd)
+            self._remove()
+            return
+        os.close(fd)
+
+    def _remove(self):
+        try:
+            os.unlink(self.path)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
 class base(object):
     # this is for metadata/cache transfer.
     # basically flags the cache needs be updated when transfered cache to cache.
@@ -32,6 +349,11 @@ class base(object):
         or queues up updates.
     :ivar cleanse_keys: Boolean controlling whether the template should drop
         empty keys for storing.
+    :ivar eclass_index_name: if not None, the reverse eclass index (see
+        :obj:`eclass_consumers`) is stored under this name on commit.
+    :ivar revdep_index_name: likewise, for the reverse dependency index (see
+        :obj:`revdeps`).
+    :ivar revdep_keys: keys whose atoms the reverse dependency index covers.
     """
 
     autocommits = False
@@ -40,6 +362,9 @@ class base(object):
     chf_type = 'mtime'
     eclass_chf_types = ('mtime',)
     eclass_splitter = '\t'
+    eclass_index_name = None
+    revdep_index_name = None
+    revdep_keys = ('DEPEND', 'RDEPEND', 'PDEPEND')
 
     default_keys = metadata_keys
 
@@ -66,6 +391,9 @@ class base(object):
         self.readonly = readonly
         self.set_sync_rate(self.default_sync_rate)
         self.updates = 0
+        # serialized _eclasses_ -> reconstruct_eclasses result.
+        self._reconstructed_eclasses = {}
+        self._eclass_chf_types = tuple(self.eclass_chf_types)
 
     @staticmethod
     def _get_chf_serializer(chf):
@@ -90,6 +418,15 @@ class base(object):
             return lambda val:long(math.floor(float(val)))
         return lambda val:long(val, 16)
 
+    @staticmethod
+    def _serialize_chf_value(chf, value):
+        """Serialize a chf value in the form its deserializer returns."""
+        if chf == 'eclassdir':
+            return value
+        elif chf == 'mtime':
+            return '%i' % (value,)
+        return '%x' % (value,)
+
     @klass.jit_attr
     def eclass_chf_serializers(self):
         return tuple(self._get_chf_serializer(chf) for chf in
@@ -119,7 +456,10 @@ class base(object):
         handles it, they can override it.
         """
         self._sync_if_needed()
-        d = self._getitem(cpv)
+        return self._convert_entry(cpv, self._getitem(cpv))
+
+    def _convert_entry(self, cpv, d):
+        """Apply the conversions :obj:`__getitem__` does to a raw entry."""
         if "_eclasses_" in d:
             d["_eclasses_"] = self.reconstruct_eclasses(cpv, d["_eclasses_"])
         return d
@@ -151,6 +491,44 @@ class base(object):
 
         d[self._chf_key] = self._chf_serializer(d.pop('_chf_'))
         self._setitem(cpv, d)
+        self._update_indexes(cpv, d)
+        self._sync_if_needed(True)
+
+    def get_serialized_entry(self, cpv):
+        """Return cpv's entry in serialized, backend independent form.
+
+        Values are strings; the chf is serialized, and _eclasses_ is in the
+        tab separated form of :obj:`deconstruct_eclasses`.  The result can
+        be stored via :obj:`set_serialized_entry` of any cache using the
+        same chf types.
+        """
+        d = {}
+        for key, value in self._getitem(cpv).iteritems():
+            if key == self._chf_key:
+                value = self._serialize_chf_value(self.chf_type, value)
+            elif key == '_eclasses_':
+                l = []
+                for eclass, chfs in self._split_eclasses(value):
+                    l.append(eclass)
+                    l.extend(chfs)
+                value = '\t'.join(l)
+            d[key] = value
+        return d
+
+    def set_serialized_entry(self, cpv, values):
+        """Store an entry returned by :obj:`get_serialized_entry`."""
+        if self.readonly:
+            raise errors.ReadOnly()
+        d = dict(values)
+        if self.cleanse_keys:
+            for k, v in d.items():
+                if not v:
+                    del d[k]
+        eclasses = d.get('_eclasses_')
+        if eclasses is not None and self.eclass_splitter != '\t':
+            d['_eclasses_'] = self.eclass_splitter.join(eclasses.split('\t'))
+        self._setitem(cpv, d)
+        self._update_indexes(cpv, d)
         self._sync_if_needed(True)
 
     def _setitem(self, name, values):
@@ -170,6 +548,7 @@ class base(object):
         if self.readonly:
             raise errors.ReadOnly()
         self._delitem(cpv)
+        self._update_indexes(cpv, None)
         self._sync_if_needed(True)
 
     def _delitem(self, cpv):
@@ -213,6 +592,244 @@ class base(object):
     def commit(self, force=False):
         if not self.autocommits:
             raise NotImplementedError
+        self._commit_indexes()
+
+    def eclass_consumers(self, eclass):
+        """Return the entries inheriting the given eclass.
+
+        This is answered from the reverse eclass index, which is loaded
+        from disk if the backend stores one, built via a scan of all
+        entries otherwise (and stored on the next commit).  Readonly caches
+        never store it, so each process using it scans them.
+
+        Entries aren't validated; see :obj:`inherited` for that.
+
+        :return: dict mapping cpv to the eclass chfs recorded in its entry,
+            in the form :obj:`reconstruct_eclasses` returns them
+        """
+        consumers = self.eclass_index().get(eclass, {})
+        return dict((cpv, tuple(self._deserialize_eclass_chfs(chfs)))
+                    for cpv, chfs in consumers.iteritems())
+
+    def iter_eclass_consumers(self):
+        """Yield (eclass, sorted cpvs) for every eclass entries inherit.
+
+        Like :obj:`eclass_consumers`, entries aren't validated.
+        """
+        for eclass, consumers in sorted(self.eclass_index().iteritems()):
+            if consumers:
+                yield eclass, sorted(consumers)
+
+    def inherited(self, cpv, ebuild_hash_item, eclass_db):
+        """Return the eclasses cpv's entry inherits, if the entry is valid.
+
+        Entries covered by the reverse eclass index are checked against the
+        ebuild chf and the eclasses the index recorded for them, without
+        being loaded.  The index is only used if it's already loaded or
+        stored, since building it means loading every entry; otherwise, or
+        if the index disagrees with the ebuild, the entry is loaded and
+        validated as a normal lookup does.
+
+        :param ebuild_hash_item: chksum data of the ebuild, as passed to
+            :obj:`validate_entry`
+        :return: sorted tuple of eclass names, or None if cpv lacks a valid
+            entry
+        """
+        index = self._stored_eclass_index.peek()
+        if index is not None and cpv in index.chfs:
+            try:
+                chf = self._chf_deserializer(index.chfs[cpv])
+            except ValueError:
+                chf = None
+            if chf is not None and chf == getattr(
+                    ebuild_hash_item, self.chf_type, None):
+                inherits = index.inherits(cpv)
+                eclass_data = [
+                    (eclass, tuple(self._deserialize_eclass_chfs(chfs)))
+                    for eclass, chfs in inherits]
+                if eclass_db.rebuild_cache_entry(eclass_data,
+                        key=(self._eclass_chf_types, inherits)) is not None:
+                    return tuple(eclass for eclass, chfs in inherits)
+        try:
+            data = self[cpv]
+            if not self.validate_entry(data, ebuild_hash_item, eclass_db):
+                return None
+        except KeyError:
+            return None
+        except errors.CacheError:
+            # corrupt; let the normal lookup report it.
+            return None
+        return tuple(sorted(data.get('_eclasses_', ())))
+
+    def has_valid_entry(self, cpv, ebuild_hash_item, eclass_db):
+        """Return True if cpv's entry is valid for the ebuild and eclasses.
+
+        See :obj:`inherited`, which this is answered by.
+        """
+        return self.inherited(cpv, ebuild_hash_item, eclass_db) is not None
+
+    def _split_eclasses(self, eclass_string):
+        """Yield (eclass, chfs) from a serialized _eclasses_ string.
+
+        Unlike :obj:`reconstruct_eclasses`, the chfs are left serialized.
+        """
+        eclass_data = eclass_string.strip().split(self.eclass_splitter)
+        if eclass_data == [""]:
+            return
+        step = len(self.eclass_chf_types) + 1
+        if len(eclass_data) % step:
+            raise ValueError("_eclasses_ was of invalid len %i "
+                "(must be mod %i)" % (len(eclass_data), step))
+        for pos in xrange(0, len(eclass_data), step):
+            yield eclass_data[pos], tuple(eclass_data[pos + 1:pos + step])
+
+    def _entry_chf(self, values):
+        """Return the serialized ebuild chf of an entry."""
+        chf = values.get(self._chf_key)
+        if chf is None:
+            return ''
+        if not isinstance(chf, basestring):
+            chf = self._serialize_chf_value(self.chf_type, chf)
+        return chf
+
+    def _index_eclasses(self, index, cpv, values):
+        if values is None:
+            index.update_entry(cpv, None, ())
+            return
+        eclasses = values.get('_eclasses_')
+        index.update_entry(cpv, self._entry_chf(values),
+            self._split_eclasses(eclasses) if eclasses else ())
+
+    def revdeps(self, key):
+        """Return the entries depending on a package key.
+
+        Like :obj:`eclass_consumers`, this is answered from an index of the
+        entries (built by a scan of them if the backend doesn't store one),
+        kept up to date as entries are added and removed.  Every atom of
+        :obj:`revdep_keys` is listed, regardless of use conditionals.
+        Entries aren't validated; check them via :obj:`has_valid_entry`
+        before relying on an entry's absence.
+
+        :return: dict mapping cpv to a tuple of (cache key, atom string)
+            pairs
+        """
+        return self.revdep_index().get(key)
+
+    def revdep_indexed(self):
+        """Return the set of cpvs covered by the reverse dependency index."""
+        return self.revdep_index().cpvs
+
+    def save_revdep_index(self):
+        """Store the reverse dependency index if it was built or changed.
+
+        :obj:`commit` does this as well; this is for consumers that only
+        read from the cache, but want a scan to be kept for next time.
+        Failures to write it are logged rather than raised.
+        """
+        stored = self._stored_revdep_index
+        if stored.unsaved:
+            self._get_index(stored)
+            stored.try_save()
+
+    def _entry_deps(self, values):
+        deps = {}
+        for attr in self.revdep_keys:
+            depstring = values.get(attr)
+            if depstring:
+                for key, atom in _iter_dep_atoms(depstring):
+                    deps.setdefault(key, []).append((attr, atom))
+        return dict((key, tuple(l)) for key, l in deps.iteritems())
+
+    def _index_deps(self, index, cpv, values):
+        index.update(cpv, None if values is None else self._entry_deps(values))
+
+    def _make_index(self, name, index_kls, indexer, header):
+        """Return the :obj:`_stored_index` for one of the reverse indexes.
+
+        By default indexes are only kept in memory; override this in
+        derived classes able to store them.
+
+        :param name: name to store the index under, None if it isn't to be
+        """
+        return _stored_index(index_kls, indexer, self._getitem, header)
+
+    @klass.jit_attr
+    def _stored_eclass_index(self):
+        return self._make_index(self.eclass_index_name, _eclass_index,
+            self._index_eclasses,
+            ' '.join((_eclass_index.magic, self.chf_type) +
+                     self._eclass_chf_types))
+
+    @klass.jit_attr
+    def _stored_revdep_index(self):
+        return self._make_index(self.revdep_index_name, _revdep_index,
+            self._index_deps,
+            ' '.join((_revdep_index.magic,) + tuple(self.revdep_keys)))
+
+    @property
+    def _indexes(self):
+        return (self._stored_eclass_index, self._stored_revdep_index)
+
+    def invalidate_indexes(self):
+        """Forget the loaded indexes, since entries were changed elsewhere.
+
+        They're read or built afresh when next used.
+        """
+        for stored in self._indexes:
+            stored.forget()
+
+    def eclass_index(self):
+        """Return the reverse eclass index, loading or building it if need be.
+
+        Its ``iterlines`` method gives the serialized form, which is what
+        :obj:`pkgcore.cache.remote` serves to clients.
+        """
+        return self._get_index(self._stored_eclass_index)
+
+    def revdep_index(self):
+        """Return the reverse dependency index; see :obj:`eclass_index`."""
+        return self._get_index(self._stored_revdep_index)
+
+    def _get_index(self, stored):
+        index = stored.peek()
+        if index is None:
+            index = self._scan_indexes()[stored]
+        return index
+
+    def _scan_indexes(self):
+        """Build every index that isn't loaded or stored.
+
+        The indexes share the one pass over the entries.
+
+        :return: dict mapping each :obj:`_stored_index` built to its index
+        """
+        missing = dict((x, x.index_kls()) for x in self._indexes
+                       if x.peek() is None)
+        for cpv in self.iterkeys():
+            try:
+                values = self._getitem(cpv)
+            except (KeyError, ValueError, errors.CacheError):
+                # removed or corrupt; either way, nothing to index.
+                continue
+            for stored, index in missing.iteritems():
+                try:
+                    stored.indexer(index, cpv, values)
+                except (KeyError, ValueError, errors.CacheError):
+                    continue
+        for stored, index in missing.iteritems():
+            stored.built(index)
+        return missing
+
+    def _update_indexes(self, cpv, values):
+        """Record cpv's new entry (None if the entry was removed)."""
+        for stored in self._indexes:
+            stored.update(cpv, values)
+
+    def _commit_indexes(self):
+        for stored in self._indexes:
+            if stored.unsaved:
+                self._get_index(stored)
+                stored.save()
 
     def deconstruct_eclasses(self, eclass_dict):
         """takes a dict, returns a string representing said dict"""
@@ -229,10 +846,24 @@ class base(object):
             yield chf, convert(item)
 
     def reconstruct_eclasses(self, cpv, eclass_string):
-        """Turn a string from :obj:`serialize_eclasses` into a dict."""
+        """Turn a string from :obj:`deconstruct_eclasses` into a sequence of
+        (eclass, chfs) pairs.
+
+        The result is immutable, and shared between all entries with the
+        same serialized form; its ``validation_key`` attribute identifies
+        that form, and is passed on to the eclass cache when validating.
+        """
         if not isinstance(eclass_string, basestring):
             raise TypeError("eclass_string must be basestring, got %r" %
                 eclass_string)
+        o = self._reconstructed_eclasses.get(eclass_string)
+        if o is None:
+            o = _eclass_entries(self._reconstruct_eclasses(cpv, eclass_string))
+            o.validation_key = (self._eclass_chf_types, eclass_string)
+            self._reconstructed_eclasses[eclass_string] = o
+        return o
+
+    def _reconstruct_eclasses(self, cpv, eclass_string):
         eclass_data = eclass_string.strip().split(self.eclass_splitter)
         if eclass_data == [""]:
             # occasionally this occurs in the fs backends.  they suck.
@@ -261,7 +892,61 @@ class base(object):
             raise_from(errors.CacheCorruption(
                 cpv, 'ValueError reading %r' % (eclass_string,)))
 
+    def get_many(self, cpvs):
+        """Return a dict of cpv -> entry for each of cpvs in the cache.
+
+        Missing or corrupt entries are left out; they're reported via the
+        normal :obj:`__getitem__` path instead.  Derived classes can
+        override this to pull in a batch of entries more efficiently.
+        """
+        d = {}
+        for cpv in cpvs:
+            try:
+                d[cpv] = self[cpv]
+            except (KeyError, errors.CacheError):
+                continue
+        return d
+
+    def _get_many(self, cpvs):
+        """Helper for backends overriding :obj:`get_many`.
+
+        Pulls the raw entries in the order given via :obj:`_getitem`, doing
+        the _eclasses_ conversion :obj:`__getitem__` would.
+        """
+        d = {}
+        for cpv in cpvs:
+            try:
+                d[cpv] = self._convert_entry(cpv, self._getitem(cpv))
+            except (KeyError, errors.CacheError):
+                continue
+        return d
+
     def validate_entry(self, cache_item, ebuild_hash_item, eclass_db):
+        return self._validate_entry(cache_item, ebuild_hash_item, eclass_db,
+                                    {})
+
+    def validate_entries(self, entries, eclass_db):
+        """Validate a batch of entries, as :obj:`validate_entry` does.
+
+        Entries inheriting the same eclasses (typically most of a batch)
+        share a single eclass check.
+
+        :param entries: iterable of (cache_item, ebuild_hash_item) pairs
+        :return: list of booleans, in the order of entries
+        """
+        checked = {}
+        l = []
+        for cache_item, ebuild_hash_item in entries:
+            try:
+                l.append(self._validate_entry(cache_item, ebuild_hash_item,
+                                              eclass_db, checked))
+            except errors.CacheError:
+                # corrupt; let the per entry path report it.
+                l.append(False)
+        return l
+
+    def _validate_entry(self, cache_item, ebuild_hash_item, eclass_db,
+                        checked):
         chf_hash = cache_item.get(self._chf_key)
         if (chf_hash is None or
             chf_hash != getattr(ebuild_hash_item, self.chf_type, None)):
@@ -269,7 +954,20 @@ class base(object):
         eclass_data = cache_item.get('_eclasses_')
         if eclass_data is None:
             return True
-        update = eclass_db.rebuild_cache_entry(eclass_data)
+        key = getattr(eclass_data, 'validation_key', None)
+        if key is None:
+            key = tuple(eclass_data)
+            if key in checked:
+                update = checked[key]
+            else:
+                update = checked[key] = eclass_db.rebuild_cache_entry(
+                    eclass_data)
+        elif key in checked:
+            update = checked[key]
+        else:
+            # the eclass cache memoizes validation under the key itself.
+            update = checked[key] = eclass_db.rebuild_cache_entry(
+                eclass_data, key=key)
         if update is None:
             return False
         cache_item['_eclasses_'] = update
@@ -320,3 +1018,4 @@ class bulk(base):
         if self._pending_updates or force:
             self._write_data()
             self._pending_updates = []
+        self._commit_indexes()
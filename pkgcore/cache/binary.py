@@ -0,0 +1,238 @@
+# License: GPL2/BSD
+
+"""
+per key file backend using a compact binary record format
+
+Entries are laid out on disk as :obj:`pkgcore.cache.flat_hash.database`
+does, one file per cpv, but each is a binary record rather than key=value
+lines::
+
+    magic       'pkb\\x01'
+    chf         fixed width big endian integer; see _chf_widths
+    then, till the end of the record, per key:
+    key         unsigned byte index into _keys; 255 if it's not listed
+                there, followed by an unsigned byte name length and name
+    value       unsigned byte length; 255 if it's longer, followed by an
+                unsigned int length- then the value itself
+
+_eclasses_ is stored as a value like any other, encoded as::
+
+    '\\x00', unsigned byte count of eclass dirs (so at most 255)
+    per dir     unsigned short length, dir
+    count       unsigned short count of eclasses
+    per eclass  unsigned byte name length, name, then each eclass chf;
+                fixed width integers, or an unsigned byte index into the
+                eclass dirs for eclassdir
+
+Reading an entry takes no line splitting or number parsing beyond struct
+unpacking, and since the encoded _eclasses_ value is what
+:obj:`pkgcore.cache.base.reconstruct_eclasses` memoizes on, each distinct
+eclass set is decoded once (names and eclass dirs interned).
+
+Existing caches can be converted via pclone_cache.
+"""
+
+__all__ = ("database", "md5_cache")
+
+import struct
+
+from pkgcore.cache import flat_hash, errors
+from pkgcore.config import ConfigHint
+from snakeoil.compatibility import raise_from
+
+_magic = 'pkb\x01'
+_eclasses_magic = '\x00'
+_ushort = struct.Struct('>H')
+_uint = struct.Struct('>I')
+_u64 = struct.Struct('>Q')
+_escape = 255
+
+# keys stored by index; this is part of the format, so only ever append.
+_keys = (
+    'DEPEND', 'RDEPEND', 'SLOT', 'SRC_URI', 'RESTRICT', 'HOMEPAGE',
+    'LICENSE', 'DESCRIPTION', 'KEYWORDS', 'INHERITED', 'IUSE',
+    'REQUIRED_USE', 'PDEPEND', 'PROVIDE', 'EAPI', 'PROPERTIES',
+    'DEFINED_PHASES', 'HDEPEND', '_eclasses_',
+)
+_key_ids = dict((key, chr(i)) for i, key in enumerate(_keys))
+
+# bytes used to store each chf type.
+_chf_widths = {
+    'mtime': 8,
+    'md5': 16,
+    'rmd160': 20,
+    'sha1': 20,
+    'sha256': 32,
+    'sha512': 64,
+    'whirlpool': 64,
+}
+
+
+def _pack_int(value, width):
+    if width == 8:
+        return _u64.pack(value)
+    return ('%0*x' % (width * 2, value)).decode('hex')
+
+
+def _unpack_int(data, pos, width):
+    if width == 8:
+        return _u64.unpack_from(data, pos)[0]
+    if len(data) < pos + width:
+        raise ValueError("truncated chf")
+    return long(data[pos:pos + width].encode('hex'), 16)
+
+
+def _pack_len(length):
+    if length < _escape:
+        return chr(length)
+    return chr(_escape) + _uint.pack(length)
+
+
+class database(flat_hash.database):
+
+    """
+    stores cache entries as compact binary records
+    """
+
+    pkgcore_config_type = ConfigHint(
+        {'readonly': 'bool', 'location': 'str', 'label': 'str',
+         'auxdbkeys': 'list'},
+        required=['location'],
+        positional=['location'],
+        typename='cache')
+
+    def __init__(self, *args, **config):
+        super(database, self).__init__(*args, **config)
+        for chf in (self.chf_type,) + tuple(self.eclass_chf_types):
+            if chf != 'eclassdir' and chf not in _chf_widths:
+                raise errors.InitializationError(self.__class__,
+                    "chf %r isn't supported by the binary format" % (chf,))
+        self._chf_width = _chf_widths[self.chf_type]
+
+    def _format_entry(self, values):
+        chf_key = self._chf_key
+        l = [_magic, _pack_int(self._chf_deserializer(values[chf_key]),
+                               self._chf_width)]
+        for key, value in values.iteritems():
+            if key == chf_key:
+                continue
+            elif key == '_eclasses_' and value:
+                value = self._encode_eclasses(value)
+            key_id = _key_ids.get(key)
+            if key_id is None:
+                key_id = "%c%c%s" % (_escape, len(key), key)
+            l.extend((key_id, _pack_len(len(value)), value))
+        return ''.join(l)
+
+    def _decode_entry(self, raw, mtime):
+        if raw[:len(_magic)] != _magic:
+            raise ValueError("not a binary cache entry")
+        d = self._cdict_kls()
+        known = self._known_keys
+        keys = _keys
+        end = len(raw)
+        try:
+            pos = len(_magic)
+            d[self._chf_key] = _unpack_int(raw, pos, self._chf_width)
+            pos += self._chf_width
+            while pos < end:
+                key_id = ord(raw[pos])
+                if key_id == _escape:
+                    start = pos + 2
+                    pos = start + ord(raw[pos + 1])
+                    key = raw[start:pos]
+                else:
+                    key = keys[key_id]
+                    pos += 1
+                length = ord(raw[pos])
+                if length == _escape:
+                    length = _uint.unpack_from(raw, pos + 1)[0]
+                    pos += 1 + _uint.size
+                else:
+                    pos += 1
+                if key in known:
+                    d[key] = raw[pos:pos + length]
+                pos += length
+        except (IndexError, struct.error) as e:
+            raise_from(ValueError("truncated entry: %s" % (e,)))
+        if pos != end:
+            raise ValueError("entry length mismatch")
+        return d
+
+    def _encode_eclasses(self, eclass_string):
+        dirs = {}
+        l = []
+        count = 0
+        for eclass, chfs in self._split_eclasses(eclass_string):
+            l.extend((chr(len(eclass)), eclass))
+            for chf, value in self._deserialize_eclass_chfs(chfs):
+                if chf == 'eclassdir':
+                    index = dirs.setdefault(value, len(dirs))
+                    if index >= _escape:
+                        raise errors.CacheError(
+                            "binary cache entries can't reference more than "
+                            "%i eclass dirs" % (_escape,))
+                    l.append(chr(index))
+                else:
+                    l.append(_pack_int(value, _chf_widths[chf]))
+            count += 1
+        header = [_eclasses_magic, chr(len(dirs))]
+        for path, i in sorted(dirs.iteritems(), key=lambda x: x[1]):
+            header.extend((_ushort.pack(len(path)), path))
+        header.append(_ushort.pack(count))
+        return ''.join(header + l)
+
+    def _decode_eclasses(self, data):
+        chfs = tuple(self.eclass_chf_types)
+        l = []
+        try:
+            dirs = []
+            pos = 2
+            for x in xrange(ord(data[1])):
+                end = pos + _ushort.size + _ushort.unpack_from(data, pos)[0]
+                dirs.append(intern(data[pos + _ushort.size:end]))
+                pos = end
+            count = _ushort.unpack_from(data, pos)[0]
+            pos += _ushort.size
+            for x in xrange(count):
+                end = pos + 1 + ord(data[pos])
+                eclass = intern(data[pos + 1:end])
+                pos = end
+                values = []
+                for chf in chfs:
+                    if chf == 'eclassdir':
+                        values.append((chf, dirs[ord(data[pos])]))
+                        pos += 1
+                    else:
+                        width = _chf_widths[chf]
+                        values.append((chf, _unpack_int(data, pos, width)))
+                        pos += width
+                l.append((eclass, tuple(values)))
+        except (IndexError, struct.error) as e:
+            raise_from(ValueError("truncated _eclasses_: %s" % (e,)))
+        if pos != len(data):
+            raise ValueError("_eclasses_ length mismatch")
+        return l
+
+    def _reconstruct_eclasses(self, cpv, eclass_string):
+        if not eclass_string.startswith(_eclasses_magic):
+            return super(database, self)._reconstruct_eclasses(
+                cpv, eclass_string)
+        try:
+            return self._decode_eclasses(eclass_string)
+        except ValueError as e:
+            raise_from(errors.CacheCorruption(cpv, e))
+
+    def _split_eclasses(self, eclass_string):
+        if not eclass_string.startswith(_eclasses_magic):
+            return super(database, self)._split_eclasses(eclass_string)
+        serialize = self._serialize_chf_value
+        return ((eclass, tuple(serialize(chf, value) for chf, value in chfs))
+                for eclass, chfs in self._decode_eclasses(eclass_string))
+
+
+class md5_cache(database):
+
+    chf_type = 'md5'
+    eclass_chf_types = ('md5',)
+    chf_base = 16
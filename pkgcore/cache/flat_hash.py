@@ -5,7 +5,7 @@
 per key file based backend
 """
 
-__all__ = ("database",)
+__all__ = ("database", "parse_entry")
 
 import os, stat, errno
 from pkgcore.cache import fs_template, errors
@@ -13,6 +13,216 @@ from pkgcore.config import ConfigHint
 from snakeoil.osutils import pjoin
 from snakeoil.fileutils import readlines_ascii
 from snakeoil.compatibility import raise_from
+from snakeoil.currying import partial
+from snakeoil.mappings import DictMixin
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'atexit',
+    'threading',
+    'Queue',
+    'weakref',
+    'pkgcore.log:logger',
+)
+
+_missing = object()
+_deleted = object()
+_write_behind_caches = None
+
+
+def _flush_write_behind_caches():
+    for cache in list(_write_behind_caches):
+        cache.set_write_behind(0)
+        # nothing is left to commit these; report them at least.
+        for e in cache._pop_write_failures():
+            logger.error("cache write-behind failed: %s" % (e,))
+
+
+class _background_writer(object):
+
+    """
+    background writer thread for :obj:`database.set_write_behind`
+
+    Entries are handed to the cache's _write_batch in batches of up to
+    batch_size; entries queued but not yet written are kept in a pending
+    map so readers still see them.  Failures are collected for the cache
+    to raise, since the thread has no caller to raise them to.
+    """
+
+    batch_size = 64
+
+    def __init__(self, write_batch, queue_size):
+        self._write_batch = write_batch
+        self._queue = Queue.Queue(queue_size)
+        self._pending = {}
+        self._failures = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        name="cache write-behind")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_pending(self, cpv):
+        return self._pending.get(cpv)
+
+    def put(self, cpv, values):
+        with self._lock:
+            self._pending[cpv] = values
+        # blocks while the queue is full, throttling the producer.
+        self._queue.put((cpv, values))
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            batch = [queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(queue.get_nowait())
+            except Queue.Empty:
+                pass
+            items = [x for x in batch if x is not None]
+            failures = []
+            try:
+                failures = self._write_batch(items)
+            except Exception as e:
+                # dying here would leave flush() waiting forever.
+                failures = [e]
+            finally:
+                with self._lock:
+                    self._failures.extend(failures)
+                    for cpv, values in items:
+                        if self._pending.get(cpv) is values:
+                            del self._pending[cpv]
+                for x in batch:
+                    queue.task_done()
+            if len(items) != len(batch):
+                return
+
+    def flush(self):
+        """Wait for everything queued so far to be written.
+
+        :return: list of the exceptions writes failed with since the last
+            flush
+        """
+        self._queue.join()
+        with self._lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+    def stop(self):
+        """Flush, and shut down the writer thread; returns as flush does."""
+        self._queue.put(None)
+        self._thread.join()
+        return self.flush()
+
+
+class _lazy_entry(DictMixin):
+
+    """
+    cache entry decoding values from the raw key=value text on first access
+
+    Values are pulled straight out of the raw text via a search for the
+    key, so keys that are never accessed are never split out (nor their
+    converters run).  Only iterating over the entry requires a full parse.
+    """
+
+    __slots__ = ("_raw", "_known", "_values", "_converters")
+
+    def __init__(self, raw, known, converters):
+        """
+        :param raw: the text of the entry
+        :param known: the keys to expose; others in the text are ignored
+        :param converters: mapping of key to a callable converting the raw
+            string value into the value to hand out
+        """
+        self._raw = raw
+        self._known = known
+        self._values = {}
+        self._converters = converters
+
+    def set_converter(self, key, converter):
+        """Set the converter for key; it must not have been accessed yet."""
+        self._converters = dict(self._converters)
+        self._converters[key] = converter
+
+    def _locate(self, key):
+        # last assignment wins, as it does for a line based parse.
+        raw = self._raw
+        prefix = "%s=" % (key,)
+        start = raw.rfind("\n" + prefix)
+        if start != -1:
+            return start + len(prefix) + 1
+        if raw.startswith(prefix):
+            return len(prefix)
+        return -1
+
+    def __getitem__(self, key):
+        value = self._values.get(key, _missing)
+        if value is _missing:
+            if key not in self._known:
+                raise KeyError(key)
+            start = self._locate(key)
+            if start == -1:
+                raise KeyError(key)
+            end = self._raw.find("\n", start)
+            if end == -1:
+                end = len(self._raw)
+            value = self._raw[start:end].rstrip()
+            converter = self._converters.get(key)
+            if converter is not None:
+                value = converter(value)
+            self._values[key] = value
+        elif value is _deleted:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        value = self._values.get(key, _missing)
+        if value is _missing:
+            return key in self._known and self._locate(key) != -1
+        return value is not _deleted
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._values[key] = _deleted
+
+    def iterkeys(self):
+        keys = set()
+        known = self._known
+        for line in self._raw.split("\n"):
+            key = line.lstrip().split("=", 1)[0]
+            if key in known and key not in keys and "=" in line:
+                keys.add(key)
+        for key, value in self._values.iteritems():
+            if value is _deleted:
+                keys.discard(key)
+            else:
+                keys.add(key)
+        return iter(keys)
+
+    def __len__(self):
+        return len(list(self.iterkeys()))
+
+
+def parse_entry(raw, known_keys, converters=None):
+    """
+    parse an entry in the key=value form :obj:`database` stores
+
+    :param raw: the text of the entry
+    :param known_keys: the keys to expose; others in the text are ignored
+    :param converters: optional mapping of key to a callable converting the
+        raw string value into the value to hand out
+    :return: mapping of the entry's keys to their values; values are
+        decoded on first access, and converters for keys not yet accessed
+        can be added via its set_converter method
+    """
+    if converters is None:
+        converters = {}
+    return _lazy_entry(raw, known_keys, converters)
+
 
 class database(fs_template.FsBased):
 
@@ -32,10 +242,75 @@ class database(fs_template.FsBased):
     autocommits = True
     mtime_in_entry = True
     eclass_chf_types = ('eclassdir', 'mtime')
+    # if True, entry files are read whole and decoded via _decode_entry-
+    # by default into lazily decoded mappings.  Derivatives with a line
+    # based format of their own must disable this.
+    lazy_entries = True
+    # derivatives that don't write entries via _write_entry must disable this.
+    supports_write_behind = True
+    _write_behind = None
+    # exceptions of failed write-behind writes, raised by commit.
+    _write_failures = ()
+
+    def set_write_behind(self, queue_size=0):
+        """Control whether entries are written out by a background thread.
+
+        While enabled, stores only queue the entry (blocking while queue_size
+        entries are already waiting), and a writer thread writes and renames
+        them into place; queued entries remain visible to lookups.  Commits,
+        deletions and walking the keys wait for the queue to drain.  Writes
+        that failed are raised by the next :obj:`commit`; the first failure,
+        with the rest logged.
+
+        :param queue_size: maximum number of queued entries; if 0, any queued
+            entries are written out and write-behind is disabled.
+        """
+        global _write_behind_caches
+        if self._write_behind is not None:
+            writer, self._write_behind = self._write_behind, None
+            self._add_write_failures(writer.stop())
+            _write_behind_caches.discard(self)
+        if queue_size and self.supports_write_behind and not self.readonly:
+            if _write_behind_caches is None:
+                _write_behind_caches = weakref.WeakSet()
+                atexit.register(_flush_write_behind_caches)
+            self._write_behind = _background_writer(self._write_batch,
+                                                    queue_size)
+            _write_behind_caches.add(self)
+
+    def _add_write_failures(self, failures):
+        if failures:
+            self._write_failures = tuple(self._write_failures) + tuple(failures)
+
+    def _pop_write_failures(self):
+        failures, self._write_failures = self._write_failures, ()
+        return failures
+
+    def _flush_writes(self):
+        if self._write_behind is not None:
+            self._add_write_failures(self._write_behind.flush())
+
+    def commit(self, force=False):
+        self._flush_writes()
+        failures = self._pop_write_failures()
+        if failures:
+            for e in failures[1:]:
+                logger.error("cache write-behind failed: %s" % (e,))
+            raise failures[0]
+        super(database, self).commit(force=force)
 
     def _getitem(self, cpv):
+        if self._write_behind is not None:
+            values = self._write_behind.get_pending(cpv)
+            if values is not None:
+                d = self._cdict_kls((k, v) for k, v in values.iteritems()
+                                    if k in self._known_keys)
+                d[self._chf_key] = self._chf_deserializer(d[self._chf_key])
+                return d
         path = pjoin(self.location, cpv)
         try:
+            if self.lazy_entries:
+                return self._read_raw_entry(path, cpv)
             data = readlines_ascii(path, True, True, True)
             if data is None:
                 raise KeyError(cpv)
@@ -43,6 +318,60 @@ class database(fs_template.FsBased):
         except (EnvironmentError, ValueError) as e:
             raise_from(errors.CacheCorruption(cpv, e))
 
+    def _read_raw_entry(self, path, cpv):
+        try:
+            f = open(path, 'r')
+        except EnvironmentError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                raise KeyError(cpv)
+            raise
+        with f:
+            raw = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime
+        return self._decode_entry(raw, mtime)
+
+    def _decode_entry(self, raw, mtime):
+        d = _lazy_entry(raw, self._known_keys, {})
+        # the chf is always needed for validation; decode it now, so any
+        # corruption is reported when the entry is read.
+        if self._mtime_used and not self.mtime_in_entry:
+            d[self._chf_key] = long(mtime)
+        else:
+            d[self._chf_key] = self._chf_deserializer(d[self._chf_key])
+        return d
+
+    def _convert_entry(self, cpv, d):
+        if isinstance(d, _lazy_entry):
+            if "_eclasses_" in d:
+                d.set_converter("_eclasses_",
+                    partial(self.reconstruct_eclasses, cpv))
+            return d
+        return super(database, self)._convert_entry(cpv, d)
+
+    def get_many(self, cpvs):
+        self._flush_writes()
+        # walk the entries in path order, listing each directory once so
+        # missing entries cost nothing beyond that listing.
+        listings = {}
+        wanted = []
+        for cpv in sorted(cpvs):
+            s = cpv.rfind("/") + 1
+            directory = cpv[:s]
+            if directory not in listings:
+                try:
+                    listings[directory] = frozenset(
+                        os.listdir(pjoin(self.location, directory)))
+                except EnvironmentError as e:
+                    if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                        listings[directory] = frozenset()
+                    else:
+                        # let _getitem sort it out per entry.
+                        listings[directory] = None
+            existing = listings[directory]
+            if existing is None or cpv[s:] in existing:
+                wanted.append(cpv)
+        return self._get_many(wanted)
+
     def _parse_data(self, data, mtime):
         d = self._cdict_kls()
         known = self._known_keys
@@ -61,8 +390,36 @@ class database(fs_template.FsBased):
         return d
 
     def _setitem(self, cpv, values):
+        if self._write_behind is None:
+            self._write_entry(cpv, values)
+        else:
+            # the caller is free to modify what it handed us once we
+            # return; snapshot it.
+            self._write_behind.put(cpv, dict(values.iteritems()))
+
+    def _write_batch(self, items):
+        """Write a batch of (cpv, values) pairs for the write-behind thread.
+
+        :return: list of the cache errors writing entries failed with
+        """
+        failures = []
+        known_dirs = set()
+        for cpv, values in items:
+            directory = cpv[:cpv.rfind("/") + 1]
+            if directory not in known_dirs:
+                # creating it up front spares each entry a failed open.
+                self._ensure_dirs(cpv)
+                known_dirs.add(directory)
+            try:
+                self._write_entry(cpv, values)
+            except errors.CacheError as ce:
+                failures.append(ce)
+        return failures
+
+    def _write_entry(self, cpv, values):
         # might seem weird, but we rely on the trailing +1; this
         # makes it behave properly for any cache depth (including no depth)
+        data = self._format_entry(values)
         s = cpv.rfind("/") + 1
         fp = pjoin(self.location,
             cpv[:s], ".update.%i.%s" % (os.getpid(), cpv[s:]))
@@ -85,9 +442,7 @@ class database(fs_template.FsBased):
         if self._mtime_used:
             if not self.mtime_in_entry:
                 mtime = values['_mtime_']
-        for k, v in values.iteritems():
-            myf.writelines("%s=%s\n" % (k, v))
-
+        myf.write(data)
         myf.close()
         if self._mtime_used and not self.mtime_in_entry:
             self._ensure_access(fp, mtime=mtime)
@@ -103,7 +458,11 @@ class database(fs_template.FsBased):
             os.remove(fp)
             raise_from(errors.CacheCorruption(cpv, e))
 
+    def _format_entry(self, values):
+        return ''.join("%s=%s\n" % (k, v) for k, v in values.iteritems())
+
     def _delitem(self, cpv):
+        self._flush_writes()
         try:
             os.remove(pjoin(self.location, cpv))
         except OSError as e:
@@ -113,16 +472,29 @@ class database(fs_template.FsBased):
                 raise_from(errors.CacheCorruption(cpv, e))
 
     def __contains__(self, cpv):
+        if (self._write_behind is not None and
+                self._write_behind.get_pending(cpv) is not None):
+            return True
         return os.path.exists(pjoin(self.location, cpv))
 
     def iterkeys(self):
         """generator for walking the dir struct"""
+        self._flush_writes()
         dirs = [self.location]
         len_base = len(self.location)
+        try:
+            os.stat(self.location)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # nothing's been written yet.
+            return
         while dirs:
             d = dirs.pop(0)
             for l in os.listdir(d):
-                if l.endswith(".cpickle"):
+                # dotfiles are the indexes stored alongside the entries
+                # (and their temp files while being written).
+                if l.endswith(".cpickle") or l.startswith("."):
                     continue
                 p = pjoin(d, l)
                 st = os.lstat(p)
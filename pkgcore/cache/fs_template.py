@@ -8,18 +8,40 @@ template for fs based backends
 __all__ = ("FsBased",)
 
 import os
-from pkgcore.cache import base
+from pkgcore.cache import base, _stored_index
 from pkgcore.os_data import portage_gid
 from snakeoil.osutils import ensure_dirs, pjoin
 
 
+class _fs_index(_stored_index):
+
+    """:obj:`_stored_index` kept in the cache directory"""
+
+    def __init__(self, ensure_access, *args, **kwds):
+        _stored_index.__init__(self, *args, **kwds)
+        self._ensure_access = ensure_access
+
+    def _write(self):
+        _stored_index._write(self)
+        self._ensure_access(self.path)
+
+
 class FsBased(base):
     """Template wrapping fs needed options.
 
     Provides _ensure_access as a way to attempt to ensure files have
     the specified owners/perms.
+
+    The reverse eclass index is stored in the cache directory; a line of the
+    ebuild chfs of every entry, then one line per eclass and set of chfs,
+    listing the cpvs whose entries recorded them.  The reverse dependency
+    index is stored beside it.  Readonly caches don't store either, so
+    processes using them build them via a scan of every entry.
     """
 
+    eclass_index_name = '.eclass_index'
+    revdep_index_name = '.revdep_index'
+
     def __init__(self, location, label=None, **config):
         """
         throws InitializationError if needs args aren't specified
@@ -72,3 +94,10 @@ class FsBased(base):
         else:
             path = self.location
         return ensure_dirs(path, mode=0775, minimal=False)
+
+    def _make_index(self, name, index_kls, indexer, header):
+        if name is None:
+            return base._make_index(self, name, index_kls, indexer, header)
+        return _fs_index(self._ensure_access, index_kls, indexer,
+                         self._getitem, header, pjoin(self.location, name),
+                         readonly=self.readonly)
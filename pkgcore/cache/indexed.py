@@ -0,0 +1,325 @@
+# License: GPL2/BSD
+
+"""
+single file backend with a sorted, mmap'able offset index
+
+Every entry is appended to one data file in the same key=value form
+:obj:`pkgcore.cache.flat_hash.database` uses; a sorted cpv -> (offset, length)
+index is kept alongside it.  Both files are memory mapped on first access,
+so a lookup is a binary search of the index followed by a single slice of
+the data file- no per package open/read/close, and no directory walk for
+:meth:`database.iterkeys`.
+
+Updates are appended to the data file immediately, but only become visible
+to other readers once :meth:`database.commit` atomically replaces the index.
+The data file is named after the index generation; when enough of it is
+unreferenced, commit writes a compacted copy under the next generation and
+points the new index at it, so readers holding the old mapping are never
+handed offsets into a file they don't know about.  The superseded data file
+is only removed by the compaction after that, since readers may have mapped
+the old index without yet opening its data file.
+
+Note this backend assumes a single writer per location.
+"""
+
+__all__ = ("database", "md5_cache")
+
+import errno
+import mmap
+import os
+import struct
+
+from pkgcore.cache import flat_hash, errors
+from pkgcore.config import ConfigHint
+from snakeoil.compatibility import raise_from
+from snakeoil.fileutils import AtomicWriteFile
+from snakeoil.osutils import pjoin
+
+_index_magic = 'pkgcore-cache-index-1\n'
+# generation, record count
+_header = struct.Struct('<II')
+# key offset, key length, data offset, data length
+_record = struct.Struct('<IIQI')
+_records_start = len(_index_magic) + _header.size
+
+
+def _map_file(path):
+    """mmap the given path read-only; returns None for missing/empty files."""
+    try:
+        f = open(path, 'rb')
+    except EnvironmentError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    try:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+
+class database(flat_hash.database):
+
+    """
+    stores all cache entries in a single data file, addressed via a sorted
+    offset index
+    """
+
+    pkgcore_config_type = ConfigHint(
+        {'readonly': 'bool', 'location': 'str', 'label': 'str',
+         'auxdbkeys': 'list'},
+        required=['location'],
+        positional=['location'],
+        typename='cache')
+
+    autocommits = False
+    default_sync_rate = 1000
+    # appends are cheap enough as is.
+    supports_write_behind = False
+    index_name = 'index'
+    # fraction of the data file allowed to be unreferenced before commit
+    # rewrites it.
+    compaction_threshold = 0.5
+
+    def __init__(self, *args, **config):
+        super(database, self).__init__(*args, **config)
+        self._index_path = pjoin(self.location, self.index_name)
+        # cpv -> (offset, length) for appended entries, None for deletions.
+        self._pending = {}
+        self._append_handle = None
+        self._index_map = self._data_map = None
+        self._generation = self._count = self._keys_start = None
+
+    def _data_path(self, generation):
+        return pjoin(self.location, "data.%i" % (generation,))
+
+    def _load_index(self):
+        if self._count is not None:
+            return
+        index_map = _map_file(self._index_path)
+        if index_map is None:
+            generation, count, keys_start = 0, 0, _records_start
+        else:
+            if index_map[:len(_index_magic)] != _index_magic:
+                raise errors.GeneralCacheCorruption(
+                    "%s isn't a pkgcore cache index" % (self._index_path,))
+            generation, count = _header.unpack_from(
+                index_map, len(_index_magic))
+            keys_start = _records_start + count * _record.size
+        self._index_map = index_map
+        self._generation, self._count = generation, count
+        self._keys_start = keys_start
+
+    def _get_data_map(self):
+        if self._data_map is None:
+            self._load_index()
+            self._data_map = _map_file(self._data_path(self._generation))
+            if self._data_map is None:
+                self._data_map = ''
+        return self._data_map
+
+    def _reset_maps(self):
+        for m in (self._index_map, self._data_map):
+            if m:
+                m.close()
+        self._index_map = self._data_map = None
+        self._generation = self._count = self._keys_start = None
+
+    def _iter_records(self):
+        self._load_index()
+        index_map, keys_start = self._index_map, self._keys_start
+        unpack = _record.unpack_from
+        for pos in xrange(_records_start,
+                          _records_start + self._count * _record.size,
+                          _record.size):
+            key_offset, key_len, offset, length = unpack(index_map, pos)
+            key_offset += keys_start
+            yield index_map[key_offset:key_offset + key_len], offset, length
+
+    def _lookup(self, cpv):
+        self._load_index()
+        index_map, keys_start = self._index_map, self._keys_start
+        unpack = _record.unpack_from
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_offset, key_len, offset, length = unpack(
+                index_map, _records_start + mid * _record.size)
+            key_offset += keys_start
+            key = index_map[key_offset:key_offset + key_len]
+            if key < cpv:
+                lo = mid + 1
+            elif key > cpv:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def _locate(self, cpv):
+        if cpv in self._pending:
+            return self._pending[cpv]
+        return self._lookup(cpv)
+
+    def _read_entry(self, cpv, offset, length):
+        if cpv in self._pending:
+            # not in the mapped generation yet; pull it from the file
+            # we're appending to.
+            with open(self._data_path(self._generation), 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+        else:
+            data = self._get_data_map()[offset:offset + length]
+        if len(data) != length:
+            raise errors.CacheCorruption(
+                cpv, "data file truncated; expected %i bytes at offset %i" %
+                (length, offset))
+        return data
+
+    def get_many(self, cpvs):
+        # sorted, so the index and data file are walked in order.
+        return self._get_many(sorted(cpvs))
+
+    def _getitem(self, cpv):
+        loc = self._locate(cpv)
+        if loc is None:
+            raise KeyError(cpv)
+        try:
+            data = self._read_entry(cpv, *loc)
+            if self.lazy_entries:
+                return self._decode_entry(data, None)
+            return self._parse_data(data.splitlines(), None)
+        except (EnvironmentError, ValueError) as e:
+            raise_from(errors.CacheCorruption(cpv, e))
+
+    def _get_append_handle(self):
+        if self._append_handle is None:
+            self._load_index()
+            path = self._data_path(self._generation)
+            try:
+                handle = open(path, 'ab')
+            except EnvironmentError as e:
+                if e.errno != errno.ENOENT or not self._ensure_dirs():
+                    raise_from(errors.GeneralCacheCorruption(
+                        "failed opening %r for appending: %s" % (path, e)))
+                handle = open(path, 'ab')
+                self._ensure_access(path)
+            # append mode doesn't position us at the end till the first write.
+            handle.seek(0, os.SEEK_END)
+            self._append_handle = handle
+        return self._append_handle
+
+    def _setitem(self, cpv, values):
+        data = self._format_entry(values)
+        handle = self._get_append_handle()
+        offset = handle.tell()
+        try:
+            handle.write(data)
+            handle.flush()
+        except EnvironmentError as e:
+            raise_from(errors.CacheCorruption(cpv, e))
+        self._pending[cpv] = (offset, len(data))
+
+    def _delitem(self, cpv):
+        if self._locate(cpv) is None:
+            raise KeyError(cpv)
+        self._pending[cpv] = None
+
+    def __contains__(self, cpv):
+        return self._locate(cpv) is not None
+
+    def iterkeys(self):
+        # snapshot; callers are allowed to delete while walking the keys.
+        pending = self._pending
+        keys = [key for key, offset, length in self._iter_records()
+                if key not in pending]
+        keys.extend(key for key, loc in pending.iteritems() if loc is not None)
+        return iter(keys)
+
+    def commit(self, force=False):
+        if not self._pending and not force:
+            self._commit_indexes()
+            return
+        if self._append_handle is not None:
+            self._append_handle.close()
+            self._append_handle = None
+
+        self._load_index()
+        generation = self._generation
+        entries = dict((key, (offset, length))
+                       for key, offset, length in self._iter_records())
+        entries.update(self._pending)
+        entries = sorted((key, loc) for key, loc in entries.iteritems()
+                         if loc is not None)
+
+        data_path = self._data_path(generation)
+        try:
+            data_size = os.stat(data_path).st_size
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            data_size = 0
+        live = sum(length for key, (offset, length) in entries)
+        stale_path = None
+        if data_size and data_size - live > data_size * self.compaction_threshold:
+            entries = self._compact(entries, data_path, generation + 1)
+            generation += 1
+            # data_path is left for readers of the index being replaced;
+            # the generation it superseded can go.
+            if generation > 1:
+                stale_path = self._data_path(generation - 2)
+
+        if not self._ensure_dirs():
+            raise errors.GeneralCacheCorruption(
+                "failed creating cache directory %r" % (self.location,))
+        records, keys, key_offset = [], [], 0
+        for key, (offset, length) in entries:
+            records.append(_record.pack(key_offset, len(key), offset, length))
+            keys.append(key)
+            key_offset += len(key)
+        f = AtomicWriteFile(self._index_path, binary=True)
+        try:
+            f.write(_index_magic)
+            f.write(_header.pack(generation, len(entries)))
+            f.write(''.join(records))
+            f.write(''.join(keys))
+        except:
+            f.discard()
+            raise
+        f.close()
+        self._ensure_access(self._index_path)
+
+        self._reset_maps()
+        self._pending.clear()
+        if stale_path is not None:
+            try:
+                os.unlink(stale_path)
+            except EnvironmentError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        self._commit_indexes()
+
+    def _compact(self, entries, source_path, generation):
+        """write live entries into a fresh data file for ``generation``
+
+        :return: sequence of (key, (offset, length)) into the new file
+        """
+        target_path = self._data_path(generation)
+        new_entries = []
+        with open(source_path, 'rb') as source:
+            with open(target_path, 'wb') as target:
+                pos = 0
+                for key, (offset, length) in entries:
+                    source.seek(offset)
+                    target.write(source.read(length))
+                    new_entries.append((key, (pos, length)))
+                    pos += length
+        self._ensure_access(target_path)
+        return new_entries
+
+
+class md5_cache(database):
+
+    chf_type = 'md5'
+    eclass_chf_types = ('md5',)
+    chf_base = 16
@@ -55,6 +55,7 @@ class database(flat_hash.database):
     magic_line_count = 22
 
     autocommits = True
+    lazy_entries = False
 
     def __init__(self, location, *args, **config):
         self.ec = config.pop("eclasses", None)
@@ -91,7 +92,7 @@ class database(flat_hash.database):
             d["_mtime_"] = long(mtime)
         return d
 
-    def _setitem(self, cpv, values):
+    def _write_entry(self, cpv, values):
         values = ProtectedDict(values)
 
         # hack. proper solution is to make this a __setitem__ override, since
@@ -0,0 +1,451 @@
+# License: GPL2/BSD
+
+"""
+cache shared between processes via a local daemon
+
+:obj:`server` loads entries from a cache once and serves them over a unix
+socket; :obj:`database` is the (readonly) cache backend clients use to talk
+to it, so any number of processes share one copy of the entries rather than
+each reading and parsing the cache files themselves.
+
+The protocol is line based; a request is a command, optionally followed by
+space separated arguments, terminated by a newline::
+
+    info                    chf type and eclass chf types of the cache
+    get <cpv> [<cpv> ...]   entries for the given cpvs; missing ones are
+                            left out of the response
+    keys                    all cpvs in the cache
+    eclass-index            the reverse eclass index; see
+                            :obj:`pkgcore.cache.base.eclass_consumers`
+    revdep-index            the reverse dependency index; see
+                            :obj:`pkgcore.cache.base.revdeps`
+
+A response is a status line of ``ok <length>`` or ``error <length>``,
+followed by that many bytes of payload.  Entries are sent as a series of
+``<cpv> <length>\\n<data>`` records, data being in the key=value form
+:obj:`pkgcore.cache.flat_hash.database` uses.
+
+Invalidation relies on cache writers renaming entries into place (as all
+pkgcore's fs backends do): the server periodically checks the mtime of each
+directory it has served entries from, and drops what it holds for any that
+changed.  Between checks, entries are served as they were when loaded, so a
+client may be handed entries up to :obj:`server.check_interval` seconds
+stale; since clients validate entries against the ebuilds and eclasses
+anyway, a stale entry results in a regen rather than bad metadata.
+
+Only keys of the form ``category/package-version`` are looked up; anything
+else (paths escaping the cache location in particular) is rejected.
+"""
+
+__all__ = ("server", "serve", "database")
+
+import errno
+import os
+import socket
+
+from pkgcore.cache import base, errors, flat_hash, _stored_index
+from pkgcore.config import ConfigHint
+from pkgcore.ebuild.cpv import versioned_CPV
+from pkgcore.ebuild.errors import InvalidCPV
+from snakeoil.compatibility import raise_from
+from snakeoil.currying import partial
+from snakeoil.osutils import pjoin
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'SocketServer',
+    'threading',
+    'pkgcore.log:logger',
+)
+
+
+def _read_response(f):
+    header = f.readline()
+    try:
+        status, length = header.split()
+        length = int(length)
+    except ValueError:
+        raise errors.GeneralCacheCorruption(
+            "invalid response from cache server: %r" % (header,))
+    payload = f.read(length)
+    if len(payload) != length:
+        raise errors.GeneralCacheCorruption(
+            "truncated response from cache server")
+    if status != 'ok':
+        raise errors.GeneralCacheCorruption(
+            "cache server error: %s" % (payload,))
+    return payload
+
+
+def _iter_records(payload):
+    pos, end = 0, len(payload)
+    while pos < end:
+        header_end = payload.index("\n", pos)
+        name, length = payload[pos:header_end].split()
+        pos = header_end + 1 + int(length)
+        yield name, payload[header_end + 1:pos]
+
+
+def _validate_cpv(cpv):
+    """raise ValueError unless cpv is a plain category/package-version key"""
+    category, sep, pkg = cpv.partition("/")
+    if not category or not pkg or "/" in pkg or ".." in cpv:
+        raise ValueError("invalid cpv %r" % (cpv,))
+    try:
+        versioned_CPV(cpv)
+    except InvalidCPV:
+        raise ValueError("invalid cpv %r" % (cpv,))
+
+
+def _is_valid_cpv(cpv):
+    try:
+        _validate_cpv(cpv)
+    except ValueError:
+        return False
+    return True
+
+
+class server(object):
+
+    """
+    serve entries of a cache to :obj:`database` clients
+
+    :ivar check_interval: seconds between checks for changed cache
+        directories; entries may be served this stale.
+    """
+
+    check_interval = 5.0
+
+    def __init__(self, cache, path, check_interval=None):
+        """
+        :param cache: :obj:`pkgcore.cache.base` derivative to serve from
+        :param path: path of the unix socket to listen on
+        """
+        self.cache = cache
+        self.path = path
+        if check_interval is not None:
+            self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # cpv -> serialized entry, None for missing entries.
+        self._entries = {}
+        self._keys = self._eclass_index = self._revdep_index = None
+        # directory -> mtime when we started serving entries from it.
+        self._dir_mtimes = {}
+        # bumped by check() on changes; anything loaded across a bump may
+        # be stale, and isn't stored.
+        self._generation = 0
+        self._location = getattr(cache, 'location', None)
+        self._stopped = threading.Event()
+        self._server = None
+
+    def _stat_dir(self, directory):
+        try:
+            return os.stat(pjoin(self._location, directory)).st_mtime
+        except EnvironmentError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            return None
+
+    def _track_dir(self, directory):
+        if self._location is not None and directory not in self._dir_mtimes:
+            self._dir_mtimes[directory] = self._stat_dir(directory)
+
+    def check(self):
+        """Drop anything held for cache directories changed since loaded."""
+        if self._location is None:
+            return
+        with self._lock:
+            generation = self._generation
+            for directory, mtime in self._dir_mtimes.items():
+                if self._stat_dir(directory) == mtime:
+                    continue
+                del self._dir_mtimes[directory]
+                self._generation += 1
+                # the key listing, and so the indexes, are
+                # invalidated by any change.
+                self._keys = self._eclass_index = self._revdep_index = None
+                if directory:
+                    prefix = directory + "/"
+                    for cpv in [x for x in self._entries
+                                if x.startswith(prefix)]:
+                        del self._entries[cpv]
+            if generation != self._generation:
+                # the cache holds its own copies of the indexes.
+                self.cache.invalidate_indexes()
+
+    def _serialize(self, cpv):
+        return ''.join("%s=%s\n" % x for x in
+                       self.cache.get_serialized_entry(cpv).iteritems())
+
+    def _get_entry(self, cpv):
+        try:
+            return self._entries[cpv]
+        except KeyError:
+            pass
+        with self._lock:
+            self._track_dir(cpv.rpartition("/")[0])
+            generation = self._generation
+        try:
+            data = self._serialize(cpv)
+        except KeyError:
+            data = None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[cpv] = data
+        return data
+
+    def _cmd_info(self):
+        return "%s\n%s\n" % (self.cache.chf_type,
+                             ' '.join(self.cache.eclass_chf_types))
+
+    def _cmd_get(self, *cpvs):
+        # checked up front; these are used as paths.
+        for cpv in cpvs:
+            _validate_cpv(cpv)
+        l = []
+        for cpv in cpvs:
+            data = self._get_entry(cpv)
+            if data is not None:
+                l.append("%s %i\n%s" % (cpv, len(data), data))
+        return ''.join(l)
+
+    def _cmd_keys(self):
+        keys = self._keys
+        if keys is None:
+            with self._lock:
+                self._track_dir('')
+                generation = self._generation
+            keys = list(self.cache.iterkeys())
+            with self._lock:
+                # the listing covers every directory.
+                for cpv in keys:
+                    self._track_dir(cpv.rpartition("/")[0])
+                keys = ''.join("%s\n" % x for x in keys)
+                if generation == self._generation:
+                    self._keys = keys
+        return keys
+
+    def _get_index(self, attr, get_index):
+        index = getattr(self, attr)
+        if index is None:
+            with self._lock:
+                generation = self._generation
+            # tracks every directory the index is built from.
+            self._cmd_keys()
+            index = ''.join(get_index().iterlines())
+            with self._lock:
+                if generation == self._generation:
+                    setattr(self, attr, index)
+                else:
+                    # built across a change; the cache's copy is as stale.
+                    self.cache.invalidate_indexes()
+        return index
+
+    def _cmd_eclass_index(self):
+        return self._get_index('_eclass_index', self.cache.eclass_index)
+
+    def _cmd_revdep_index(self):
+        return self._get_index('_revdep_index', self.cache.revdep_index)
+
+    def handle_request(self, line):
+        """Return the response for a single request line."""
+        args = line.split()
+        if not args:
+            return "error 13\nempty request"
+        handler = getattr(self, '_cmd_%s' % (args[0].replace('-', '_'),),
+                          None)
+        try:
+            if handler is None:
+                raise ValueError("unknown command %r" % (args[0],))
+            payload = handler(*args[1:])
+        except Exception as e:
+            msg = "%s: %s" % (e.__class__.__name__, e)
+            logger.warning("cache server: failed handling %r: %s" %
+                           (line, msg))
+            return "error %i\n%s" % (len(msg), msg)
+        return "ok %i\n%s" % (len(payload), payload)
+
+    def _watch(self):
+        while not self._stopped.wait(self.check_interval):
+            try:
+                self.check()
+            except EnvironmentError as e:
+                logger.warning("cache server: invalidation check failed: %s" %
+                               (e,))
+
+    def serve_forever(self):
+        """Listen on the socket, serving clients until :obj:`stop` is called."""
+        server = self
+
+        class handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                for line in iter(self.rfile.readline, ''):
+                    self.wfile.write(server.handle_request(line))
+                    self.wfile.flush()
+
+        class socket_server(SocketServer.ThreadingMixIn,
+                            SocketServer.UnixStreamServer):
+            daemon_threads = True
+
+        try:
+            os.unlink(self.path)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self._server = socket_server(self.path, handler)
+        watcher = threading.Thread(target=self._watch,
+                                   name="cache server watcher")
+        watcher.daemon = True
+        watcher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stopped.set()
+            self._server.server_close()
+            try:
+                os.unlink(self.path)
+            except EnvironmentError:
+                pass
+
+    def stop(self):
+        """Stop :obj:`serve_forever`; call this from another thread."""
+        self._server.shutdown()
+
+
+def serve(cache, path, check_interval=None):
+    """Serve the given cache on path till interrupted; see :obj:`server`."""
+    server(cache, path, check_interval=check_interval).serve_forever()
+
+
+class _remote_index(_stored_index):
+
+    """:obj:`pkgcore.cache._stored_index` fetched from the server"""
+
+    def __init__(self, query, *args, **kwds):
+        _stored_index.__init__(self, *args, **kwds)
+        self._query = query
+
+    def _read(self):
+        return self.index_kls.from_lines(self._query().splitlines())
+
+
+class database(base):
+
+    """
+    readonly cache backend, pulling entries from a :obj:`server`
+
+    The chf types are those of the cache the server is serving.
+    """
+
+    pkgcore_config_type = ConfigHint(
+        {'location': 'str', 'label': 'str', 'auxdbkeys': 'list'},
+        required=['location'],
+        positional=['location'],
+        typename='cache')
+
+    autocommits = True
+    # the server commands the indexes are fetched by.
+    eclass_index_name = 'eclass-index'
+    revdep_index_name = 'revdep-index'
+
+    def __init__(self, location, label=None, auxdbkeys=None, readonly=True):
+        """
+        :param location: path of the server's socket
+        :param label: unused, accepted for compatibility with other backends
+        """
+        self.location = location
+        self._sock = self._file = None
+        self._lock = threading.Lock()
+        try:
+            info = self._request("info").split("\n")
+        except EnvironmentError as e:
+            raise_from(errors.InitializationError(self.__class__, e))
+        self.chf_type = info[0]
+        self.eclass_chf_types = tuple(info[1].split())
+        base.__init__(self, auxdbkeys=auxdbkeys, readonly=True)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.location)
+        except:
+            sock.close()
+            raise
+        self._sock, self._file = sock, sock.makefile('rb')
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def _request(self, *args):
+        request = "%s\n" % (' '.join(args),)
+        with self._lock:
+            for attempt in (True, False):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(request)
+                    return _read_response(self._file)
+                except EnvironmentError:
+                    # the server may have been restarted; reconnect once.
+                    self._disconnect()
+                    if not attempt:
+                        raise
+                except errors.CacheError:
+                    self._disconnect()
+                    raise
+
+    def _query(self, *args):
+        try:
+            return self._request(*args)
+        except EnvironmentError as e:
+            raise_from(errors.GeneralCacheCorruption(
+                "failed talking to cache server %r: %s" % (self.location, e)))
+
+    def _make_entry(self, raw):
+        d = flat_hash.parse_entry(raw, self._known_keys)
+        d[self._chf_key] = self._chf_deserializer(d[self._chf_key])
+        return d
+
+    def _getitem(self, cpv):
+        if not _is_valid_cpv(cpv):
+            # the server would refuse it; it can't be in the cache anyway.
+            raise KeyError(cpv)
+        for name, raw in _iter_records(self._query("get", cpv)):
+            return self._make_entry(raw)
+        raise KeyError(cpv)
+
+    def _convert_entry(self, cpv, d):
+        if "_eclasses_" in d:
+            d.set_converter("_eclasses_",
+                partial(self.reconstruct_eclasses, cpv))
+        return d
+
+    def get_many(self, cpvs):
+        cpvs = [x for x in cpvs if _is_valid_cpv(x)]
+        d = {}
+        # keep requests to a sane size.
+        for start in xrange(0, len(cpvs), 256):
+            for cpv, raw in _iter_records(
+                    self._query("get", *cpvs[start:start + 256])):
+                try:
+                    d[cpv] = self._convert_entry(cpv, self._make_entry(raw))
+                except (KeyError, ValueError):
+                    continue
+        return d
+
+    def __contains__(self, cpv):
+        return _is_valid_cpv(cpv) and bool(self._query("get", cpv))
+
+    def iterkeys(self):
+        return iter(self._query("keys").split())
+
+    def _make_index(self, name, index_kls, indexer, header):
+        return _remote_index(partial(self._query, name), index_kls,
+                             indexer, self._getitem, header)
+
+    def close(self):
+        """Drop the connection to the server."""
+        with self._lock:
+            self._disconnect()
@@ -8,6 +8,7 @@
 __all__ = ("CPV", "versioned_CPV", "unversioned_CPV")
 
 from itertools import izip
+import struct
 from snakeoil.compatibility import cmp
 from snakeoil.klass import inject_richcmp_methods_from_cmp
 from pkgcore.ebuild.errors import InvalidCPV
@@ -20,6 +21,7 @@ demandload(globals(), "pkgcore.ebuild:atom")
 demand_compile_regexp(globals(), 'suffix_regexp',
     '^(alpha|beta|rc|pre|p)(\\d*)$')
 suffix_value = {"pre": -2, "p": 1, "alpha": -4, "beta": -3, "rc": -1}
+_ushort = struct.Struct(">H")
 
 # while the package section looks fugly, there is a reason for it-
 # to prevent version chunks from showing up in the package
@@ -59,13 +61,14 @@ class _native_CPV(object):
     :ivar key: strkey (cat/pkg)
     :ivar version: str version
     :ivar revision: int revision
+    :ivar sort_key: sortable key, see :obj:`sort_key`
     :ivar versioned_atom: atom matching this exact version
     :ivar unversioned_atom: atom matching all versions of this package
     :cvar _get_attr: mapping of attr:callable to generate attributes on the fly
     """
 
     __slots__ = ("__weakref__", "cpvstr", "key", "category", "package",
-        "version", "revision", "fullver")
+        "version", "revision", "fullver", "_sort_key")
 
     # if native is being used, forget trying to reuse strings.
     def __init__(self, *a, **kwds):
@@ -162,6 +165,16 @@ class _native_CPV(object):
     def __str__(self):
         return getattr(self, 'cpvstr', 'None')
 
+    @property
+    def sort_key(self):
+        """Sortable key; computed on first access, then cached."""
+        try:
+            return self._sort_key
+        except AttributeError:
+            val = sort_key(self)
+            object.__setattr__(self, '_sort_key', val)
+            return val
+
     def __cmp__(self, other):
         try:
             if self.cpvstr == other.cpvstr:
@@ -301,6 +314,66 @@ def native_ver_cmp(ver1, rev1, ver2, rev2):
     # The revision holds the final difference.
     return cmp(rev1, rev2)
 
+def _pack_num(num):
+    # decimal digits, prefixed by their count.
+    s = str(num) if num else ""
+    return _ushort.pack(len(s)) + s
+
+
+def ver_key(ver, rev):
+    """Sortable key for a version; keys compare as :obj:`ver_cmp` does.
+
+    The key is a byte string, so comparing two is a single memcmp rather
+    than a walk over version components and suffixes.  Layout, which the
+    extension's sort_key mirrors::
+
+        per component   '\\x01', digits sans trailing zeros, '\\x00' if
+                        it has a leading 0 (compared as a string), else
+                        '\\x02', digit count (2 bytes), digits
+        '\\x00'         end of components
+        letter          the letter, or '\\x00'
+        per suffix      suffix value + 5, then its number as a digit count
+                        (2 bytes) and digits; no digits for 0
+        '\\x05\\x00\\x00' terminator, sorting between the negative
+                        suffixes and _p
+        revision        as suffix numbers
+    """
+    if ver is None:
+        return ""
+    parts = ver.split("_")
+    ver_parts = parts[0].split(".")
+    if ver_parts[-1][-1].isalpha():
+        letter = ver_parts[-1][-1]
+        ver_parts[-1] = ver_parts[-1][:-1]
+    else:
+        letter = "\x00"
+    l = []
+    for x in ver_parts:
+        if x[0] == "0":
+            l.append("\x01%s\x00" % (x.rstrip("0"),))
+        else:
+            l.append("\x02" + _ushort.pack(len(x)) + x)
+    l.append("\x00")
+    l.append(letter)
+    for x in parts[1:]:
+        match = suffix_regexp.match(x)
+        l.append(chr(suffix_value[match.group(1)] + 5))
+        l.append(_pack_num(int("0" + match.group(2))))
+    l.append("\x05" + _pack_num(0))
+    l.append(_pack_num(rev))
+    return "".join(l)
+
+
+def sort_key(cpv):
+    """Sortable key for a cpv; keys compare as cpv instances do.
+
+    CPV instances cache this as their sort_key attribute, which is what
+    should be used as a sorted/min/max key where instances are at hand.
+    """
+    return "%s\x00%s\x00%s" % (cpv.category, cpv.package,
+        ver_key(cpv.version, cpv.revision))
+
+
 fake_cat = "fake"
 fake_pkg = "pkg"
 def cpy_ver_cmp(ver1, rev1, ver2, rev2):
@@ -328,6 +401,7 @@ def mk_cpv_cls(base_cls):
         :ivar key: strkey (cat/pkg)
         :ivar version: str version
         :ivar revision: int revision
+        :ivar sort_key: sortable key, see :obj:`sort_key`
         :ivar versioned_atom: atom matching this exact version
         :ivar unversioned_atom: atom matching all versions of this package
         :cvar _get_attr: mapping of attr:callable to generate attributes on the fly
@@ -5,7 +5,7 @@
 ebuild tree manifest/digest support
 """
 
-__all__ = ("serialize_manifest", "parse_manifest", "Manifest")
+__all__ = ("serialize_manifest", "parse_manifest", "Manifest", "ManifestIndex")
 
 from itertools import izip
 import operator
@@ -15,6 +15,7 @@ from snakeoil.chksum import get_handler
 from pkgcore import gpg
 from pkgcore.package import errors
 from pkgcore.fs.livefs import iter_scan
+from pkgcore.util.file_index import FileIndex
 
 from snakeoil.mappings import make_SlottedDict_kls
 from snakeoil.compatibility import raise_from
@@ -22,7 +23,9 @@ from snakeoil.demandload import demandload
 demandload(globals(),
     "snakeoil.lists:iflatten_instance",
     'snakeoil:mappings',
+    'snakeoil.osutils:pjoin',
     "errno",
+    "os",
 )
 
 
@@ -186,3 +189,89 @@ class Manifest(object):
     def distfiles(self):
         self._pull_manifest()
         return self._dist
+
+
+class ManifestIndex(FileIndex):
+
+    """
+    repository wide index of the DIST entries of package Manifests
+
+    Entries are stored per package directory along with the mtime and size
+    of the Manifest they were parsed from, and reparsed only if those
+    change.  The file format is::
+
+        category/package<tab>mtime<tab>size
+        <tab>distfile<tab>size<tab>chf sum ...
+
+    with one line per DIST entry following the line of its package.
+
+    Signatures aren't checked, so trees enforcing gpg shouldn't use this.
+
+    :ivar base: location of the repository
+    """
+
+    magic = 'pkgcore-manifest-index-1'
+    description = 'manifest index'
+
+    def __init__(self, base, path=None, readonly=False):
+        FileIndex.__init__(self, path, readonly)
+        self.base = base
+
+    @property
+    def header(self):
+        return '%s %s' % (self.magic, self.base)
+
+    def _read_entries(self, f):
+        packages = {}
+        distfiles = None
+        for line in f:
+            chunks = line.rstrip('\n').split('\t')
+            if chunks[0]:
+                distfiles = {}
+                packages[tuple(chunks[0].split('/', 1))] = (
+                    float(chunks[1]), long(chunks[2]), distfiles)
+                continue
+            i = iter(chunks[3].split())
+            chksums = [("size", long(chunks[2]))]
+            chksums.extend(convert_chksums(izip(i, i)))
+            distfiles[chunks[1]] = dict(chksums)
+        return packages
+
+    def _stat(self, key):
+        try:
+            st = os.stat(pjoin(self.base, key[0], key[1], 'Manifest'))
+        except EnvironmentError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def distfiles(self, category, package):
+        """
+        :return: mapping of distfile to checksums for a package, or None if
+            its Manifest is missing or unreadable
+        """
+        key = (category, package)
+        st = self._stat(key)
+        if st is None:
+            return None
+        stored = self._entries.get(key)
+        if stored is not None and stored[:2] == st:
+            return stored[2]
+        path = pjoin(self.base, category, package, 'Manifest')
+        try:
+            distfiles = parse_manifest(path)[0]
+        except EnvironmentError:
+            return None
+        self._entries[key] = st + (distfiles,)
+        self._dirty = True
+        return distfiles
+
+    def _write_entries(self, f, cutoff):
+        for key, (mtime, size, distfiles) in sorted(self._entries.iteritems()):
+            if mtime >= cutoff:
+                continue
+            f.write('%s/%s\t%r\t%i\n' % (key[0], key[1], mtime, size))
+            for distfile, chksums in sorted(distfiles.iteritems()):
+                f.write('\t%s\t%i\t%s\n' % (distfile, chksums['size'],
+                    ' '.join('%s %x' % (chf, val)
+                             for chf, val in sorted(chksums.iteritems())
+                             if chf != 'size')))
@@ -329,6 +329,7 @@ __ebd_process_ebuild_phases() {
 		__execute_phases ${phases} &> >(umask 0002; tee -i -a "${PORTAGE_LOGFILE}")
 		ret=$?
 	fi
+	__ebd_report_preload_hits
 
 	if [[ ${ret} -ne 0 ]]; then
 		__ebd_process_sandbox_results
@@ -339,6 +340,13 @@ __ebd_process_ebuild_phases() {
 }
 
 __ebd_process_metadata() {
+	local __data
+	__ebd_read_size "$1" __data
+	__ebd_process_metadata_env "$2"
+}
+
+# Run the given metadata phase against the env held in __data.
+__ebd_process_metadata_env() {
 	# protect the env.
 	# note the local usage is redundant in light of it, but prefer to write it this
 	# way so that if someone ever drops the (), it'll still not bleed out.
@@ -347,9 +355,7 @@ __ebd_process_metadata() {
 	declare -r PKGCORE_QA_SUPPRESSED=false
 	# Wipe __mode; it bleeds from our parent.
 	unset __mode
-	local __data
 	local __ret
-	__ebd_read_size "$1" __data
 	local IFS=$'\0'
 	eval "$__data"
 	__ret=$?
@@ -363,12 +369,71 @@ __ebd_process_metadata() {
 	fi
 
 	PORTAGE_SANDBOX_PID=${PPID}
-	__execute_phases "${2:-depend}" && exit 0
+	local __ret=0
+	__execute_phases "${1:-depend}" || __ret=1
+	__ebd_report_preload_hits
+	[[ ${__ret} -eq 0 ]] && exit 0
 	__ebd_process_sandbox_results
 	exit 1
 	)
 }
 
+# Source the metadata of a batch of ebuilds; $1 is the number of ebuilds,
+# each of whose env follows as a size line and that many bytes.  The envs
+# are all read up front so python never blocks writing them while we're
+# writing results back.  Every ebuild's keys are followed by a
+# 'batch_item <index> succeeded|failed' line.
+__ebd_process_metadata_batch() {
+	local -a __batch
+	local __i __size __data
+	for (( __i=0; __i < $1; __i++ )); do
+		__ebd_read_line __size
+		__ebd_read_size "${__size}" "__batch[${__i}]"
+	done
+	for (( __i=0; __i < $1; __i++ )); do
+		__data=${__batch[${__i}]}
+		if __ebd_process_metadata_env depend; then
+			__ebd_write_line "batch_item ${__i} succeeded"
+		else
+			__ebd_write_line "batch_item ${__i} failed"
+		fi
+	done
+}
+
+# Fork a copy of this daemon, talking to python over the fifos to_child and
+# from_child in a directory; $1 is the size of the directory path, sent
+# next.  This lets python spawn processors from an initialized template
+# rather than going through the full startup for each.
+__ebd_fork_daemon() {
+	local __dir
+	__ebd_read_size "$1" __dir
+	# fork twice, waiting on the first; the copy is then reparented to init,
+	# which reaps it when it exits, rather than left a zombie of ours.
+	(
+		(
+		STARTING_PID=${BASHPID}
+		eval "exec ${PKGCORE_EBD_WRITE_FD}>\"\${__dir}/from_child\"" || exit 1
+		eval "exec ${PKGCORE_EBD_READ_FD}<\"\${__dir}/to_child\"" || exit 1
+		unset __dir
+		# traps aren't inherited by subshells.
+		trap __ebd_sigint_handler SIGINT
+		trap __ebd_sigkill_handler SIGKILL
+		__ebd_write_line "dude!"
+		__ebd_main_loop
+		exit 0
+		) &
+		__ebd_write_line "forked $!"
+	)
+}
+
+# Tell python how many inherits were served from preloaded eclasses, if any.
+__ebd_report_preload_hits() {
+	if [[ -n ${PKGCORE_PRELOAD_HITS} ]]; then
+		__ebd_write_line "preload_hits ${PKGCORE_PRELOAD_HITS}"
+		unset PKGCORE_PRELOAD_HITS
+	fi
+}
+
 __make_preloaded_eclass_func() {
 	eval "__preloaded_eclass_$1() {
 		$2
@@ -416,6 +481,9 @@ __ebd_main_loop() {
 				__ebd_write_line "preload_eclass ${success}"
 				unset e x success
 				;;
+			fork_daemon\ *)
+				__ebd_fork_daemon "${com#fork_daemon }"
+				;;
 			clear_preloaded_eclasses)
 				unset PKGCORE_PRELOADED_ECLASSES
 				declare -A PKGCORE_PRELOADED_ECLASSES
@@ -426,6 +494,10 @@ __ebd_main_loop() {
 				__ebd_read_size "${line}" PKGCORE_METADATA_PATH
 				__ebd_write_line "metadata_path_received"
 				;;
+			gen_metadata_batch\ *)
+				__ebd_process_metadata_batch "${com#gen_metadata_batch }"
+				__ebd_write_line "phases succeeded"
+				;;
 			gen_metadata\ *|gen_ebuild_env\ *)
 				local __mode="depend"
 				[[ ${com} == gen_ebuild_env* ]] && __mode="generate_env"
@@ -28,7 +28,7 @@ from pkgcore.ebuild import processor
 from snakeoil.mappings import IndeterminantDict
 from snakeoil.currying import partial
 from snakeoil import klass
-from snakeoil.compatibility import intern
+from snakeoil.compatibility import intern, IGNORED_EXCEPTIONS
 
 from snakeoil import demandload
 demandload.demandload(globals(),
@@ -297,6 +297,7 @@ class package(base):
 
     maintainers = klass.alias_attr("_shared_pkg_data.metadata_xml.maintainers")
     herds = klass.alias_attr("_shared_pkg_data.metadata_xml.herds")
+    local_use = klass.alias_attr("_shared_pkg_data.metadata_xml.local_use")
     longdescription = klass.alias_attr("_shared_pkg_data.metadata_xml.longdescription")
     manifest = klass.alias_attr("_shared_pkg_data.manifest")
 
@@ -325,6 +326,10 @@ class package_factory(metadata.factory):
         super(package_factory, self).__init__(parent, *args, **kwargs)
         self._cache = cachedb
         self._ecache = eclass_cache
+        # cpvstr -> pkg for the batch registered via prefetch, and the
+        # valid cache entries pulled for it.
+        self._prefetch_batch = {}
+        self._prefetched = {}
 
         if mirrors:
             mirrors = {k: mirror(v, k) for k, v in mirrors.iteritems()}
@@ -345,18 +350,63 @@ class package_factory(metadata.factory):
     def _get_ebuild_mtime(self, pkg):
         return os.stat(self._get_ebuild_path(pkg)).st_mtime
 
+    def prefetch(self, pkgs):
+        """Note that the metadata of pkgs is likely to be needed shortly.
+
+        Nothing is read until the first of them has its metadata pulled; at
+        that point the whole batch is pulled from the caches at once, see
+        :obj:`pkgcore.cache.base.get_many`.  Registering a new batch drops
+        whatever remains of the previous one.
+        """
+        self._prefetch_batch = dict((pkg.cpvstr, pkg) for pkg in pkgs)
+        self._prefetched = {}
+
+    def _load_prefetch_batch(self):
+        remaining, self._prefetch_batch = self._prefetch_batch, {}
+        found = {}
+        for cache in self._cache:
+            if cache is None or not remaining:
+                continue
+            entries = cache.get_many(remaining).items()
+            valid = cache.validate_entries(
+                ((data, chksum.LazilyHashedPath(remaining[cpvstr].path))
+                 for cpvstr, data in entries), self._ecache)
+            for (cpvstr, data), is_valid in zip(entries, valid):
+                if is_valid:
+                    found[cpvstr] = data
+                    del remaining[cpvstr]
+        # anything left over goes through the per package path, which
+        # deals with pruning invalid entries.
+        self._prefetched = found
+
     def _get_metadata(self, pkg, ebp=None, force_regen=False):
-        caches = self._cache
-        if force_regen:
-            caches = ()
+        if not force_regen:
+            data = self._prefetched.pop(pkg.cpvstr, None)
+            if data is None and pkg.cpvstr in self._prefetch_batch:
+                self._load_prefetch_batch()
+                data = self._prefetched.pop(pkg.cpvstr, None)
+            if data is None:
+                data = self._get_cached_metadata(pkg)
+            if data is not None:
+                return data
+
+        # no cache entries, regen
+        return self._update_metadata(pkg, ebp=ebp)
+
+    def _get_cached_metadata(self, pkg, prune=True):
+        """Return the first valid cache entry for pkg, or None.
+
+        :param prune: if True, invalid entries are removed from writable
+            caches as they're encountered.
+        """
         ebuild_hash = chksum.LazilyHashedPath(pkg.path)
-        for cache in caches:
+        for cache in self._cache:
             if cache is not None:
                 try:
                     data = cache[pkg.cpvstr]
                     if cache.validate_entry(data, ebuild_hash, self._ecache):
                         return data
-                    if not cache.readonly:
+                    if prune and not cache.readonly:
                         del cache[pkg.cpvstr]
                 except KeyError:
                     continue
@@ -364,18 +414,77 @@ class package_factory(metadata.factory):
                     logger.warning("caught cache error: %s" % ce)
                     del ce
                     continue
-
-        # no cache entries, regen
-        return self._update_metadata(pkg, ebp=ebp)
+        return None
 
     def _update_metadata(self, pkg, ebp=None):
+        data = self._source_metadata(pkg, ebp=ebp)
+        if data is None:
+            return {'EAPI':pkg.eapi_obj.magic}
+        return self._store_metadata(pkg, *data)
+
+    def _source_metadata(self, pkg, ebp=None):
+        """Source pkg's metadata, without touching the caches.
+
+        :return: None if pkg's eapi is unsupported, else a tuple of
+            (metadata dict, INHERITED string); both are plain strings, thus
+            safe to hand across process boundaries.
+        """
         parsed_eapi = pkg.eapi_obj
         if not parsed_eapi.is_supported:
-            return {'EAPI':parsed_eapi.magic}
+            return None
 
         with processor.reuse_or_request(ebp) as my_proc:
             mydata = my_proc.get_keys(pkg, self._ecache)
+        return self._finalize_sourced_metadata(pkg, mydata)
+
+    def _source_metadata_many(self, pkgs, ebp=None):
+        """Source the metadata of a batch of packages at once.
 
+        The batch is sourced in a single request to the ebuild processor;
+        see :obj:`pkgcore.ebuild.processor.EbuildProcessor.get_keys_many`.
+
+        :return: list of (pkg, data, exception) tuples, in the order of pkgs;
+            data is what :obj:`_source_metadata` would return, exception is
+            set instead for packages that failed.
+        """
+        pkgs = list(pkgs)
+        results = []
+        # indexes into results of the packages to source.
+        supported = []
+        for pkg in pkgs:
+            try:
+                if pkg.eapi_obj.is_supported:
+                    supported.append(len(results))
+                    results.append(None)
+                    continue
+                results.append((pkg, None, None))
+            except IGNORED_EXCEPTIONS:
+                raise
+            except Exception as e:
+                results.append((pkg, None, e))
+        if not supported:
+            return results
+
+        with processor.reuse_or_request(ebp) as my_proc:
+            sourced = my_proc.get_keys_many(
+                [pkgs[i] for i in supported], self._ecache)
+        for i, mydata in zip(supported, sourced):
+            pkg = pkgs[i]
+            if mydata is None:
+                results[i] = (pkg, None, metadata_errors.MetadataException(
+                    pkg, 'data', "failed sourcing metadata"))
+                continue
+            try:
+                results[i] = (
+                    pkg, self._finalize_sourced_metadata(pkg, mydata), None)
+            except IGNORED_EXCEPTIONS:
+                raise
+            except Exception as e:
+                results[i] = (pkg, None, e)
+        return results
+
+    def _finalize_sourced_metadata(self, pkg, mydata):
+        parsed_eapi = pkg.eapi_obj
         inherited = mydata.pop("INHERITED", None)
         # rewrite defined_phases as needed, since we now know the eapi.
         eapi = get_eapi(mydata["EAPI"])
@@ -394,6 +503,19 @@ class package_factory(metadata.factory):
             phases.discard(None)
             mydata["DEFINED_PHASES"] = ' '.join(sorted(phases))
 
+        for x in wipes:
+            del mydata[x]
+
+        return mydata, inherited
+
+    def _store_metadata(self, pkg, mydata, inherited):
+        """Bind eclass/ebuild validation data to freshly sourced metadata,
+        and write it to the first writable cache.
+
+        :param mydata: metadata dict, as returned from :obj:`_source_metadata`
+        :param inherited: INHERITED string, as returned from
+            :obj:`_source_metadata`
+        """
         if inherited:
             mydata["_eclasses_"] = self._ecache.get_eclass_data(
                 inherited.split())
@@ -401,9 +523,6 @@ class package_factory(metadata.factory):
             mydata["_eclasses_"] = {}
         mydata['_chf_'] = chksum.LazilyHashedPath(pkg.path)
 
-        for x in wipes:
-            del mydata[x]
-
         if self._cache is not None:
             for cache in self._cache:
                 if not cache.readonly:
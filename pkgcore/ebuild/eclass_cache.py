@@ -34,11 +34,25 @@ class base(object):
 
     def __init__(self, portdir=None, eclassdir=None):
         self._eclass_data_inst_cache = WeakValCache()
+        # validation key -> rebuild_cache_entry result, valid for the
+        # eclasses mapping it was computed against.
+        self._validated = {}
+        self._validated_generation = None
         # generate this.
         # self.eclasses = {} # {"Name": ("location", "_mtime_")}
         self.portdir = portdir
         self.eclassdir = eclassdir
 
+    def reload(self):
+        """Force a rescan of the available eclasses on next access.
+
+        Anything derived from the prior scan is dropped along with it.
+        """
+        self.__dict__.pop('_eclasses', None)
+        self._eclass_data_inst_cache.clear()
+        self._validated = {}
+        self._validated_generation = None
+
     def get_eclass_data(self, inherits):
         """Return the cachable entries from a list of inherited eclasses.
 
@@ -63,24 +77,40 @@ class base(object):
 
     eclasses = jit_attr_ext_method("_load_eclasses", "_eclasses")
 
-    def rebuild_cache_entry(self, entry_eclasses):
+    def rebuild_cache_entry(self, entry_eclasses, key=None):
         """Check if eclass data is still valid.
 
         Given a dict as returned by get_eclass_data, walk it comparing
         it to internal eclass view.
 
-        :return: a boolean representing whether that eclass data is still
-            up to date, or not
+        :param key: if given, a hashable uniquely identifying entry_eclasses
+            (typically derived from its serialized form); the result is
+            memoized under it until the eclasses are reloaded.
+        :return: None if that eclass data is no longer up to date, else
+            a mapping of eclass to its current data
         """
         ec = self.eclasses
-        d = {}
+        if key is not None:
+            if self._validated_generation is not ec:
+                self._validated = {}
+                self._validated_generation = ec
+            try:
+                return self._validated[key]
+            except KeyError:
+                pass
 
+        d = {}
         for eclass, chksums in entry_eclasses:
             data = ec.get(eclass)
             if any(val != getattr(data, chf, None) for chf, val in chksums):
-                return None
+                d = None
+                break
             d[eclass] = data
+        else:
+            d = ImmutableDict(d)
 
+        if key is not None:
+            self._validated[key] = d
         return d
 
 
@@ -144,5 +174,10 @@ class StackedCaches(base):
         self._caches = caches
         base.__init__(self, **kwds)
 
+    def reload(self):
+        for ec in self._caches:
+            ec.reload()
+        base.reload(self)
+
     def _load_eclasses(self):
         return StackedDict(*[ec.eclasses for ec in self._caches])
@@ -26,24 +26,29 @@ __all__ = (
 
 try:
     import threading
-    _global_ebp_lock = threading.Lock()
-    _acquire_global_ebp_lock = _global_ebp_lock.acquire
-    _release_global_ebp_lock = _global_ebp_lock.release
 except ImportError:
-    def _acquire_global_ebp_lock():
-        pass
+    import dummy_threading as threading
 
-    def _release_global_ebp_lock():
-        pass
+_global_ebp_lock = threading.Lock()
+_acquire_global_ebp_lock = _global_ebp_lock.acquire
+_release_global_ebp_lock = _global_ebp_lock.release
 
+# userpriv -> template processor new processors are forked from.
+_template_processors = {}
+# if True, unsandboxed processors are forked from a template; see
+# _fork_ebuild_processor.  Sandboxed and fakerooted ones are always spawned.
+use_template_processors = True
 
-inactive_ebp_list = []
-active_ebp_list = []
-
+import collections
 import contextlib
 import errno
+import fcntl
+import itertools
 import os
+import shutil
 import signal
+import tempfile
+import time
 
 import pkgcore.spawn
 from pkgcore import const, os_data
@@ -72,26 +77,257 @@ def _single_thread_allowed(functor):
     pretty_docs(_inner, name=functor.__name__)
     return _inner
 
+
+class ProcessorPool(object):
+
+    """
+    processors handed out by :obj:`request_ebuild_processor`
+
+    Idle processors sit in free lists striped by kind (userpriv, sandbox),
+    and within a kind by thread; a thread returns processors to its own
+    stripe and takes from it first, only stealing from the other stripes
+    when it's empty.  Beyond that, each thread remembers the last processor
+    it released, and reclaims it directly if nobody took it meanwhile.
+
+    A processor is claimed via a nonblocking acquire of its claim lock, held
+    for as long as it's handed out, so claims need no pool wide lock.  That
+    lock (the condition below) is only taken when processors are created or
+    discarded, or on release if the pool is bounded.
+
+    :ivar max_size: if set, the most processors kept alive at once, handed
+        out or idle; requests beyond that block till one is released.  Note
+        a thread requesting a processor while holding another can deadlock
+        itself once the limit is reached.
+    """
+
+    def __init__(self, max_size=None, stripes=8):
+        self.max_size = max_size
+        self.stripes = stripes
+        self._reset()
+
+    def _reset(self):
+        # (userpriv, sandbox) -> tuple of (lock, deque of idle processors)
+        self._free = {}
+        self._local = threading.local()
+        self._homes = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+        self._processors = set()
+        # processors alive or being created; bounded by max_size.
+        self._count = 0
+        self._releases = 0
+
+    def __len__(self):
+        return len(self._processors)
+
+    def _home(self):
+        local = self._local
+        try:
+            return local.home
+        except AttributeError:
+            local.home = next(self._homes) % self.stripes
+            return local.home
+
+    def _stripes(self, kind):
+        stripes = self._free.get(kind)
+        if stripes is None:
+            stripes = self._free.setdefault(kind, tuple(
+                (threading.Lock(), collections.deque())
+                for x in xrange(self.stripes)))
+        return stripes
+
+    def _claim_idle(self, userpriv, sandbox):
+        last = getattr(self._local, 'last', None)
+        if (last is not None and last.userprived() == userpriv and
+                (last.sandboxed() or not sandbox) and
+                last._pool_claim.acquire(False)):
+            if last.is_alive:
+                return last
+            self._local.last = None
+            self._discard(last)
+
+        kinds = [(userpriv, sandbox)]
+        if not sandbox:
+            # sandboxed processors are usable for unsandboxed work.
+            kinds.append((userpriv, True))
+        home = self._home()
+        for kind in kinds:
+            stripes = self._free.get(kind, ())
+            for i in xrange(home, home + len(stripes)):
+                lock, idle = stripes[i % len(stripes)]
+                while idle:
+                    with lock:
+                        if not idle:
+                            break
+                        ebp = idle.pop()
+                        ebp._pool_queued = False
+                        claimed = ebp._pool_claim.acquire(False)
+                    # if not claimed, it's been reclaimed by the thread that
+                    # last released it; it's queued again on release.
+                    if claimed:
+                        if ebp.is_alive:
+                            return ebp
+                        self._discard(ebp)
+        return None
+
+    def _evict_idle(self):
+        for stripes in self._free.values():
+            for lock, idle in stripes:
+                while idle:
+                    with lock:
+                        if not idle:
+                            break
+                        ebp = idle.popleft()
+                        ebp._pool_queued = False
+                        claimed = ebp._pool_claim.acquire(False)
+                    if claimed:
+                        self._discard(ebp)
+                        ebp.shutdown_processor()
+                        return True
+        return False
+
+    def _make_idle(self, ebp):
+        ebp._pool_claim.release()
+        lock, idle = self._stripes(
+            (ebp.userprived(), ebp.sandboxed()))[self._home()]
+        with lock:
+            if not ebp._pool_queued:
+                ebp._pool_queued = True
+                idle.append(ebp)
+
+    def _discard(self, ebp):
+        with self._cond:
+            if ebp in self._processors:
+                self._processors.remove(ebp)
+                self._count -= 1
+                self._cond.notify()
+
+    def request(self, userpriv, sandbox, fakeroot, save_file):
+        """
+        claim an idle processor of a compatible kind, spawning one if there
+        are none; see :obj:`request_ebuild_processor`.
+        """
+        userpriv = bool(userpriv)
+        while True:
+            releases = self._releases
+            if not fakeroot:
+                ebp = self._claim_idle(userpriv, sandbox)
+                if ebp is not None:
+                    return ebp
+            with self._cond:
+                if self.max_size is None or self._count < self.max_size:
+                    self._count += 1
+                    break
+            # full; make room by dropping an idle processor of another kind,
+            # else wait for one to be released.
+            if self._evict_idle():
+                continue
+            with self._cond:
+                if releases == self._releases and self._count >= self.max_size:
+                    self._cond.wait()
+
+        try:
+            ebp = _spawn_ebuild_processor(userpriv, sandbox, fakeroot,
+                                          save_file)
+        except:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+        ebp._pool_claim = threading.Lock()
+        ebp._pool_claim.acquire()
+        ebp._pool_queued = False
+        with self._cond:
+            self._processors.add(ebp)
+        return ebp
+
+    def release(self, ebp):
+        """
+        return a processor claimed via :obj:`request`; see
+        :obj:`release_ebuild_processor`.
+        """
+        claim = getattr(ebp, '_pool_claim', None)
+        if claim is None or not claim.locked() or ebp not in self._processors:
+            return False
+
+        # if it's a fakeroot'd process, we throw it away.
+        # it's not useful outside of a chain of calls
+        if ebp.onetime() or ebp.locked:
+            # ok, so the thing is not reusable either way.
+            self._discard(ebp)
+            ebp.shutdown_processor()
+            return True
+
+        if ebp._preloader is not None and ebp._preloader is not _eclass_preloader:
+            # warmed by a preloader that's since been dropped.
+            ebp._preloader = None
+            ebp.clear_preloaded_eclasses()
+        self._local.last = ebp
+        self._make_idle(ebp)
+        if self.max_size is not None:
+            with self._cond:
+                self._releases += 1
+                self._cond.notify()
+        return True
+
+    def iter_idle(self):
+        """
+        yield idle processors, each claimed till the next one is requested
+        """
+        for ebp in list(self._processors):
+            if ebp._pool_claim.acquire(False):
+                try:
+                    yield ebp
+                finally:
+                    self._make_idle(ebp)
+
+    def shutdown(self):
+        """shut down all known processors, including those handed out"""
+        with self._cond:
+            processors = list(self._processors)
+            self._cond.notify_all()
+        # drops the free lists too; nothing should hold onto processors
+        # beyond this.
+        self._reset()
+        for ebp in processors:
+            try:
+                ebp.shutdown_processor(ignore_keyboard_interrupt=True)
+            except EnvironmentError:
+                pass
+
+    def forget(self):
+        """
+        drop all known processors without shutting them down
+
+        Used after forking, where the processors (and the state of the locks
+        guarding them) belong to the parent.
+        """
+        for ebp in list(self._processors):
+            ebp.pid = None
+        self._reset()
+
+
+processor_pool = ProcessorPool()
+
+
 @_single_thread_allowed
 def forget_all_processors():
-    active_ebp_list[:] = []
-    inactive_ebp_list[:] = []
+    # these belong to whoever forked us; make sure they're not shut down
+    # when they fall out of memory.
+    processor_pool.forget()
+    for ebp in _template_processors.values():
+        ebp.pid = None
+    _template_processors.clear()
 
 
 @_single_thread_allowed
 def shutdown_all_processors():
     """kill off all known processors"""
     try:
-        while active_ebp_list:
-            try:
-                active_ebp_list.pop().shutdown_processor(
-                    ignore_keyboard_interrupt=True)
-            except EnvironmentError:
-                pass
+        processor_pool.shutdown()
 
-        while inactive_ebp_list:
+        while _template_processors:
             try:
-                inactive_ebp_list.pop().shutdown_processor(
+                _template_processors.popitem()[1].shutdown_processor(
                     ignore_keyboard_interrupt=True)
             except EnvironmentError:
                 pass
@@ -102,7 +338,6 @@ def shutdown_all_processors():
 
 pkgcore.spawn.atexit_register(shutdown_all_processors)
 
-@_single_thread_allowed
 def request_ebuild_processor(userpriv=False, sandbox=None, fakeroot=False,
                              save_file=None):
     """
@@ -111,6 +346,9 @@ def request_ebuild_processor(userpriv=False, sandbox=None, fakeroot=False,
     Note that fakeroot processes are B{never} reused due to the fact
     the fakeroot env becomes localized to the pkg it's handling.
 
+    If :obj:`processor_pool` is bounded (see :obj:`ProcessorPool`), this
+    blocks while the pool is full till a processor is released.
+
     :return: :obj:`EbuildProcessor`
     :param userpriv: should the processor be deprived to
         :obj:`pkgcore.os_data.portage_gid` and :obj:`pkgcore.os_data.portage_uid`?
@@ -123,21 +361,49 @@ def request_ebuild_processor(userpriv=False, sandbox=None, fakeroot=False,
     if sandbox is None:
         sandbox = pkgcore.spawn.is_sandbox_capable()
 
-    if not fakeroot:
-        for x in inactive_ebp_list:
-            if x.userprived() == userpriv and (x.sandboxed() or not sandbox):
-                if not x.is_alive:
-                    inactive_ebp_list.remove(x)
-                    continue
-                inactive_ebp_list.remove(x)
-                active_ebp_list.append(x)
-                return x
-
-    e = EbuildProcessor(userpriv, sandbox, fakeroot, save_file)
-    active_ebp_list.append(e)
+    e = processor_pool.request(userpriv, sandbox, fakeroot, save_file)
+    preloader = _eclass_preloader
+    if preloader is not None:
+        preloader.warm(e)
+    return e
+
+def _spawn_ebuild_processor(userpriv, sandbox, fakeroot, save_file):
+    e = None
+    if not sandbox and not fakeroot and use_template_processors:
+        e = _fork_ebuild_processor(userpriv)
+    if e is None:
+        e = EbuildProcessor(userpriv, sandbox, fakeroot, save_file)
     return e
 
 @_single_thread_allowed
+def _fork_ebuild_processor(userpriv):
+    """Fork a processor from the template daemon, starting it if needed.
+
+    Only unsandboxed, non fakerooted processors are forked; sandboxed
+    processors share the sandbox log of the daemon they're forked from, thus
+    are always spawned.
+
+    :return: :obj:`EbuildProcessor` instance, or None if forking failed.
+    """
+    template = _template_processors.get(userpriv)
+    try:
+        if template is None or not template.is_alive:
+            template = _template_processors[userpriv] = EbuildProcessor(
+                userpriv, False, False, None)
+        if _eclass_preloader is not None:
+            # children share the preloaded eclasses copy on write.
+            _eclass_preloader.warm(template)
+        return EbuildProcessor(userpriv, False, False, None,
+                               template=template)
+    except (EnvironmentError, InitializationError) as e:
+        logger.warning("failed forking an ebuild processor, spawning "
+                       "one instead: %s" % (e,))
+        template = _template_processors.pop(userpriv, None)
+        if template is not None:
+            template.shutdown_processor()
+        return None
+
+
 def release_ebuild_processor(ebp):
     """
     the inverse of request_ebuild_processor.
@@ -152,21 +418,7 @@ def release_ebuild_processor(ebp):
         If a processor isn't known as active, this means either calling
         error or an internal error.
     """
-
-    try:
-        active_ebp_list.remove(ebp)
-    except ValueError:
-        return False
-
-    assert ebp not in inactive_ebp_list
-    # if it's a fakeroot'd process, we throw it away.
-    # it's not useful outside of a chain of calls
-    if ebp.onetime() or ebp.locked:
-        # ok, so the thing is not reusable either way.
-        ebp.shutdown_processor()
-    else:
-        inactive_ebp_list.append(ebp)
-    return True
+    return processor_pool.release(ebp)
 
 
 @contextlib.contextmanager
@@ -186,6 +438,136 @@ def reuse_or_request(ebp=None, **request_kwds):
             release_ebuild_processor(ebp)
 
 
+_eclass_preloader = None
+
+
+class EclassPreloader(object):
+
+    """
+    eclasses to preload into every processor handed out
+
+    While active (see :obj:`preloading_eclasses`), each processor returned by
+    :obj:`request_ebuild_processor` has the eclasses preloaded into bash
+    functions before it's used, so inheriting them costs neither a request
+    back to python nor sourcing the eclass file.
+
+    :ivar hits: inherits served from preloaded eclasses by those processors
+    :ivar misses: inherits those processors had to request from python
+    """
+
+    def __init__(self, eclass_cache, eclasses):
+        """
+        :param eclass_cache: :obj:`pkgcore.ebuild.eclass_cache` instance
+            the eclasses are pulled from
+        :param eclasses: names of the eclasses to preload
+        """
+        self.eclass_cache = eclass_cache
+        self.eclasses = tuple(eclasses)
+        self.hits = self.misses = 0
+
+    @classmethod
+    def from_consumers(cls, eclass_caches, consumers, limit, minimum=2):
+        """Build a preloader for the most inherited eclasses.
+
+        Eclasses are ranked by their number of consumers; those inherited
+        less than ``minimum`` times aren't worth preloading.
+
+        :param eclass_caches: sequence of eclass caches the processors will
+            be sourcing from; eclasses not resolving to the same file in
+            all of them are skipped, since a preloaded eclass is used
+            regardless of the repository an ebuild is from.
+        :param consumers: iterable of (eclass, consumers) pairs, as
+            :obj:`pkgcore.cache.base.iter_eclass_consumers` yields
+        :param limit: maximum number of eclasses to preload
+        :return: :obj:`EclassPreloader` instance, or None if nothing's worth
+            preloading
+        """
+        eclass_caches = list(eclass_caches)
+        if not eclass_caches or limit <= 0:
+            return None
+        ranked = []
+        for eclass, cpvs in consumers:
+            count = len(cpvs)
+            if count < minimum:
+                continue
+            paths = set()
+            for ec in eclass_caches:
+                data = ec.eclasses.get(eclass)
+                paths.add(data.path if data is not None else None)
+            if len(paths) == 1 and None not in paths:
+                ranked.append((-count, eclass))
+        if not ranked:
+            return None
+        ranked.sort()
+        return cls(eclass_caches[0], [eclass for count, eclass in ranked[:limit]])
+
+    def warm(self, ebp):
+        """Preload the eclasses into the given processor, if not yet done."""
+        ebp._preloader = self
+        ebp.preload_eclasses(self.eclass_cache, async=True,
+                             limited_to=self.eclasses)
+
+    @_single_thread_allowed
+    def count(self, hits=0, misses=0):
+        self.hits += hits
+        self.misses += misses
+
+    def reset(self):
+        self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        """Fraction of inherits served from preloaded eclasses, or None."""
+        total = self.hits + self.misses
+        if not total:
+            return None
+        return float(self.hits) / total
+
+    def __str__(self):
+        rate = self.hit_rate
+        return "%i eclasses preloaded, %i of %i inherits served from them%s" % (
+            len(self.eclasses), self.hits, self.hits + self.misses,
+            " (%.1f%%)" % (rate * 100,) if rate is not None else "")
+
+
+@contextlib.contextmanager
+def preloading_eclasses(preloader):
+    """Preload eclasses into processors handed out within this context.
+
+    Processors left in the pool have the preloaded eclasses cleared on the
+    way out.
+
+    :param preloader: :obj:`EclassPreloader` instance; if None, this is a
+        noop.
+    """
+    global _eclass_preloader
+    if preloader is None:
+        yield None
+        return
+    _acquire_global_ebp_lock()
+    previous, _eclass_preloader = _eclass_preloader, preloader
+    _release_global_ebp_lock()
+    try:
+        yield preloader
+    finally:
+        _acquire_global_ebp_lock()
+        try:
+            _eclass_preloader = previous
+            for ebp in itertools.chain(processor_pool.iter_idle(),
+                                       _template_processors.values()):
+                if ebp._preloader is preloader:
+                    ebp._preloader = None
+                    if ebp.is_alive:
+                        ebp.clear_preloaded_eclasses()
+        finally:
+            _release_global_ebp_lock()
+
+
+def get_eclass_preloader():
+    """Return the active :obj:`EclassPreloader`, if any."""
+    return _eclass_preloader
+
+
 class ProcessingInterruption(Exception):
     pass
 
@@ -238,7 +620,7 @@ class EbuildProcessor(object):
 
     __metaclass__ = WeakRefFinalizer
 
-    def __init__(self, userpriv, sandbox, fakeroot, save_file):
+    def __init__(self, userpriv, sandbox, fakeroot, save_file, template=None):
         """
         :param sandbox: enables a sandboxed processor
         :param userpriv: enables a userpriv'd processor
@@ -246,14 +628,28 @@ class EbuildProcessor(object):
             this is a mutually exclusive option to sandbox, and
             requires userpriv to be enabled. Violating this will
             result in nastiness.
+        :param template: if given, an unsandboxed processor to fork the
+            daemon from rather than spawning a new one; it must match
+            userpriv, and sandbox and fakeroot must be disabled.
         """
 
         self.lock()
+        if template is not None:
+            if (sandbox or fakeroot or template.sandboxed() or
+                    template.fakerooted() or
+                    bool(userpriv) != template.userprived()):
+                raise InitializationError(
+                    "template processors can only be used for unsandboxed, "
+                    "non fakeroot processors of the same userpriv state")
+            self._init_from_template(template)
+            self.unlock()
+            return
         self.ebd = e_const.EBUILD_DAEMON_PATH
         spawn_opts = {'umask':0002}
 
         self._preloaded_eclasses = {}
         self._eclass_caching = False
+        self._preloader = None
         self._outstanding_expects = []
         self._metadata_paths = None
 
@@ -345,6 +741,94 @@ class EbuildProcessor(object):
         # locking isn't used much, but w/ threading this will matter
         self.unlock()
 
+    def _init_from_template(self, template):
+        self.ebd = template.ebd
+        self.__userpriv = template.userprived()
+        self.__sandbox = self.__fakeroot = False
+        self.pid = None
+        self._eclass_caching = False
+        self._outstanding_expects = []
+        tmpdir = tempfile.mkdtemp(prefix='pkgcore-ebd-')
+        dread = None
+        try:
+            to_child = pjoin(tmpdir, 'to_child')
+            from_child = pjoin(tmpdir, 'from_child')
+            paths = [to_child, from_child]
+            for path in paths:
+                os.mkfifo(path, 0600)
+            if self.__userpriv:
+                for path in [tmpdir] + paths:
+                    os.chown(path, os_data.portage_uid, os_data.portage_gid)
+            # open our end ahead of time so the child's open doesn't block.
+            dread = os.open(from_child, os.O_RDONLY|os.O_NONBLOCK)
+            self.pid = template._fork_daemon(tmpdir)
+            cwrite = self._open_fifo_writer(to_child)
+            for fd in (dread, cwrite):
+                fcntl.fcntl(fd, fcntl.F_SETFL,
+                            fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+            self.ebd_read = os.fdopen(dread, "r")
+            dread = None
+            self.ebd_write = os.fdopen(cwrite, "w")
+            if not self.expect("dude!"):
+                raise InitializationError(
+                    "expected 'dude!' response from forked ebd, which "
+                    "wasn't received. likely a bug")
+        except:
+            if dread is not None:
+                os.close(dread)
+            if self.pid is not None:
+                try:
+                    os.kill(self.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                self.pid = None
+            raise
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        # everything set up in the template is inherited by the fork.
+        self.dont_export_vars = template.dont_export_vars
+        self._metadata_paths = template._metadata_paths
+        self._preloaded_eclasses = dict(template._preloaded_eclasses)
+        self._preloader = template._preloader
+
+    def _open_fifo_writer(self, path, timeout=10):
+        # nonblocking opens of a fifo's write end fail till the reader shows
+        # up; poll for it rather than blocking on a child that may have died.
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return os.open(path, os.O_WRONLY|os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            if not self.is_alive or time.time() > deadline:
+                raise InitializationError(
+                    "forked ebd failed to connect to %s" % (path,))
+            time.sleep(0.001)
+
+    def _fork_daemon(self, fifo_dir):
+        """
+        Fork a copy of this daemon, talking over fifos in fifo_dir.
+
+        The copy reads commands from the fifo ``to_child``, and writes to
+        ``from_child``, which must already be opened for reading.  It's
+        reparented to init, so isn't ours (nor the template's) to reap.
+
+        :return: pid of the copy
+        """
+        if self._outstanding_expects:
+            if not self._consume_async_expects():
+                raise InitializationError(
+                    "template processor failed async commands")
+        self.write("fork_daemon %i\n%s" % (len(fifo_dir), fifo_dir),
+                   append_newline=False)
+        line = self.read().split()
+        if len(line) != 2 or line[0] != 'forked':
+            raise InitializationError(
+                "unexpected response to fork_daemon: %r" % (' '.join(line),))
+        return int(line[1])
+
     def run_phase(self, phase, env, tmpdir, logging=None,
                   additional_commands=None, sandbox=True):
         """
@@ -498,7 +982,7 @@ class EbuildProcessor(object):
     def clear_preloaded_eclasses(self):
         if self.is_alive:
             self.write("clear_preloaded_eclasses")
-            if not self.expect("clear_preload_eclasses succeeded", flush=True):
+            if not self.expect("clear_preloaded_eclasses succeeded", flush=True):
                 self.shutdown_processor()
                 return False
         self._preloaded_eclasses.clear()
@@ -535,6 +1019,10 @@ class EbuildProcessor(object):
         self.clear_preloaded_eclasses()
         self._eclass_caching = False
 
+    def _count_inherits(self, hits=0, misses=0):
+        if self._preloader is not None:
+            self._preloader.count(hits=hits, misses=misses)
+
     def _preload_eclass(self, ec_file, async=False):
         """
         Preload an eclass into a bash function.
@@ -612,6 +1100,10 @@ class EbuildProcessor(object):
         except KeyboardInterrupt:
             if not ignore_keyboard_interrupt:
                 raise
+        except OSError as e:
+            # forked processors are reparented to init, not us.
+            if e.errno != errno.ECHILD:
+                raise
 
         # currently, this assumes all went well.
         # which isn't always true.
@@ -700,12 +1192,24 @@ class EbuildProcessor(object):
 
     def _run_depend_like_phase(self, command, package_inst, eclass_cache,
                                extra_commands={}):
-        self._ensure_metadata_paths(const.HOST_NONROOT_PATHS)
-
         e = expected_ebuild_env(package_inst, depends=True)
         data = self._generate_env_str(e)
-        self.write("%s %i\n%s" % (command, len(data), data),
-            append_newline=False)
+        self._run_depend_like_request(command,
+            "%s %i\n%s" % (command, len(data), data), eclass_cache,
+            extra_commands)
+
+    def _run_depend_like_request(self, command, request, eclass_cache,
+                                 extra_commands):
+        """
+        send a metadata sourcing request, handling the daemon's requests
+        till it's done
+
+        :param command: name of the command requested, for errors
+        :param request: full request to send to the daemon
+        :param extra_commands: handlers for the responses of the command
+        """
+        self._ensure_metadata_paths(const.HOST_NONROOT_PATHS)
+        self.write(request, append_newline=False)
 
         updates = None
         if self._eclass_caching:
@@ -774,6 +1278,56 @@ class EbuildProcessor(object):
 
         return metadata_keys
 
+    def get_keys_many(self, pkgs, eclass_cache):
+        """
+        request the metadata of a batch of ebuilds be regenerated
+
+        Unlike :obj:`get_keys`, the whole batch is handed to the daemon in a
+        single command, and the keys of each ebuild are streamed back as
+        it's sourced; a failure sourcing one ebuild doesn't affect the rest.
+
+        :param pkgs: sequence of :obj:`pkgcore.ebuild.ebuild_src.package`
+            instances to regenerate
+        :param eclass_cache: :obj:`pkgcore.ebuild.eclass_cache` instance to use
+            for eclass access
+        :return: list of metadata dicts, in the order of pkgs; None for
+            ebuilds that failed
+        """
+        pkgs = list(pkgs)
+        results = [None] * len(pkgs)
+        if not pkgs:
+            return results
+
+        data = ["gen_metadata_batch %i\n" % (len(pkgs),)]
+        for pkg in pkgs:
+            env = self._generate_env_str(expected_ebuild_env(pkg, depends=True))
+            data.append("%i\n%s" % (len(env), env))
+
+        current = {}
+        # keys for the item being sourced were malformed.
+        invalid = []
+        def receive_key(self, line):
+            key, sep, val = (line or '').partition("=")
+            if sep:
+                current[key] = val
+            else:
+                invalid.append(line)
+
+        def receive_item(self, line):
+            index, status = line.split()
+            index = int(index)
+            if status == 'succeeded' and not invalid:
+                results[index] = current.copy()
+            elif invalid:
+                logger.error("invalid metadata key line(s) from %s: %r" %
+                             (pkgs[index], invalid))
+            current.clear()
+            del invalid[:]
+
+        self._run_depend_like_request('gen_metadata_batch', ''.join(data),
+            eclass_cache, {"key": receive_key, "batch_item": receive_item})
+        return results
+
     # this basically handles all hijacks from the daemon, whether
     # confcache or portageq.
     def generic_handler(self, additional_commands=None):
@@ -807,6 +1361,7 @@ class EbuildProcessor(object):
             chuck_StoppingCommand, lambda f: f.lower().strip() == "succeeded")
 
         handlers["killed"] = chuck_KeyboardInterrupt
+        handlers["preload_hits"] = receive_preload_hits
 
         if additional_commands is not None:
             for x in additional_commands:
@@ -871,6 +1426,16 @@ def inherit_handler(ecache, ebp, line, updates=None):
 
     if updates is not None:
         updates.add(line)
+    ebp._count_inherits(misses=1)
+
+
+def receive_preload_hits(ebp, line):
+    """
+    Callback for the daemon reporting inherits served from preloaded eclasses.
+
+    Not for normal consumption.
+    """
+    ebp._count_inherits(hits=int(line))
 
 
 def expected_ebuild_env(pkg, d=None, env_source_override=None, depends=False):
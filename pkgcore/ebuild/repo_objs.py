@@ -6,7 +6,8 @@ package class for buildable ebuilds
 """
 
 __all__ = ("Maintainer", "MetadataXml", "LocalMetadataXml",
-    "SharedPkgData", "Licenses", "OverlayedLicenses")
+    "IndexedMetadataXml", "MetadataXmlIndex", "SharedPkgData", "Licenses",
+    "OverlayedLicenses", "ListingIndex")
 
 from snakeoil.caching import WeakInstMeta
 from snakeoil import compatibility
@@ -19,8 +20,10 @@ from snakeoil import klass
 from itertools import chain
 from pkgcore.config import ConfigHint
 from pkgcore.repository import syncable
+from pkgcore.util.file_index import FileIndex
 demandload(globals(),
     'errno',
+    'os',
     'snakeoil.xml:etree',
     'snakeoil.bash:BashParseError,iter_read_bash,read_dict',
     'snakeoil.fileutils:readfile,readlines_ascii',
@@ -74,8 +77,12 @@ class MetadataXml(object):
     if loaded
     """
 
-    __slots__ = ("__weakref__", "_maintainers", "_herds", "_longdescription",
-        "_source")
+    __slots__ = ("__weakref__", "_maintainers", "_herds", "_local_use",
+        "_longdescription", "_source")
+
+    # parsed attributes, in the order _set_parsed takes them.
+    _parsed_attrs = ("_maintainers", "_herds", "_local_use",
+        "_longdescription")
 
     def __init__(self, source):
         self._source = source
@@ -85,10 +92,18 @@ class MetadataXml(object):
             self._parse_xml()
         return getattr(self, attr)
 
-    for attr in ("herds", "maintainers", "longdescription"):
+    for attr in ("herds", "maintainers", "local_use", "longdescription"):
         locals()[attr] = property(post_curry(_generic_attr, "_"+attr))
     del attr
 
+    def _get_parsed(self):
+        return tuple(getattr(self, attr) for attr in self._parsed_attrs)
+
+    def _set_parsed(self, values):
+        for attr, value in zip(self._parsed_attrs, values):
+            setattr(self, attr, value)
+        self._source = None
+
     def _parse_xml(self, source=None):
         if source is None:
             source = self._source.bytes_fileobj()
@@ -109,6 +124,17 @@ class MetadataXml(object):
         self._maintainers = tuple(maintainers)
         self._herds = tuple(x.text for x in tree.findall("herd"))
 
+        local_use = {}
+        for x in tree.findall("use"):
+            if x.get("lang", "en") != "en":
+                continue
+            for flag in x.findall("flag"):
+                name = flag.get("name")
+                if name:
+                    local_use[name] = ' '.join(
+                        ''.join(flag.itertext()).split())
+        self._local_use = mappings.ImmutableDict(local_use)
+
         # Could be unicode!
         longdesc = tree.findtext("longdescription")
         if longdesc:
@@ -127,10 +153,149 @@ class LocalMetadataXml(MetadataXml):
         except EnvironmentError as oe:
             if oe.errno != errno.ENOENT:
                 raise
-            self._maintainers = ()
-            self._herds = ()
-            self._longdescription = None
-            self._source = None
+            self._set_parsed(((), (), mappings.ImmutableDict(), None))
+
+
+class IndexedMetadataXml(LocalMetadataXml):
+
+    """
+    metadata.xml of a package, read from a :obj:`MetadataXmlIndex` when it
+    holds the file's current contents, else parsed and added to it
+    """
+
+    __slots__ = ("_index", "_key")
+
+    def __init__(self, source, index, key):
+        LocalMetadataXml.__init__(self, source)
+        self._index = index
+        self._key = key
+
+    def _parse_xml(self):
+        source = self._source
+        st, parsed = self._index.lookup(self._key, source)
+        if parsed is not None:
+            self._set_parsed(parsed)
+            return
+        LocalMetadataXml._parse_xml(self)
+        if st is not None:
+            self._index.update(self._key, st, self._get_parsed())
+
+
+def _escape(value):
+    if value is None:
+        return ''
+    return unicode(value).encode('unicode_escape')
+
+
+def _unescape(value):
+    if not value:
+        return None
+    value = value.decode('unicode_escape')
+    try:
+        # etree hands back plain strings for ascii text; match it.
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value
+
+
+class MetadataXmlIndex(FileIndex):
+
+    """
+    on disk index of the parsed metadata.xml of a repository's packages
+
+    Entries are stored along with the mtime and size of the metadata.xml
+    they were parsed from, and used only while those are unchanged; a query
+    on maintainers or herds over the tree then reads this file instead of
+    parsing every metadata.xml.  The format is::
+
+        category/package<tab>mtime<tab>size
+        <tab>maintainer<tab>email<tab>name<tab>description
+        <tab>herd<tab>herd
+        <tab>use<tab>flag<tab>description
+        <tab>longdescription<tab>longdescription
+
+    with the lines of a package following its own, and values escaped as
+    python unicode literals (empty if unset).
+
+    :ivar base: location of the repository
+    """
+
+    magic = 'pkgcore-metadata-xml-index-1'
+    description = 'metadata.xml index'
+
+    def __init__(self, base, path=None, readonly=False):
+        FileIndex.__init__(self, path, readonly)
+        self.base = base
+
+    @property
+    def header(self):
+        return '%s %s' % (self.magic, self.base)
+
+    def _read_entries(self, f):
+        packages = {}
+        for line in f:
+            chunks = line.rstrip('\n').split('\t')
+            if chunks[0]:
+                maintainers, herds, local_use = [], [], {}
+                longdesc = [None]
+                packages[tuple(chunks[0].split('/', 1))] = (
+                    float(chunks[1]), long(chunks[2]),
+                    maintainers, herds, local_use, longdesc)
+                continue
+            kind = chunks[1]
+            values = map(_unescape, chunks[2:])
+            if kind == 'maintainer':
+                maintainers.append(Maintainer(*values))
+            elif kind == 'herd':
+                herds.append(values[0])
+            elif kind == 'use':
+                local_use[values[0]] = values[1] or ''
+            elif kind == 'longdescription':
+                longdesc[0] = values[0]
+        for key, (mtime, size, maintainers, herds, local_use,
+                  longdesc) in packages.iteritems():
+            packages[key] = (mtime, size, (tuple(maintainers), tuple(herds),
+                mappings.ImmutableDict(local_use), longdesc[0]))
+        return packages
+
+    def lookup(self, key, path):
+        """
+        :return: (stat, parsed) for the metadata.xml at path; stat is the
+            (mtime, size) of the file, or None if it's missing, and parsed
+            the stored (maintainers, herds, local_use, longdescription) if
+            they're current, else None
+        """
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            return None, None
+        st = (st.st_mtime, st.st_size)
+        stored = self._entries.get(key)
+        if stored is not None and stored[:2] == st:
+            return st, stored[2]
+        return st, None
+
+    def update(self, key, st, parsed):
+        """store what was parsed from a metadata.xml of the given stat"""
+        self._entries[key] = st + (parsed,)
+        self._dirty = True
+
+    def _write_entries(self, f, cutoff):
+        for key, (mtime, size, parsed) in sorted(self._entries.iteritems()):
+            if mtime >= cutoff:
+                continue
+            maintainers, herds, local_use, longdesc = parsed
+            f.write('%s/%s\t%r\t%i\n' % (key + (mtime, size)))
+            for m in maintainers:
+                f.write('\tmaintainer\t%s\t%s\t%s\n' % (
+                    _escape(m.email), _escape(m.name),
+                    _escape(m.description)))
+            for herd in herds:
+                f.write('\therd\t%s\n' % (_escape(herd),))
+            for flag, desc in sorted(local_use.iteritems()):
+                f.write('\tuse\t%s\t%s\n' % (_escape(flag), _escape(desc)))
+            if longdesc is not None:
+                f.write('\tlongdescription\t%s\n' % (_escape(longdesc),))
 
 
 class SharedPkgData(object):
@@ -142,6 +307,71 @@ class SharedPkgData(object):
         self.manifest = manifest
 
 
+class ListingIndex(FileIndex):
+
+    """
+    on disk index of a repository's category, package and version listings
+
+    Each listing is stored with the mtime of the directory it was read from;
+    it's only used while that mtime is unchanged, so after a partial sync
+    just the directories touched are rescanned.  The file is one line per
+    listing::
+
+        key<tab>mtime<tab>space separated names
+
+    where key is '' for the categories, the category for its packages, and
+    category/package for its versions.  The header carries the settings
+    the listings depend on, as passed in.
+    """
+
+    magic = 'pkgcore-listing-index-1'
+    description = 'listing index'
+
+    def __init__(self, path, header='', readonly=False):
+        FileIndex.__init__(self, path, readonly)
+        self._settings = header
+
+    @property
+    def header(self):
+        return '%s %s' % (self.magic, self._settings)
+
+    def _read_entries(self, f):
+        listings = {}
+        for line in f:
+            try:
+                key, mtime, names = line.rstrip('\n').split('\t')
+                listings[key] = (float(mtime), tuple(names.split()))
+            except ValueError:
+                # corrupt; the directory is listed again.
+                continue
+        return listings
+
+    def lookup(self, key, path):
+        """
+        :return: (mtime, names) for the listing of the directory path; names
+            is None if the stored listing is missing or stale, mtime if the
+            directory doesn't exist
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except EnvironmentError:
+            return None, None
+        stored = self._entries.get(key)
+        if stored is not None and stored[0] == mtime:
+            return mtime, stored[1]
+        return mtime, None
+
+    def update(self, key, mtime, names):
+        """store the listing of a directory, as read at the given mtime"""
+        self._entries[key] = (mtime, tuple(names))
+        self._dirty = True
+
+    def _write_entries(self, f, cutoff):
+        for key, (mtime, names) in sorted(self._entries.iteritems()):
+            if mtime < cutoff:
+                f.write('%s\t%r\t%s\n' % (key, mtime, ' '.join(names)))
+
+
 class Licenses(object):
 
     __metaclass__ = WeakInstMeta
@@ -26,20 +26,24 @@ from snakeoil.fileutils import readfile
 from snakeoil.containers import InvertedContains
 from snakeoil.obj import make_kls
 from snakeoil.weakrefs import WeakValCache
-from snakeoil.compatibility import intern, raise_from
+from snakeoil.compatibility import intern, raise_from, IGNORED_EXCEPTIONS
 
 from snakeoil.demandload import demandload
 demandload(globals(),
     'pkgcore.ebuild:ebd',
     'snakeoil.data_source:local_source',
-    'snakeoil.chksum:get_chksums',
-    'pkgcore.ebuild:digest,repo_objs,atom',
+    'snakeoil.chksum:get_chksums,LazilyHashedPath',
+    'pkgcore.ebuild:digest,repo_objs,atom,restricts',
+    'pkgcore.restrictions:boolean',
     'pkgcore.ebuild:errors@ebuild_errors',
     'pkgcore.ebuild:profiles,processor',
+    'pkgcore.ebuild.cpv:versioned_CPV',
+    'snakeoil.osutils:stat_mtime_long',
     'pkgcore.package:errors@pkg_errors',
     'pkgcore.util.packages:groupby_pkg',
     'pkgcore.fs.livefs:iter_scan',
     'pkgcore.log:logger',
+    'pkgcore.util.thread_pool:map_async',
     'operator:attrgetter',
     'random:shuffle',
     'errno',
@@ -154,17 +158,19 @@ def _sort_eclasses(config, raw_repo, eclasses):
          'default_mirrors': 'list',
          'override_repo_id':'str',
          'ignore_paludis_versioning':'bool',
-         'allow_missing_manifests':'bool'},
+         'allow_missing_manifests':'bool',
+         'listing_threads':'int'},
          requires_config='config')
 def tree(config, raw_repo, cache=(), eclass_override=None, default_mirrors=None,
-         ignore_paludis_versioning=False, allow_missing_manifests=False):
+         ignore_paludis_versioning=False, allow_missing_manifests=False,
+         listing_threads=0):
     eclass_override = _sort_eclasses(config, raw_repo, eclass_override)
 
     return _UnconfiguredTree(raw_repo.location, eclass_override, cache=cache,
         default_mirrors=default_mirrors,
         ignore_paludis_versioning=ignore_paludis_versioning,
         allow_missing_manifests=allow_missing_manifests,
-        repo_config=raw_repo)
+        repo_config=raw_repo, listing_threads=listing_threads)
 
 @configurable(typename='repo',
         types={'raw_repo': 'ref:raw_repo', 'cache': 'refs:cache',
@@ -173,21 +179,64 @@ def tree(config, raw_repo, cache=(), eclass_override=None, default_mirrors=None,
          'default_mirrors': 'list',
          'override_repo_id':'str',
          'ignore_paludis_versioning':'bool',
-         'allow_missing_manifests':'bool'},
+         'allow_missing_manifests':'bool',
+         'listing_threads':'int'},
          requires_config='config')
 def slavedtree(config, raw_repo, parent_repo, cache=(), eclass_override=None, default_mirrors=None,
-               ignore_paludis_versioning=False, allow_missing_manifests=False):
+               ignore_paludis_versioning=False, allow_missing_manifests=False,
+               listing_threads=0):
     eclass_override = _sort_eclasses(config, raw_repo, eclass_override)
 
     return _SlavedTree(parent_repo, raw_repo.location, eclass_override, cache=cache,
         default_mirrors=default_mirrors,
         ignore_paludis_versioning=ignore_paludis_versioning,
         allow_missing_manifests=allow_missing_manifests,
-        repo_config=raw_repo)
+        repo_config=raw_repo, listing_threads=listing_threads)
 
 
 metadata_offset = "profiles"
 
+def _list_concurrently(keys, functor, threads):
+    results = []
+    def _worker(queue):
+        for key in queue:
+            try:
+                results.append((key, functor(key)))
+            except IGNORED_EXCEPTIONS:
+                raise
+            except Exception:
+                pass
+    map_async(keys, _worker, threads=threads)
+    return results
+
+
+def _revdep_targets(restrict):
+    """Return the atoms a restriction requires a dependency on, or None.
+
+    A restriction only matches packages depending on one of the atoms
+    returned; None means it isn't limited to reverse dependencies.
+    """
+    if getattr(restrict, 'negate', True):
+        return None
+    if isinstance(restrict, restricts.RevdepRestriction):
+        return [restrict.atom]
+    if isinstance(restrict, boolean.OrRestriction):
+        targets = []
+        for x in restrict.restrictions:
+            l = _revdep_targets(x)
+            if l is None:
+                # one branch matches regardless of dependencies.
+                return None
+            targets.extend(l)
+        return targets or None
+    if isinstance(restrict, boolean.AndRestriction):
+        for x in restrict.restrictions:
+            l = _revdep_targets(x)
+            if l is not None:
+                return l
+    return None
+
+
 class _UnconfiguredTree(prototype.tree):
 
     """
@@ -219,13 +268,14 @@ class _UnconfiguredTree(prototype.tree):
          'ignore_paludis_versioning':'bool',
          'allow_missing_manifests':'bool',
          'repo_config':'ref:raw_repo',
+         'listing_threads':'int',
         },
         typename='repo')
 
     def __init__(self, location, eclass_cache, cache=(),
                  default_mirrors=None, override_repo_id=None,
                  ignore_paludis_versioning=False, allow_missing_manifests=False,
-                 repo_config=None):
+                 repo_config=None, listing_threads=0):
 
         """
         :param location: on disk location of the tree
@@ -240,6 +290,9 @@ class _UnconfiguredTree(prototype.tree):
             repository unique id
         :param ignore_paludis_versioning: If False, fail when -scm is encountred.  if True,
             silently ignore -scm ebuilds.
+        :param listing_threads: if above 1, walks of the whole tree first
+            list its directories via that many threads; see
+            :obj:`prefetch_listings`.
         """
 
         prototype.tree.__init__(self)
@@ -281,6 +334,7 @@ class _UnconfiguredTree(prototype.tree):
         self.cache = cache
         self.ignore_paludis_versioning = ignore_paludis_versioning
         self._allow_missing_chksums = allow_missing_manifests
+        self.listing_threads = listing_threads
         self.package_class = self.package_factory(
             self, cache, self.eclass_cache, self.mirrors, self.default_mirrors)
         self._shared_pkg_cache = WeakValCache()
@@ -330,16 +384,24 @@ class _UnconfiguredTree(prototype.tree):
         cats = self.hardcoded_categories
         if cats is not None:
             return cats
+        return tuple(imap(intern,
+            self._indexed_listing('', self.base, self._scan_categories)))
+
+    def _scan_categories(self):
         try:
-            return tuple(imap(intern,
+            return tuple(
                 ifilterfalse(self.false_categories.__contains__,
                     (x for x in listdir_dirs(self.base) if x[0:1] != ".")
-                )))
+                ))
         except EnvironmentError as e:
             raise_from(KeyError("failed fetching categories: %s" % str(e)))
 
     def _get_packages(self, category):
         cpath = pjoin(self.base, category.lstrip(os.path.sep))
+        return self._indexed_listing(category, cpath, self._scan_packages,
+                                     category, cpath)
+
+    def _scan_packages(self, category, cpath):
         try:
             return tuple(ifilterfalse(self.false_packages.__contains__,
                 listdir_dirs(cpath)))
@@ -355,6 +417,10 @@ class _UnconfiguredTree(prototype.tree):
 
     def _get_versions(self, catpkg):
         cppath = pjoin(self.base, catpkg[0], catpkg[1])
+        return self._indexed_listing('/'.join(catpkg), cppath,
+                                     self._scan_versions, catpkg, cppath)
+
+    def _scan_versions(self, catpkg, cppath):
         pkg = catpkg[-1] + "-"
         lp = len(pkg)
         extension = self.extension
@@ -379,6 +445,199 @@ class _UnconfiguredTree(prototype.tree):
             raise_from(KeyError("failed fetching versions for package %s: %s" % \
                 (pjoin(self.base, catpkg.lstrip(os.path.sep)), str(e))))
 
+    @klass.jit_attr
+    def _index_cache(self):
+        # indexes are stored in the first writable fs cache; barring one, in
+        # a readonly one (a cache shipped with the repo, say) if it provides
+        # them.
+        caches = [x for x in self.cache if getattr(x, 'location', None)]
+        caches.sort(key=attrgetter('readonly'))
+        if not caches:
+            return None
+        return caches[0]
+
+    @klass.jit_attr
+    def _listing_index(self):
+        cache = self._index_cache
+        if cache is None:
+            return None
+        return repo_objs.ListingIndex(
+            pjoin(cache.location, '.listing_index'),
+            '%s %s %s' % (self.extension, int(self.ignore_paludis_versioning),
+                          self.base),
+            readonly=cache.readonly)
+
+    @klass.jit_attr
+    def manifest_index(self):
+        """
+        :obj:`pkgcore.ebuild.digest.ManifestIndex` of the repository's
+        Manifests, or None if manifests are disabled or signed.
+        """
+        if self.config.manifests.disabled or self.enable_gpg:
+            return None
+        cache = self._index_cache
+        if cache is None:
+            return digest.ManifestIndex(self.base)
+        return digest.ManifestIndex(self.base,
+            pjoin(cache.location, '.manifest_index'), readonly=cache.readonly)
+
+    def save_manifest_index(self):
+        """
+        Write out the Manifest entries parsed so far to the on disk manifest
+        index.
+        """
+        index = self.manifest_index
+        if index is not None:
+            index.try_save()
+
+    @klass.jit_attr
+    def metadata_xml_index(self):
+        """
+        :obj:`pkgcore.ebuild.repo_objs.MetadataXmlIndex` of the repository's
+        metadata.xml files.
+        """
+        cache = self._index_cache
+        if cache is None:
+            return repo_objs.MetadataXmlIndex(self.base)
+        return repo_objs.MetadataXmlIndex(self.base,
+            pjoin(cache.location, '.metadata_xml_index'),
+            readonly=cache.readonly)
+
+    def save_metadata_xml_index(self):
+        """
+        Write out the metadata.xml files parsed so far to the on disk
+        metadata.xml index.
+        """
+        self.metadata_xml_index.try_save()
+
+    def _indexed_listing(self, key, path, scan, *args):
+        index = self._listing_index
+        if index is None:
+            return scan(*args)
+        mtime, names = index.lookup(key, path)
+        if names is None:
+            names = scan(*args)
+            if mtime is not None:
+                index.update(key, mtime, names)
+        return names
+
+    def save_listing_index(self):
+        """
+        Write out the listings read so far to the on disk listing index,
+        letting later instances skip listing unchanged directories.
+        """
+        index = self._listing_index
+        if index is not None:
+            index.try_save()
+
+    def prefetch_listings(self, threads=None):
+        """
+        List the packages of every category, then the versions of every
+        package, keeping several listings outstanding at once.
+
+        Listing a tree is bound by filesystem latency rather than cpu (on
+        nfs in particular), so issuing the listdirs from a pool of threads
+        cuts the time of a full walk roughly by the number of threads.
+        Listings already pulled are skipped; those that fail are left for
+        the lazy lookup to hit (and report) again.
+
+        :param threads: number of listings in flight; defaults to
+            listing_threads.
+        """
+        if threads is None:
+            threads = self.listing_threads
+        threads = max(threads, 1)
+        index = self._listing_index
+        if index is not None:
+            # loaded up front so the workers only ever update it.
+            index.load()
+        self.packages.prime(_list_concurrently(
+            self.packages.uncached(self.categories), self._get_packages,
+            threads))
+        self.versions.prime(_list_concurrently(
+            self.versions.uncached(self.versions.iterkeys()),
+            self._get_versions, threads))
+
+    def _identify_candidates(self, restrict, sorter):
+        candidates = super(_UnconfiguredTree, self)._identify_candidates(
+            restrict, sorter)
+        if candidates is self.versions and self.listing_threads > 1:
+            # walking the whole tree.
+            self.prefetch_listings()
+        targets = _revdep_targets(restrict)
+        if targets is not None and self.cache:
+            return self._revdep_candidates(targets, candidates)
+        return candidates
+
+    def _revdep_candidates(self, targets, candidates):
+        """Return the candidates that may depend on any of the target atoms.
+
+        Answered from the metadata caches' reverse dependency index, so only
+        the atoms of the packages keyed on a target are parsed and checked.
+        A package is only ruled out if every version has a cache entry valid
+        for its ebuild and eclasses, and none of those entries depend on a
+        target; the first cache with a valid entry is used, as for a normal
+        metadata lookup.
+
+        :return: list of the (category, package) candidates left
+        """
+        parsed = {}
+        def intersects(target, atom_str):
+            try:
+                a = parsed[atom_str]
+            except KeyError:
+                try:
+                    a = atom.atom(atom_str)
+                except ebuild_errors.MalformedAtom:
+                    # let the full match sort it out.
+                    a = None
+                parsed[atom_str] = a
+            return a is None or target.intersects(a)
+
+        matches = {}
+        def matched(cache):
+            cpvs = matches.get(cache)
+            if cpvs is None:
+                cpvs = matches[cache] = set()
+                for target in targets:
+                    for cpvstr, deps in cache.revdeps(target.key).iteritems():
+                        if any(intersects(target, atom_str)
+                               for attr, atom_str in deps):
+                            cpvs.add(cpvstr)
+            return cpvs
+
+        def ruled_out(pkg):
+            ebuild_hash = LazilyHashedPath(pkg.path)
+            for cache in self.cache:
+                if cache.has_valid_entry(pkg.cpvstr, ebuild_hash,
+                                         self.eclass_cache):
+                    return (pkg.cpvstr in cache.revdep_indexed() and
+                            pkg.cpvstr not in matched(cache))
+            # no valid entry; it has to be sourced to know.
+            return False
+
+        l = []
+        for cp in candidates:
+            if not all(ruled_out(self.package_class(*(cp + (version,))))
+                       for version in self.versions[cp]):
+                l.append(cp)
+        return l
+
+    def save_revdep_index(self):
+        """
+        Write out the metadata caches' reverse dependency indexes, if they
+        were built for a query.
+        """
+        for cache in self.cache:
+            if not cache.readonly:
+                cache.save_revdep_index()
+
+    def save_indexes(self):
+        self.save_listing_index()
+        self.save_manifest_index()
+        self.save_metadata_xml_index()
+        self.save_revdep_index()
+
     def _get_ebuild_path(self, pkg):
         if pkg.revision is None:
             if pkg.fullver not in self.versions[(pkg.category, pkg.package)]:
@@ -402,8 +661,9 @@ class _UnconfiguredTree(prototype.tree):
         return o
 
     def _get_metadata_xml(self, category, package):
-        return repo_objs.LocalMetadataXml(pjoin(self.base, category,
-            package, "metadata.xml"))
+        return repo_objs.IndexedMetadataXml(pjoin(self.base, category,
+            package, "metadata.xml"), self.metadata_xml_index,
+            (category, package))
 
     def _get_manifest(self, category, package):
         return digest.Manifest(pjoin(self.base, category, package,
@@ -413,6 +673,11 @@ class _UnconfiguredTree(prototype.tree):
     def _get_digests(self, pkg, allow_missing=False):
         if self.config.manifests.disabled:
             return True, {}
+        index = self.manifest_index
+        if index is not None:
+            distfiles = index.distfiles(pkg.category, pkg.package)
+            if distfiles is not None:
+                return allow_missing, distfiles
         try:
             manifest = pkg._shared_pkg_data.manifest
             return allow_missing, manifest.distfiles
@@ -456,6 +721,166 @@ class _UnconfiguredTree(prototype.tree):
                 'package.mask', ma))
         return [neg, pos]
 
+    def mtime_snapshot(self):
+        """Return a mapping of every ebuild and eclass path to its mtime.
+
+        Intended to be saved after a regen, and diffed against a later
+        snapshot to get the changes to feed to an incremental regen.
+        """
+        d = {}
+        for eclass, data in self.eclass_cache.eclasses.iteritems():
+            d[data.path] = data.mtime
+        for (category, package), versions in self.versions.iteritems():
+            for version in versions:
+                path = pjoin(self.base, category, package, "%s-%s%s" % (
+                    package, version, self.extension))
+                try:
+                    d[path] = stat_mtime_long(path)
+                except EnvironmentError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return d
+
+    def _regen_changed_pkgs(self, paths):
+        """Work out which packages need regen due to the given changed paths.
+
+        Ebuilds that were added or modified are returned directly; for
+        eclasses, every package whose cache entry lists the eclass in its
+        ``_eclasses_`` is returned.  Cache entries for ebuilds that no longer
+        exist are dropped from the writable caches.
+
+        :param paths: iterable of changed (added, modified, or removed) ebuild
+            and eclass paths; relative paths are taken as relative to the
+            repository, anything that isn't an ebuild or eclass is ignored.
+        :return: list of packages, sorted
+        """
+        base = os.path.normpath(self.base).rstrip(os.path.sep) + os.path.sep
+        ext_len = len(self.extension)
+        eclasses = set()
+        cpvs, removed = set(), set()
+        for path in paths:
+            # collapse ./, //, and the like so 'cat/pkg' can be split out.
+            path = os.path.normpath(pjoin(self.base, path))
+            if path.endswith(".eclass"):
+                eclasses.add(os.path.basename(path)[:-len(".eclass")])
+                continue
+            if not path.startswith(base) or not path.endswith(self.extension):
+                continue
+            chunks = path[len(base):].split(os.path.sep)
+            if len(chunks) != 3 or not chunks[2].startswith(chunks[1] + "-"):
+                continue
+            category, package, version = chunks[0], chunks[1], \
+                chunks[2][len(chunks[1]) + 1:-ext_len]
+            if version in self.versions.get((category, package), ()):
+                cpvs.add((category, package, version))
+                continue
+            try:
+                removed.add(versioned_CPV(
+                    "%s/%s-%s" % (category, package, version)).cpvstr)
+            except ebuild_errors.InvalidCPV:
+                continue
+
+        for cache in self.cache:
+            if removed and not cache.readonly:
+                for cpvstr in removed:
+                    if cpvstr in cache:
+                        del cache[cpvstr]
+
+        pkgs = set()
+        for eclass in eclasses:
+            pkgs.update(self.eclass_consumers(eclass))
+        for cpv in cpvs:
+            try:
+                pkgs.add(self[cpv])
+            except KeyError:
+                continue
+        return sorted(pkgs)
+
+    def _cpvs_to_pkgs(self, cpvstrs):
+        pkgs = []
+        for cpvstr in sorted(cpvstrs):
+            try:
+                cpv = versioned_CPV(cpvstr)
+                pkgs.append(self[(cpv.category, cpv.package, cpv.fullver)])
+            except (ebuild_errors.InvalidCPV, KeyError):
+                # stale cache entry for an ebuild that's since been removed.
+                continue
+        return pkgs
+
+    def eclass_consumers(self, eclass, stale=False):
+        """Return the packages inheriting an eclass, per the metadata caches.
+
+        This uses the caches' reverse eclass index rather than loading the
+        metadata of every package in the repository.  Entries aren't
+        validated, and packages without one are missed; it's meant for
+        finding entries to regenerate.  Use :obj:`eclasses_inherited` where
+        an accurate answer is needed.
+
+        :param stale: if True, only return packages whose cache entry was
+            generated against different eclass data than is currently in
+            the repository.
+        :return: sorted list of packages
+        """
+        consumers = {}
+        for cache in self.cache:
+            for cpvstr, chfs in cache.eclass_consumers(eclass).iteritems():
+                consumers.setdefault(cpvstr, chfs)
+        if stale:
+            rebuild = self.eclass_cache.rebuild_cache_entry
+            consumers = [cpvstr for cpvstr, chfs in consumers.iteritems()
+                         if rebuild([(eclass, chfs)]) is None]
+        return self._cpvs_to_pkgs(consumers)
+
+    def eclasses_inherited(self, pkg):
+        """Return the sorted eclasses a package inherits.
+
+        Where a metadata cache's reverse eclass index holds an entry for pkg
+        that's valid against its ebuild and the current eclasses, that's
+        used; otherwise pkg's metadata is loaded, and sourced if no cache
+        has a valid entry, just as for :obj:`pkg.inherited`.
+        """
+        ebuild_hash = LazilyHashedPath(pkg.path)
+        for cache in self.cache:
+            if cache is None:
+                continue
+            inherited = cache.inherited(pkg.cpvstr, ebuild_hash,
+                                        self.eclass_cache)
+            if inherited is not None:
+                return inherited
+        return pkg.inherited
+
+    def iter_eclass_consumers(self):
+        """Yield (eclass, cpvs) for every eclass inherited in the repository.
+
+        Each package's eclasses come from :obj:`eclasses_inherited`, so
+        packages lacking valid cache entries have their metadata sourced.
+        """
+        consumers = {}
+        for pkg in self:
+            for eclass in self.eclasses_inherited(pkg):
+                consumers.setdefault(eclass, []).append(pkg.cpvstr)
+        for eclass, cpvs in sorted(consumers.iteritems()):
+            yield eclass, sorted(cpvs)
+
+    def _eclass_preloader(self, limit):
+        """Return a preloader for the repository's most inherited eclasses.
+
+        Eclasses are ranked by the number of metadata cache entries
+        inheriting them; unlike :obj:`iter_eclass_consumers`, entries aren't
+        validated, so no tree walk is needed- a stale ranking only costs
+        preloading the wrong eclasses.
+
+        :param limit: maximum number of eclasses to preload
+        :return: :obj:`pkgcore.ebuild.processor.EclassPreloader` instance,
+            or None if there's nothing worth preloading
+        """
+        consumers = {}
+        for cache in self.cache:
+            for eclass, cpvs in cache.iter_eclass_consumers():
+                consumers.setdefault(eclass, set()).update(cpvs)
+        return processor.EclassPreloader.from_consumers(
+            [self.eclass_cache], consumers.iteritems(), limit)
+
     def _regen_operation_helper(self, **kwds):
         return _RegenOpHelper(self, force=bool(kwds.get('force', False)),
             eclass_caching=bool(kwds.get('eclass_caching', True)))
@@ -463,21 +888,89 @@ class _UnconfiguredTree(prototype.tree):
 
 class _RegenOpHelper(object):
 
+    # packages handed to the ebuild processor per request by regen_many and
+    # generate_many.
+    batch_size = 16
+
     def __init__(self, repo, force=False, eclass_caching=True):
         self.force=force
         self.eclass_caching = eclass_caching
-        self.ebp = processor.request_ebuild_processor()
-        if eclass_caching:
-            self.ebp.allow_eclass_caching()
+        self._ebp = None
+
+    @property
+    def ebp(self):
+        # requested on first use; helpers that only store results
+        # (the writer in a multiprocess regen) never need one.
+        if self._ebp is None:
+            self._ebp = processor.request_ebuild_processor()
+            if self.eclass_caching:
+                self._ebp.allow_eclass_caching()
+        return self._ebp
 
     def __call__(self, pkg):
         return pkg._fetch_metadata(ebp=self.ebp, force_regen=self.force)
 
+    def generate(self, pkg):
+        """Source pkg's metadata if it's stale, without writing to the caches.
+
+        :return: None if the cache is already valid for pkg, else a picklable
+            object to hand to :obj:`store`.
+        """
+        factory = pkg._parent
+        if not self.force and factory._get_cached_metadata(pkg, prune=False) is not None:
+            return None
+        # note this is None for unsupported eapis; there's nothing to store.
+        return factory._source_metadata(pkg, ebp=self.ebp)
+
+    def generate_many(self, pkgs):
+        """Batched form of :obj:`generate`.
+
+        The stale packages are sourced via a single ebuild processor
+        request; a failure sourcing one doesn't affect the others.
+
+        :return: list of (pkg, data, exception) for the packages needing
+            regeneration; data is as :obj:`generate` returns it, exception
+            is set instead if sourcing pkg failed.
+        """
+        stale = {}
+        for pkg in pkgs:
+            factory = pkg._parent
+            if self.force or factory._get_cached_metadata(pkg, prune=False) is None:
+                stale.setdefault(factory, []).append(pkg)
+        results = []
+        for factory, batch in stale.iteritems():
+            results.extend(factory._source_metadata_many(batch, ebp=self.ebp))
+        return results
+
+    def regen_many(self, pkgs):
+        """Regenerate the metadata of a batch of packages as needed.
+
+        :return: list of (pkg, exception) for the packages that failed
+        """
+        failures = []
+        for pkg, data, error in self.generate_many(pkgs):
+            if error is None and data is not None:
+                try:
+                    self.store(pkg, data)
+                except IGNORED_EXCEPTIONS:
+                    raise
+                except Exception as e:
+                    error = e
+            if error is not None:
+                failures.append((pkg, error))
+        return failures
+
+    def store(self, pkg, data):
+        """Commit the results of :obj:`generate` to pkg's caches."""
+        pkg._parent._store_metadata(pkg, *data)
+
     def finish(self):
+        if self._ebp is None:
+            return
         if self.eclass_caching:
-            self.ebp.disable_eclass_caching()
-        processor.release_ebuild_processor(self.ebp)
-        self.ebp = None
+            self._ebp.disable_eclass_caching()
+        processor.release_ebuild_processor(self._ebp)
+        self._ebp = None
 
 
 class _SlavedTree(_UnconfiguredTree):
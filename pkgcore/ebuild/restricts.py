@@ -8,12 +8,14 @@
 atom version restrict
 """
 
-__all__ = ("VersionMatch",)
+__all__ = ("VersionMatch", "RevdepRestriction")
 
-from pkgcore.restrictions import packages, restriction, values
+from pkgcore.restrictions import boolean, packages, restriction, values
 from pkgcore.ebuild import cpv, errors
 from snakeoil.klass import generic_equality
 from snakeoil.compatibility import is_py3k
+from snakeoil.demandload import demandload
+demandload(globals(), 'pkgcore.ebuild:atom')
 
 # TODO: change values.EqualityMatch so it supports le, lt, gt, ge, eq,
 # ne ops, and convert this to it.
@@ -281,6 +283,36 @@ class UseDepDefault(packages.PackageRestrictionMulti):
         packages.PackageRestrictionMulti.__init__(self, ('iuse', 'use'), v)
 
 
+class RevdepRestriction(boolean.OrRestriction):
+
+    """
+    match packages with a dependency intersecting an atom
+
+    Equivalent to an or of depends, rdepends and post_rdepends
+    :obj:`packages.PackageRestriction` instances; kept distinct so
+    repositories indexing dependencies can narrow down what they check
+    via :obj:`atom`.
+    """
+
+    __slots__ = ("atom",)
+
+    attrs = ("depends", "rdepends", "post_rdepends")
+
+    def __init__(self, target, negate=False):
+        """
+        :param target: :obj:`pkgcore.ebuild.atom.atom` dependencies must
+            intersect with
+        """
+        val_restrict = values.FlatteningRestriction(
+            atom.atom,
+            values.AnyMatch(values.FunctionRestriction(target.intersects)))
+        boolean.OrRestriction.__init__(self,
+            *[packages.PackageRestriction(attr, val_restrict)
+              for attr in self.attrs],
+            node_type=restriction.package_type, negate=negate)
+        object.__setattr__(self, "atom", target)
+
+
 def _parse_nontransitive_use(sequence):
     default_off = [[], []]
     default_on = [[], []]
@@ -445,12 +445,23 @@ class ProtectOwned(FileCollision):
         super(ProtectOwned, self).__init__(*args)
         self.vdb = vdb
 
+    def _candidates(self, colliding):
+        paths = [x.location for x in colliding]
+        for repo in self.vdb:
+            owners = getattr(getattr(repo, 'raw_vdb', repo), 'owners', None)
+            if owners is not None:
+                # only the packages the owner index lists need checking.
+                for pkg in owners(paths):
+                    yield pkg
+                continue
+            for pkg in repo:
+                if pkg.package_is_real:
+                    yield pkg
+
     def collision(self, colliding):
-        real_pkgs = (pkg for repo in self.vdb for pkg in repo if pkg.package_is_real)
         collisions = {}
 
-        # TODO: worth parallelizing this vdb scanning?
-        for pkg in real_pkgs:
+        for pkg in self._candidates(colliding):
             pkg_file_collisions = pkg.contents.intersection(colliding)
             if pkg_file_collisions:
                 collisions[pkg.cpvstr] = pkg_file_collisions
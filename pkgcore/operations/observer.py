@@ -53,8 +53,11 @@ class formatter_output(null_output):
 
     def __init__(self, out):
         self._out = out
+        # number of errors reported through this observer.
+        self.errors = 0
 
     def error(self, msg, *args, **kwds):
+        self.errors += 1
         self._out.error(_convert(msg, args, kwds))
 
     def info(self, msg, *args, **kwds):
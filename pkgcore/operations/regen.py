@@ -2,9 +2,16 @@
 # License: GPL2/BSD 3 clause
 
 import time
+from itertools import islice
 from snakeoil import compatibility
 from snakeoil.demandload import demandload
 demandload(globals(),
+    'errno',
+    'multiprocessing',
+    'Queue:Empty',
+    'snakeoil.fileutils:AtomicWriteFile',
+    'pkgcore.ebuild:processor',
+    'pkgcore.log:logger',
     'pkgcore.util.thread_pool:map_async',
 )
 
@@ -21,7 +28,67 @@ def regen_iter(iterable, regen_func, observer, is_thread=False):
             observer.error("caught exception %s while processing %s" % (e, x))
 
 
-def regen_repository(repo, observer, threads=1, pkg_attr='keywords', **options):
+def regen_batch_iter(batches, helper, observer, is_thread=False):
+    """Like :obj:`regen_iter`, for helpers able to regen batches at once."""
+    for batch in batches:
+        try:
+            failures = helper.regen_many(batch)
+        except compatibility.IGNORED_EXCEPTIONS as e:
+            if isinstance(e, KeyboardInterrupt):
+                return
+            raise
+        except Exception as e:
+            failures = [(pkg, e) for pkg in batch]
+        for pkg, e in failures:
+            observer.error("caught exception %s while processing %s" % (e, pkg))
+
+
+def _iter_batches(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        batch = list(islice(iterable, size))
+        if not batch:
+            return
+        yield batch
+
+
+def regen_repository(repo, observer, threads=1, pkg_attr='keywords',
+                     processes=1, changes=None, preload_eclasses=32,
+                     **options):
+    """Regenerate the metadata cache of a repository.
+
+    :param changes: if given, an iterable of ebuild/eclass paths that have
+        changed since the last regen; only the packages affected by those
+        changes are regenerated.  Repositories unable to map changes to
+        packages fall back to a full regen.
+    :param preload_eclasses: number of the repository's most inherited
+        eclasses to preload into each ebuild processor before regen starts;
+        0 disables it, as does disabling eclass caching.  The resultant hit
+        rate is logged.
+    """
+
+    pkgs = repo
+    if changes is not None and hasattr(repo, '_regen_changed_pkgs'):
+        pkgs = repo._regen_changed_pkgs(changes)
+
+    preloader = None
+    if (preload_eclasses and options.get('eclass_caching', True) and
+            hasattr(repo, '_eclass_preloader')):
+        preloader = repo._eclass_preloader(preload_eclasses)
+    with processor.preloading_eclasses(preloader):
+        ret = _regen_repository(repo, pkgs, observer, threads, processes,
+                                **options)
+    if preloader is not None:
+        logger.info("regen of %s: %s", repo, preloader)
+    # regen walked the repo's listings, so it's a good point to store them.
+    repo.save_indexes()
+    return ret
+
+
+def _regen_repository(repo, pkgs, observer, threads, processes, **options):
+    if processes > 1 and hasattr(repo, '_regen_operation_helper'):
+        return regen_repository_processes(repo, observer, processes,
+                                          pkgs=pkgs, **options)
 
     helpers = []
     def _get_repo_helper():
@@ -32,18 +99,189 @@ def regen_repository(repo, observer, threads=1, pkg_attr='keywords', **options):
         helpers.append(helper)
         return helper
 
+    helper = _get_repo_helper()
+    # helpers supporting it are fed batches of packages, sourced via a
+    # single ebuild processor request each.
+    batch_size = getattr(helper, 'batch_size', None)
+    if batch_size:
+        work, regen_func = _iter_batches(pkgs, batch_size), regen_batch_iter
+    else:
+        work, regen_func = pkgs, regen_iter
+
     if threads == 1:
         def passthru(iterable):
             global count
             for x in iterable:
                 yield x
-        regen_iter(passthru(repo), _get_repo_helper(), observer)
+        regen_func(passthru(work), helper, observer)
     else:
+        spare = [helper]
         def get_args():
+            if spare:
+                return (spare.pop(), observer, True)
             return (_get_repo_helper(), observer, True)
-        map_async(repo, regen_iter, per_thread_args=get_args)
+        map_async(work, regen_func, per_thread_args=get_args)
 
     for helper in helpers:
         f = getattr(helper, 'finish', None)
         if f is not None:
             f()
+
+
+def _regen_worker(repo, jobs, results, options):
+    """Worker process for :obj:`regen_repository_processes`.
+
+    Sources metadata for each cpv pulled from jobs, pushing the results back
+    to the writer; the caches themselves are never written to from here.
+    """
+    # any processors we know of were inherited from the parent; they're not
+    # ours to use, nor to shut down.
+    processor.forget_all_processors()
+    # our counts are sent back to the parent's preloader when we're done.
+    preloader = processor.get_eclass_preloader()
+    if preloader is not None:
+        preloader.reset()
+    helper = repo._regen_operation_helper(**options)
+    generate_many = getattr(helper, 'generate_many', None)
+    try:
+        for cpvs in iter(jobs.get, None):
+            pkgs = [repo.package_class(*cpv) for cpv in cpvs]
+            try:
+                if generate_many is not None:
+                    generated = generate_many(pkgs)
+                else:
+                    generated = [(pkg, helper.generate(pkg), None)
+                                 for pkg in pkgs]
+            except compatibility.IGNORED_EXCEPTIONS:
+                raise
+            except Exception as e:
+                generated = [(pkg, None, e) for pkg in pkgs]
+            for pkg, data, error in generated:
+                cpv = (pkg.category, pkg.package, pkg.fullver)
+                if error is not None:
+                    results.put((cpv, None,
+                        "caught exception %s while processing %s" % (error, pkg)))
+                elif data is not None:
+                    results.put((cpv, data, None))
+    finally:
+        helper.finish()
+        processor.shutdown_all_processors()
+        if preloader is not None:
+            results.put((None, (preloader.hits, preloader.misses), None))
+        results.put(None)
+
+
+def regen_repository_processes(repo, observer, processes, pkgs=None,
+                               **options):
+    """Regenerate repo's metadata cache via a pool of worker processes.
+
+    Each worker owns its own ebuild processor (and thus its own set of
+    preloaded eclasses), and sends the sourced metadata back to this
+    process, which is the sole writer to the repository's caches.
+
+    The repository must provide a regen helper supporting the
+    ``generate``/``store`` protocol, in addition to ``finish``.
+
+    :param pkgs: packages to regenerate; defaults to the whole repository.
+    """
+    if pkgs is None:
+        pkgs = repo
+    jobs = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_regen_worker,
+                                       args=(repo, jobs, results, options))
+               for x in xrange(processes)]
+    writer = repo._regen_operation_helper(**options)
+    finished = False
+    try:
+        for worker in workers:
+            worker.start()
+        # jobs are batches of cpvs, each sourced by a single ebuild
+        # processor request if the helper supports it.
+        batch_size = getattr(writer, 'batch_size', 1)
+        for batch in _iter_batches(pkgs, batch_size):
+            jobs.put([(pkg.category, pkg.package, pkg.fullver)
+                      for pkg in batch])
+        for worker in workers:
+            jobs.put(None)
+
+        running = len(workers)
+        while running:
+            try:
+                result = results.get(True, 1)
+            except Empty:
+                # guard against workers dying without saying goodbye.
+                if not any(worker.is_alive() for worker in workers):
+                    observer.error("regen workers exited unexpectedly")
+                    break
+                continue
+            if result is None:
+                running -= 1
+                continue
+            cpv, data, error = result
+            if cpv is None:
+                # eclass preload hits/misses of a worker.
+                preloader = processor.get_eclass_preloader()
+                if preloader is not None:
+                    preloader.count(*data)
+                continue
+            if error is not None:
+                observer.error(error)
+                continue
+            pkg = repo.package_class(*cpv)
+            try:
+                writer.store(pkg, data)
+            except compatibility.IGNORED_EXCEPTIONS:
+                raise
+            except Exception as e:
+                observer.error("caught exception %s while processing %s" % (e, pkg))
+        finished = True
+    finally:
+        if not finished:
+            jobs.cancel_join_thread()
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+        for worker in workers:
+            if worker.pid is not None:
+                worker.join()
+        writer.finish()
+
+
+def read_mtime_snapshot(path):
+    """Read a snapshot written by :obj:`write_mtime_snapshot`.
+
+    :return: mapping of path to mtime, or None if the snapshot doesn't exist
+    """
+    try:
+        f = open(path, 'r')
+    except EnvironmentError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    d = {}
+    with f:
+        for line in f:
+            mtime, fp = line.rstrip('\n').split('\t', 1)
+            d[fp] = long(mtime)
+    return d
+
+
+def write_mtime_snapshot(path, snapshot):
+    """Atomically write a path -> mtime mapping out to path."""
+    f = AtomicWriteFile(path)
+    try:
+        for fp, mtime in sorted(snapshot.iteritems()):
+            f.write("%i\t%s\n" % (mtime, fp))
+    except:
+        f.discard()
+        raise
+    f.close()
+
+
+def diff_mtime_snapshots(old, new):
+    """Return the sorted paths added, removed, or modified between snapshots."""
+    changed = set(old).symmetric_difference(new)
+    changed.update(fp for fp, mtime in new.iteritems()
+                   if fp in old and old[fp] != mtime)
+    return sorted(changed)
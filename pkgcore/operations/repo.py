@@ -209,18 +209,31 @@ class operations(sync_operations):
         return self._cmd_implementation_configure(self.repository, pkg,
             self._get_observer(observer))
 
+    # max number of entries queued for the cache's write-behind thread
+    # during regen.
+    _regen_write_behind_size = 256
+
     @_operations_mod.is_standalone
     def _cmd_api_regen_cache(self, observer=None, threads=1, **options):
         if getattr(self, '_regen_disable_threads', False):
             threads = 1
+            options.pop('processes', None)
         cache = getattr(self.repo, 'cache', None)
         sync_rate = getattr(cache, 'sync_rate', None)
+        # hand entry writes off to a background thread so regen isn't
+        # stalled on each write/rename.
+        write_behind = [x for x in self._get_caches()
+                        if hasattr(x, 'set_write_behind') and not x.readonly]
         try:
             if sync_rate is not None:
                 cache.set_sync_rate(1000000)
+            for x in write_behind:
+                x.set_write_behind(self._regen_write_behind_size)
             return regen.regen_repository(self.repo,
                 self._get_observer(observer), threads=threads, **options)
         finally:
+            for x in write_behind:
+                x.set_write_behind(0)
             if sync_rate is not None:
                 cache.set_sync_rate(sync_rate)
             self.repo.operations.run_if_supported("flush_cache")
@@ -27,6 +27,9 @@ class EclassConsumerSet(VersionedInstalled):
         self.eclasses = frozenset(eclasses)
 
     def __iter__(self):
+        # use the repository's eclass index where it's valid for a package.
+        inherited = getattr(self.portdir, 'eclasses_inherited',
+                            lambda pkg: pkg.inherited)
         for atom in VersionedInstalled.__iter__(self):
             pkgs = self.portdir.match(atom)
             if not pkgs:
@@ -36,5 +39,5 @@ class EclassConsumerSet(VersionedInstalled):
                 continue
             assert len(pkgs) == 1, 'I do not know what I am doing: %r' % (pkgs,)
             pkg = pkgs[0]
-            if self.eclasses.isdisjoint(pkg.data.get('_eclasses_', ())):
+            if not self.eclasses.isdisjoint(inherited(pkg)):
                 yield atom
@@ -8,12 +8,17 @@ wrap a repository, binding configuration to pkgs returned from the repository
 __all__ = ("tree",)
 
 from pkgcore.repository import prototype
+from pkgcore.restrictions import packages, values
 from pkgcore.package.conditionals import make_wrapper
 from pkgcore.operations.repo import operations_proxy
 from snakeoil.currying import partial
 from snakeoil.klass import GetAttrProxy
 
 
+_supported = packages.PackageRestriction("is_supported",
+    values.EqualityMatch(True))
+
+
 class tree(prototype.tree):
     configured = True
 
@@ -55,6 +60,11 @@ class tree(prototype.tree):
             kwds["pkg_klass_override"] = partial(self.package_class, o)
         else:
             kwds["pkg_klass_override"] = self.package_class
+        pkg_filter = kwds.get("pkg_filter")
+        if pkg_filter is not None:
+            # the filter is meant for supported pkgs only.
+            kwds["pkg_filter"] = packages.AndRestriction(_supported,
+                pkg_filter)
         return (x for x in self.raw_repo.itermatch(restrict, **kwds) if x.is_supported)
 
     itermatch.__doc__ = prototype.tree.itermatch.__doc__.replace(
@@ -1,6 +1,9 @@
 # Copyright: 2006-2008 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
+from collections import OrderedDict
+from weakref import WeakValueDictionary
+
 from pkgcore.restrictions import packages
 from pkgcore.package.mutated import MutatedPkg
 from pkgcore.operations.repo import operations_proxy
@@ -61,29 +64,86 @@ class caching_repo(object):
     in memory till the cache is cleared.  General use, not usually what
     you want- if you're making a lot of random queries that are duplicates
     (resolver does this for example), caching helps.
+
+    To bound that cost, max_size limits the number of results held, least
+    recently used dropped first.  Dropped results that were fully pulled can
+    additionally be tracked weakly, and handed back for as long as something
+    else (a resolver choice point, say) keeps them alive.
+
+    :ivar hits: lookups answered from the cache, weakly held results included
+    :ivar weak_hits: lookups answered from weakly held results
+    :ivar misses: lookups that went to the repository
+    :ivar evictions: results dropped to stay within max_size
     """
 
     operations_kls = operations_proxy
 
-    def __init__(self, db, strategy):
+    def __init__(self, db, strategy, max_size=None, weak=False):
         """
         :param db: an instance supporting the repository protocol to cache
           queries from.
         :param strategy: forced sorting strategy for results.  If you don't
           need sorting, pass in iter.
+        :param max_size: if not None, the maximum number of results held.
+        :param weak: if True, results dropped due to max_size are tracked
+          via weakrefs once fully pulled.
         """
         self.__db__ = db
         self.__strategy__ = strategy
-        self.__cache__ = {}
+        self.__max_size__ = max_size
+        if max_size is None:
+            self.__cache__ = {}
+        else:
+            self.__cache__ = OrderedDict()
+        self.__weak__ = WeakValueDictionary() if weak else None
+        self.hits = self.weak_hits = self.misses = self.evictions = 0
 
     def match(self, restrict):
-        v = self.__cache__.get(restrict)
-        if v is None:
-            v = self.__cache__[restrict] = \
-                caching_iter(self.__db__.itermatch(restrict,
-                    sorter=self.__strategy__))
+        cache = self.__cache__
+        v = cache.get(restrict)
+        if v is not None:
+            self.hits += 1
+            if self.__max_size__ is not None:
+                # most recently used goes last.
+                del cache[restrict]
+                cache[restrict] = v
+            return v
+        if self.__weak__ is not None:
+            v = self.__weak__.pop(restrict, None)
+            if v is not None:
+                self.hits += 1
+                self.weak_hits += 1
+                self._store(restrict, v)
+                return v
+        self.misses += 1
+        v = caching_iter(self.__db__.itermatch(restrict,
+            sorter=self.__strategy__))
+        self._store(restrict, v)
         return v
 
+    def _store(self, restrict, v):
+        cache = self.__cache__
+        cache[restrict] = v
+        max_size = self.__max_size__
+        if max_size is None:
+            return
+        weak = self.__weak__
+        while len(cache) > max_size:
+            key, old = cache.popitem(last=False)
+            self.evictions += 1
+            if weak is not None and old.iterable is None:
+                weak[key] = old
+
+    def format_stats(self):
+        """:return: one line summary of the cache counters"""
+        lookups = self.hits + self.misses
+        s = "%i lookups, %i hits (%i from weakrefs), %i misses, " \
+            "%i evictions" % (lookups, self.hits, self.weak_hits,
+                              self.misses, self.evictions)
+        if lookups:
+            s += "; %.1f%% hit rate" % (100.0 * self.hits / lookups,)
+        return s
+
     def itermatch(self, restrict):
         return iter(self.match(restrict))
 
@@ -91,6 +151,8 @@ class caching_repo(object):
 
     def clear(self):
         self.__cache__.clear()
+        if self.__weak__ is not None:
+            self.__weak__.clear()
 
 
 class multiplex_sorting_repo(object):
@@ -100,6 +162,9 @@ class multiplex_sorting_repo(object):
         self.__sorter__ = sorter
 
     def itermatch(self, restrict):
+        merge = getattr(self.__sorter__, 'merge_pkgs', None)
+        if merge is not None:
+            return merge(*[repo.itermatch(restrict) for repo in self.__repos__])
         return iter_sort(self.__sorter__,
             *[repo.itermatch(restrict) for repo in self.__repos__])
 
@@ -135,6 +135,10 @@ class tree(prototype.tree):
         if sorter is iter:
             return (match for repo in self.trees
                 for match in repo.itermatch(restrict, **kwds))
+        merge = getattr(sorter, 'merge_pkgs', None)
+        if merge is not None:
+            return merge(*[repo.itermatch(restrict, **kwds)
+                           for repo in self.trees])
         # ugly, and a bit slow, but works.
         def f(x, y):
             l = sorter([x, y])
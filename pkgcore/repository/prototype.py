@@ -10,12 +10,29 @@ __all__ = ("CategoryIterValLazyDict", "PackageMapping", "VersionMapping",
 
 from pkgcore.ebuild.atom import atom
 from pkgcore.restrictions import values, boolean, restriction, packages
-from pkgcore.restrictions.util import collect_package_restrictions
+from pkgcore.restrictions.util import (collect_package_restrictions,
+    restriction_cost, split_by_cost, CPV_COST)
 
 from snakeoil.mappings import LazyValDict, DictMixin
 from snakeoil.lists import iflatten_instance
 from snakeoil.compatibility import is_py3k
 from pkgcore.operations import repo
+from itertools import ifilter
+from operator import itemgetter
+
+
+def _match_all(matchers):
+    if not matchers:
+        return None
+    elif len(matchers) == 1:
+        return matchers[0]
+    def match(pkg):
+        for f in matchers:
+            if not f(pkg):
+                return False
+        return True
+    return match
+
 
 class IterValLazyDict(LazyValDict):
 
@@ -57,13 +74,27 @@ class CategoryIterValLazyDict(IterValLazyDict):
         return key in self._keys
 
 
-class PackageMapping(DictMixin):
+class _LazyValMapping(DictMixin):
 
     def __init__(self, parent_mapping, pull_vals):
         self._cache = {}
         self._parent = parent_mapping
         self._pull_vals = pull_vals
 
+    def uncached(self, keys):
+        """yield the keys whose values haven't been pulled yet"""
+        cache = self._cache
+        return (key for key in keys if key not in cache)
+
+    def prime(self, items):
+        """store (key, value) pairs pulled elsewhere, for keys not yet pulled"""
+        setdefault = self._cache.setdefault
+        for key, val in items:
+            setdefault(key, val)
+
+
+class PackageMapping(_LazyValMapping):
+
     def __getitem__(self, key):
         o = self._cache.get(key)
         if o is not None:
@@ -86,12 +117,7 @@ class PackageMapping(DictMixin):
             pass
 
 
-class VersionMapping(DictMixin):
-
-    def __init__(self, parent_mapping, pull_vals):
-        self._cache = {}
-        self._parent = parent_mapping
-        self._pull_vals = pull_vals
+class VersionMapping(_LazyValMapping):
 
     def __getitem__(self, key):
         o = self._cache.get(key)
@@ -122,7 +148,11 @@ class tree(object):
     :ivar raw_repo: if wrapping a repo, set raw_repo per instance to it
     :ivar livefs: boolean, set it to True if it's a repository representing
         a livefs
-    :ivar package_class: callable to generate a package instance, must override
+    :ivar package_class: callable to generate a package instance, must override.
+        If it has a prefetch method, itermatch hands it batches of candidate
+        packages (at least prefetch_batch_size, barring the last) prior to
+        matching them.
+    :ivar prefetch_batch_size: see package_class
     :ivar configured: if a repo is unusable for merging/unmerging
         without being configured, set it to False
     :ivar configure: if the repository isn't configured, must be a callable
@@ -136,6 +166,7 @@ class tree(object):
     raw_repo = None
     livefs = False
     package_class = None
+    prefetch_batch_size = 64
     configured = True
     configure = None
     frozen_settable = True
@@ -199,7 +230,8 @@ class tree(object):
         return list(self.itermatch(atom, **kwds))
 
     def itermatch(self, restrict, restrict_solutions=None, sorter=None,
-                  pkg_klass_override=None, force=None, yield_none=False):
+                  pkg_klass_override=None, force=None, yield_none=False,
+                  pkg_filter=None):
 
         """
         generator that yields packages match a restriction.
@@ -218,6 +250,10 @@ class tree(object):
             packages. If you override this method you should yield
             None in long-running loops, strictly calling it for every package
             is not necessary.
+        :param pkg_filter: restriction packages must match as well; unlike
+            restrict, it isn't used to identify candidates and is always
+            matched rather than forced.  Terms of both are matched cheapest
+            first, see :obj:`pkgcore.restrictions.util.restriction_cost`.
         """
 
         if not isinstance(restrict, restriction.base):
@@ -233,30 +269,85 @@ class tree(object):
         else:
             candidates = self._identify_candidates(restrict, sorter)
 
-        if force is None:
-            match = restrict.match
-        elif force:
-            match = restrict.force_True
-        else:
-            match = restrict.force_False
+        pre_match, match = self._cost_ordered_match(restrict, force, pkg_filter)
         return self._internal_match(
             candidates, match, sorter, pkg_klass_override,
-            yield_none=yield_none)
+            yield_none=yield_none, pre_match=pre_match)
 
-    def _internal_gen_candidates(self, candidates, sorter):
+    @staticmethod
+    def _cost_ordered_match(restrict, force, pkg_filter):
+        """
+        :return: (pre_match, match); pre_match covers the terms answered by
+            the cpv alone, and is applied to candidates before their metadata
+            is touched (or batched up for prefetching), match the remainder,
+            cheapest terms first.  Either may be None if there's nothing to
+            match.
+        """
+        if force is None:
+            terms = split_by_cost(restrict)
+            matchers = [(cost, r.match) for cost, r in terms]
+        else:
+            # forcing works on the restriction as a whole; its cpv terms are
+            # still required for forcing it True, so they're matched upfront.
+            if force:
+                matchers = [(cost, r.match)
+                    for cost, r in split_by_cost(restrict) if cost == CPV_COST]
+                forced = restrict.force_True
+            else:
+                matchers = []
+                forced = restrict.force_False
+            matchers.append((restriction_cost(restrict), forced))
+        if pkg_filter is not None:
+            matchers.extend((cost, r.match)
+                for cost, r in split_by_cost(pkg_filter))
+        # stable; equal cost terms of restrict still go first.
+        matchers.sort(key=itemgetter(0))
+        return (_match_all([f for cost, f in matchers if cost == CPV_COST]),
+                _match_all([f for cost, f in matchers if cost != CPV_COST]))
+
+    def _internal_gen_candidates(self, candidates, sorter, pre_match=None):
         pkls = self.package_class
+        prefetch = getattr(pkls, 'prefetch', None)
+        # key based sorters (see pkgcore.util.packages.key_sorter) sort
+        # packages differently than categories and package names.
+        pkg_sorter = getattr(sorter, 'sort_pkgs', sorter)
+        if prefetch is None:
+            for cp in sorter(candidates):
+                pkgs = pkg_sorter(pkls(cp[0], cp[1], ver)
+                                  for ver in self.versions.get(cp, ()))
+                if pre_match is not None:
+                    pkgs = ifilter(pre_match, pkgs)
+                for pkg in pkgs:
+                    yield pkg
+            return
+
+        batch_size = self.prefetch_batch_size
+        batch = []
         for cp in sorter(candidates):
-            for pkg in sorter(pkls(cp[0], cp[1], ver)
-                              for ver in self.versions.get(cp, ())):
+            pkgs = pkg_sorter(pkls(cp[0], cp[1], ver)
+                              for ver in self.versions.get(cp, ()))
+            if pre_match is not None:
+                # only what could match is worth pulling metadata for.
+                pkgs = ifilter(pre_match, pkgs)
+            batch.extend(pkgs)
+            if len(batch) >= batch_size:
+                prefetch(batch)
+                for pkg in batch:
+                    yield pkg
+                batch = []
+        if batch:
+            prefetch(batch)
+            for pkg in batch:
                 yield pkg
 
     def _internal_match(self, candidates, match_func, sorter,
-                        pkg_klass_override, yield_none=False):
-        for pkg in self._internal_gen_candidates(candidates, sorter):
+                        pkg_klass_override, yield_none=False, pre_match=None):
+        for pkg in self._internal_gen_candidates(candidates, sorter,
+                                                 pre_match=pre_match):
             if pkg_klass_override is not None:
                 pkg = pkg_klass_override(pkg)
 
-            if match_func(pkg):
+            if match_func is None or match_func(pkg):
                 yield pkg
             elif yield_none:
                 yield None
@@ -436,6 +527,15 @@ class tree(object):
     def get_operations(self, observer=None):
         return self.operations_kls(self)
 
+    def save_indexes(self):
+        """
+        Write out any on disk indexes built or updated so far, so later
+        instances can skip reading what they cover again.
+
+        Failures are logged rather than raised; repositories without
+        indexes do nothing.
+        """
+
     def __nonzero__(self):
         try:
             iter(self.versions).next()
@@ -28,13 +28,15 @@ class tree(prototype.tree):
     def _expand_vers(self, cp, ver):
         raise NotImplementedError(self, "_expand_vers")
 
-    def _internal_gen_candidates(self, candidates, sorter):
+    def _internal_gen_candidates(self, candidates, sorter, pre_match=None):
         pkls = self.package_class
+        pkg_sorter = getattr(sorter, 'sort_pkgs', sorter)
         for cp in candidates:
-            for pkg in sorter(pkls(provider, cp[0], cp[1], ver)
+            for pkg in pkg_sorter(pkls(provider, cp[0], cp[1], ver)
                 for ver in self.versions.get(cp, ())
                 for provider in self._expand_vers(cp, ver)):
-                yield pkg
+                if pre_match is None or pre_match(pkg):
+                    yield pkg
 
     def _get_categories(self, *optional_category):
         # return if optional_category is passed... cause it's not yet supported
@@ -8,6 +8,7 @@ filtering repository
 __all__ = ("filterTree",)
 
 from pkgcore.repository import prototype, errors
+from pkgcore.restrictions import packages
 from pkgcore.restrictions.restriction import base
 from pkgcore.operations.repo import operations_proxy
 from snakeoil.klass import GetAttrProxy
@@ -36,17 +37,27 @@ class filterTree(prototype.tree):
         self.raw_repo = repo
         if sentinel_val:
             self._filterfunc = ifilter
+            self._pkg_filter = restriction
         else:
             self._filterfunc = filterfalse
+            self._pkg_filter = packages.AndRestriction(restriction,
+                negate=True)
 
     def itermatch(self, restrict, **kwds):
-        # note that this lets the repo do the initial filtering.
-        # better design would to analyze the restrictions, and inspect
-        # the repo, determine what can be done without cost
-        # (determined by repo's attributes) versus what does cost
-        # (metadata pull for example).
-        return self._filterfunc(self.restriction.match,
-            self.raw_repo.itermatch(restrict, **kwds))
+        if not isinstance(self.raw_repo, prototype.tree):
+            return self._filterfunc(self.restriction.match,
+                self.raw_repo.itermatch(restrict, **kwds))
+        # hand the filter down so it's matched along with restrict, cheapest
+        # terms of either first; the filter's cpv terms (masks for example)
+        # then apply before metadata is pulled, and its keyword or license
+        # checks only run for packages restrict's cheap terms accepted.
+        pkg_filter = kwds.get("pkg_filter")
+        if pkg_filter is None:
+            kwds["pkg_filter"] = self._pkg_filter
+        else:
+            kwds["pkg_filter"] = packages.AndRestriction(pkg_filter,
+                self._pkg_filter)
+        return self.raw_repo.itermatch(restrict, **kwds)
 
 
     itermatch.__doc__ = prototype.tree.itermatch.__doc__.replace(
@@ -18,6 +18,7 @@ from pkgcore.ebuild import atom as _atom
 from snakeoil.currying import partial
 from snakeoil.compatibility import cmp, sort_cmp
 from snakeoil.iterables import caching_iter
+from pkgcore.util.packages import key_sorter
 
 
 limiters = set(["cycle"])#, None])
@@ -30,8 +31,8 @@ def dprint(handle, fmt, args=None, label=None):
 
 
 #iter/pkg sorting functions for selection strategy
-pkg_sort_highest = partial(sorted, reverse=True)
-pkg_sort_lowest = sorted
+pkg_sort_highest = key_sorter(reverse=True)
+pkg_sort_lowest = key_sorter()
 
 pkg_grabber = operator.itemgetter(0)
 
@@ -79,6 +80,14 @@ def lowest_iter_sort(l, pkg_grabber=pkg_grabber):
     return l
 
 
+# key based equivalents of the above for merging the per repository results;
+# livefs pkgs win ties either way.
+highest_iter_sorter = key_sorter(
+    lambda pkg: (pkg.sort_key, pkg.repo.livefs), reverse=True)
+lowest_iter_sorter = key_sorter(
+    lambda pkg: (pkg.sort_key, not pkg.repo.livefs))
+
+
 class MutableContainmentRestriction(values.base):
 
     __slots__ = ('_blacklist', 'match')
@@ -229,7 +238,8 @@ class merge_plan(object):
                  global_strategy=None,
                  depset_reorder_strategy=None,
                  process_built_depends=False,
-                 drop_cycles=False, debug=False, debug_handle=None):
+                 drop_cycles=False, debug=False, debug_handle=None,
+                 query_cache_size=None, query_cache_weak=True):
 
         if debug_handle is None:
             debug_handle = sys.stdout
@@ -250,7 +260,8 @@ class merge_plan(object):
         self.depset_reorder = depset_reorder_strategy
         self.per_repo_strategy = per_repo_strategy
         self.total_ordering_strategy = global_strategy
-        self.all_raw_dbs = [misc.caching_repo(x, self.per_repo_strategy) for x in dbs]
+        self.all_raw_dbs = [misc.caching_repo(x, self.per_repo_strategy,
+            max_size=query_cache_size, weak=query_cache_weak) for x in dbs]
         self.all_dbs = global_strategy(self.all_raw_dbs)
         self.default_dbs = self.all_dbs
 
@@ -812,6 +823,14 @@ class merge_plan(object):
         for repo in self.all_raw_dbs:
             repo.clear()
 
+    def iter_cache_stats(self):
+        """
+        yield (repo, summary) for each repository's query cache; see
+        :obj:`pkgcore.repository.misc.caching_repo.format_stats`
+        """
+        for repo in self.all_raw_dbs:
+            yield repo.__db__, repo.format_stats()
+
     # selection strategies for atom matches
 
     def default_depset_reorder_strategy(self, depset, mode):
@@ -859,18 +878,18 @@ class merge_plan(object):
 
     @classmethod
     def prefer_highest_version_strategy(cls, dbs):
-        return misc.multiplex_sorting_repo(highest_iter_sort,
+        return misc.multiplex_sorting_repo(highest_iter_sorter,
             *list(cls.prefer_livefs_dbs(dbs)))
 
     @staticmethod
     def prefer_lowest_version_strategy(dbs):
-        return misc.multiplex_sorting_repo(lowest_iter_sort, *list(dbs))
+        return misc.multiplex_sorting_repo(lowest_iter_sorter, *list(dbs))
 
     @classmethod
     def prefer_reuse_strategy(cls, dbs):
         return multiplex.tree(
-            misc.multiplex_sorting_repo(highest_iter_sort,
+            misc.multiplex_sorting_repo(highest_iter_sorter,
                 *list(cls.just_livefs_dbs(dbs))),
-            misc.multiplex_sorting_repo(highest_iter_sort,
+            misc.multiplex_sorting_repo(highest_iter_sorter,
                 *list(cls.just_nonlivefs_dbs(dbs)))
         )
@@ -7,6 +7,7 @@ restriction related utilities
 
 from pkgcore.restrictions import packages, boolean, restriction
 from snakeoil.lists import iflatten_func
+from operator import itemgetter
 
 def _is_package_instance(inst):
     return (getattr(inst, "type", None) == packages.package_type
@@ -34,3 +35,89 @@ def collect_package_restrictions(restrict, attrs=None, invert=False):
         for r in iflatten_func(restrict, _is_package_instance):
             if invert == attrs.isdisjoint(getattr(r, 'attrs', ())):
                 yield r
+
+
+# relative cost of matching a package restriction; see restriction_cost.
+CPV_COST = 0
+METADATA_COST = 1
+DEPSET_COST = 2
+
+# attributes answered from the cpv (or the repository it's from) alone.
+cpv_attrs = frozenset(["category", "package", "key", "cpvstr", "version",
+    "revision", "fullver", "versioned_atom", "unversioned_atom", "repo",
+    "repo.repo_id", "repo_id"])
+
+# attributes requiring metadata parsed into a depset, or worse (the
+# environment dump, contents of an installed pkg).
+depset_attrs = frozenset(["depends", "rdepends", "post_rdepends",
+    "fetchables", "license", "src_uri", "provides", "restrict",
+    "required_use", "properties", "environment", "contents"])
+
+
+# costs of recently seen large boolean restrictions (visibility filters for
+# example, which can be made up of thousands of atoms and are costed for every
+# query), by id.
+_cost_cache = {}
+_cost_cache_size = 128
+_cost_cache_min = 16
+
+
+def _attr_cost(attr):
+    if attr in cpv_attrs:
+        return CPV_COST
+    elif attr in depset_attrs:
+        return DEPSET_COST
+    return METADATA_COST
+
+
+def restriction_cost(restrict):
+    """Estimate the relative cost of matching a package restriction.
+
+    :return: :obj:`CPV_COST` if it only looks at the cpv, :obj:`METADATA_COST`
+        if it needs package metadata, :obj:`DEPSET_COST` for depsets and
+        anything that can't be analyzed (delegates, for example)
+    """
+    if isinstance(restrict, restriction.AlwaysBool):
+        return CPV_COST
+    elif isinstance(restrict, boolean.base):
+        restricts = restrict.restrictions
+        if len(restricts) < _cost_cache_min:
+            return max([restriction_cost(x) for x in restricts] or [CPV_COST])
+        cached = _cost_cache.get(id(restrict))
+        if cached is not None and cached[0] is restrict:
+            return cached[1]
+        cost = max(restriction_cost(x) for x in restricts)
+        if len(_cost_cache) >= _cost_cache_size:
+            _cost_cache.clear()
+        _cost_cache[id(restrict)] = (restrict, cost)
+        return cost
+    elif isinstance(restrict, packages.Conditional):
+        return DEPSET_COST
+    attrs = getattr(restrict, 'attrs', None)
+    if attrs is None:
+        attr = getattr(restrict, 'attr', None)
+        if attr is None:
+            return DEPSET_COST
+        attrs = (attr,)
+    return max(_attr_cost(x) for x in attrs)
+
+
+def split_by_cost(restrict):
+    """Split a package restriction into the terms that must all match.
+
+    Non negated AndRestrictions (atoms included) are flattened into their
+    terms, which are returned as (cost, restriction) pairs ordered cheapest
+    first; anything else is a single term.
+    """
+    terms = []
+    stack = [restrict]
+    while stack:
+        r = stack.pop()
+        if (isinstance(r, boolean.AndRestriction) and not r.negate and
+                r.type == packages.package_type):
+            stack.extend(reversed(r.restrictions))
+        else:
+            terms.append((restriction_cost(r), r))
+    # stable, so terms of equal cost keep their order.
+    terms.sort(key=itemgetter(0))
+    return terms
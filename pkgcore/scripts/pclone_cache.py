@@ -10,6 +10,7 @@ __all__ = ("argparser", "main")
 import time
 
 from pkgcore.util import commandline
+from snakeoil.currying import partial
 
 argparser = commandline.mk_argparser(domain=False, description=__doc__)
 argparser.add_argument("-v", "--verbose", action='store_true',
@@ -23,6 +24,24 @@ argparser.add_argument("target", config_type='cache',
     priority=21,
     help="target cache to update.  Must be writable.")
 
+def _convert_eclasses(source, target, eclass_cache, value):
+    """
+    convert a serialized _eclasses_ value of source to target's eclass chf
+    types, taking the chfs from the eclasses of eclass_cache
+
+    :raise KeyError: if an eclass isn't in eclass_cache
+    """
+    if not value:
+        return value
+    serializers = target.eclass_chf_serializers
+    l = []
+    for eclass in value.split('\t')[::len(source.eclass_chf_types) + 1]:
+        chksums = eclass_cache.eclasses[eclass]
+        l.append(eclass)
+        l.extend(f(chksums) for f in serializers)
+    return '\t'.join(l)
+
+
 @argparser.bind_main_func
 def main(options, out, err):
     if options.target.readonly:
@@ -31,21 +50,46 @@ def main(options, out, err):
         return 1
 
     source, target = options.source, options.target
+    if source.chf_type != target.chf_type:
+        out.error("can't clone cache '%s' to '%s'; ebuild %s checksums can't "
+            "be converted to %s" % (source, target, source.chf_type,
+            target.chf_type))
+        return 1
+    convert_eclasses = None
+    if tuple(source.eclass_chf_types) != tuple(target.eclass_chf_types):
+        # eclass chfs are taken from the eclasses the source is validated
+        # against.
+        eclass_cache = getattr(source, 'ec', None)
+        if eclass_cache is None:
+            out.error("can't clone cache '%s' to '%s'; they use different "
+                "eclass checksums, and '%s' has no eclass cache to convert "
+                "them with" % (source, target, source))
+            return 1
+        convert_eclasses = partial(_convert_eclasses, source, target,
+            eclass_cache)
     if not target.autocommits:
         target.sync_rate = 1000
     if options.verbose:
         out.write("grabbing target's existing keys")
     valid = set()
     start = time.time()
-    if options.verbose:
-        for k, v in source.iteritems():
+    # entries are copied in serialized form, converting between backend
+    # formats without reconstructing them.
+    for k in source.iterkeys():
+        try:
+            v = source.get_serialized_entry(k)
+        except KeyError:
+            continue
+        if convert_eclasses is not None and '_eclasses_' in v:
+            try:
+                v['_eclasses_'] = convert_eclasses(v['_eclasses_'])
+            except KeyError as e:
+                out.warn("skipping %s; eclass %s wasn't found" % (k, e))
+                continue
+        if options.verbose:
             out.write("updating %s" % (k,))
-            target[k] = v
-            valid.add(k)
-    else:
-        for k, v in source.iteritems():
-            target[k] = v
-            valid.add(k)
+        target.set_serialized_entry(k, v)
+        valid.add(k)
 
     for x in target.iterkeys():
         if not x in valid:
@@ -53,5 +97,8 @@ def main(options, out, err):
                 out.write("deleting %s" % (x,))
             del target[x]
 
+    # even for autocommitting caches; this stores the eclass index.
+    target.commit()
+
     if options.verbose:
         out.write("took %i seconds" % int(time.time() - start))
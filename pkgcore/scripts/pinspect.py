@@ -217,6 +217,13 @@ class eclass_usage_kls(histo_data):
         "repositories")
 
     def get_data(self, repo, options):
+        iter_consumers = getattr(repo, 'iter_eclass_consumers', None)
+        if iter_consumers is not None:
+            # use the repository's eclass index where it's valid, instead
+            # of loading the metadata of every package.
+            data = dict((eclass, len(cpvs)) for eclass, cpvs in
+                        iter_consumers())
+            return data, len(repo)
         pos, data = 0, defaultdict(lambda:0)
         for pos, pkg in enumerate(repo):
             for eclass in getattr(pkg, 'inherited', ()):
@@ -286,6 +293,8 @@ class distfiles_usage_kls(histo_data):
                 for fetchable in iflatten_instance(pkg.fetchables, fetch.fetchable):
                     owners[fetchable.filename].add(key)
                     items[fetchable.filename] = fetchable.chksums.get("size", 0)
+        # every Manifest was read; keep them for next time.
+        repo.save_indexes()
 
         data = defaultdict(lambda:0)
         for filename, keys in owners.iteritems():
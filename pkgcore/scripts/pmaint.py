@@ -7,6 +7,7 @@ repository maintainence
 """
 
 __all__ = ("sync", "sync_main", "copy", "copy_main", "regen", "regen_main",
+    "cache_server", "cache_server_main",
     "perl_rebuild", "perl_rebuild_main", "env_update", "env_update_main")
 
 from pkgcore.util import commandline
@@ -17,13 +18,14 @@ demandload(globals(),
     'time',
     'snakeoil.osutils:pjoin,listdir_dirs',
     'pkgcore:spawn',
-    'pkgcore.operations:observer',
+    'pkgcore.operations:observer,regen@regen_ops',
     'pkgcore.repository:multiplex',
     'pkgcore.package:mutated',
     'pkgcore.fs:contents,livefs',
     'pkgcore.ebuild:processor,triggers',
     'pkgcore.merge:triggers@merge_triggers',
     'pkgcore.sync:base@sync_base',
+    'pkgcore.cache:remote@remote_cache',
     're',
 )
 
@@ -168,12 +170,32 @@ regen.add_argument("--disable-eclass-caching", action='store_true',
     "this optimization via this option results in ~2x slower "
     "regeneration. Disable it only if you suspect the optimization "
     "is somehow causing issues.")
+regen.add_argument("--preload-eclasses", type=int, default=32, metavar='N',
+    help="number of the repository's most inherited eclasses (per its "
+    "metadata cache) to preload into each ebuild processor before regen "
+    "starts; 0 disables it")
 regen.add_argument("-t", "--threads", type=int,
     default=commandline.DelayedValue(_get_default_jobs, 100),
     help="number of threads to use for regeneration.  Defaults to using all "
     "available processors")
+regen.add_argument("-p", "--processes", type=int, default=1,
+    help="number of worker processes to use for regeneration; if more than "
+    "one, this is used instead of threads.  Each process sources metadata "
+    "with its own ebuild processor, while the main process writes the "
+    "results to the cache")
 regen.add_argument("--force", action='store_true', default=False,
     help="force regeneration to occur regardless of staleness checks")
+regen.add_argument("--changed-paths", type=commandline.argparse.FileType(),
+    default=None, metavar='FILE',
+    help="incremental regen; FILE lists the ebuilds and eclasses changed "
+    "since the last regen, one path per line (relative to the repository, "
+    "or absolute).  Only the affected packages are regenerated. '-' reads "
+    "from stdin")
+regen.add_argument("--mtime-snapshot", default=None, metavar='FILE',
+    help="incremental regen; FILE holds the ebuild and eclass mtimes recorded "
+    "by the previous regen, and is diffed against the repository to find "
+    "what changed.  If FILE doesn't exist a full regen is done.  FILE is "
+    "updated afterwards, unless errors were encountered")
 regen.add_argument("--rsync", action='store_true', default=False,
     help="perform actions necessary for rsync repos (update metadata/timestamp.chk)")
 regen.add_argument("-v", "--verbose", action='store_true', default=False,
@@ -189,10 +211,38 @@ def regen_main(options, out, err):
         out.write("repository %s doesn't support cache regeneration" % (repo,))
         return 0
 
+    changes = snapshot = None
+    if options.changed_paths is not None:
+        changes = [x.strip() for x in options.changed_paths]
+        changes = [x for x in changes if x]
+    if options.mtime_snapshot is not None:
+        if not hasattr(repo, 'mtime_snapshot'):
+            err.write("repository %s doesn't support mtime snapshots" % (repo,))
+            return 1
+        snapshot = repo.mtime_snapshot()
+        old = regen_ops.read_mtime_snapshot(options.mtime_snapshot)
+        if old is None:
+            # nothing to diff against; regen everything.
+            changes = None
+        else:
+            changes = (changes or []) + regen_ops.diff_mtime_snapshots(
+                old, snapshot)
+
     start_time = time.time()
+    obs = observer.formatter_output(out)
     repo.operations.regen_cache(threads=options.threads,
-        observer=observer.formatter_output(out), force=options.force,
-            eclass_caching=(not options.disable_eclass_caching))
+        processes=options.processes, changes=changes,
+        observer=obs, force=options.force,
+            eclass_caching=(not options.disable_eclass_caching),
+            preload_eclasses=options.preload_eclasses)
+    if snapshot is not None:
+        if obs.errors:
+            # the failed packages have to be picked up by the next run,
+            # so leave the previous snapshot as the base to diff against.
+            err.write("regen of %s had %i errors, not updating mtime "
+                "snapshot %s" % (repo, obs.errors, options.mtime_snapshot))
+        else:
+            regen_ops.write_mtime_snapshot(options.mtime_snapshot, snapshot)
     end_time = time.time()
     if options.verbose:
         out.write("finished %d nodes in %.2f seconds" % (len(repo),
@@ -208,6 +258,35 @@ def regen_main(options, out, err):
     return 0
 
 
+cache_server = subparsers.add_parser("cache-server", parents=shared_options,
+    description="serve a repository's metadata cache to other processes; "
+    "configure clients with a cache section of class "
+    "pkgcore.cache.remote.database, with location set to the socket")
+cache_server.add_argument("--socket", required=True, metavar='PATH',
+    help="path of the unix socket to listen on")
+cache_server.add_argument("--check-interval", type=float, default=None,
+    metavar='SECONDS',
+    help="how often to check the cache for changed entries")
+cache_server.add_argument("repo", action=commandline.StoreRepoObject,
+    help="repository whose cache to serve")
+@cache_server.bind_main_func
+def cache_server_main(options, out, err):
+    """Serve a repository's cache over a unix socket."""
+    caches = getattr(options.repo, 'cache', ())
+    if hasattr(caches, 'commit'):
+        caches = [caches]
+    if not caches:
+        err.write("repository %s has no cache to serve" % (options.repo,))
+        return 1
+    out.write("serving cache %s on %s" % (caches[0], options.socket))
+    try:
+        remote_cache.serve(caches[0], options.socket,
+            check_interval=options.check_interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
 perl_rebuild = subparsers.add_parser("perl-rebuild",
     parents=(commandline.mk_argparser(add_help=False),),
     description="EXPERIMENTAL: perl-rebuild support for use after upgrading perl")
@@ -293,6 +372,8 @@ def mirror_main(options, out, err):
                 return 2
             out.info("ignoring..\n")
             continue
+    for repo in domain.repos_raw.itervalues():
+        repo.save_indexes()
     if warnings:
         return 1
     return 0
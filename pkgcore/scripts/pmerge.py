@@ -9,7 +9,7 @@ __all__ = ("argparser", "AmbiguousQuery", "NoMatches")
 
 from time import time
 
-from pkgcore.ebuild import resolver
+from pkgcore.ebuild import processor, resolver
 from pkgcore.ebuild.atom import atom
 from pkgcore.merge import errors as merge_errors
 from pkgcore.operations import observer, format
@@ -17,6 +17,7 @@ from pkgcore.resolver.util import reduce_to_failures
 from pkgcore.restrictions import packages, values
 from pkgcore.restrictions.boolean import AndRestriction, OrRestriction
 from pkgcore.util import commandline, parserestrict, repo_utils, argparse
+from pkgcore.util.packages import sort_key_getter
 
 from snakeoil.compatibility import IGNORED_EXCEPTIONS
 from snakeoil.currying import partial
@@ -89,6 +90,12 @@ resolution_options.add_argument('--preload-vdb-state', action='store_true',
           "disabled, it's possible for the requested action to conflict with "
           "already installed dependencies that aren't involved in the graph of "
           "the requested operation."))
+resolution_options.add_argument('--query-cache-size', type=int,
+    metavar='ENTRIES',
+    help=("limit the resolver to caching this many query results per "
+          "repository, dropping the least recently used; lowers memory use "
+          "of large resolutions (world updates for example) at some cost "
+          "in speed.  0 disables the cache.  Unlimited by default."))
 resolution_options.add_argument('-i', '--ignore-cycles', action='store_true',
     help=("ignore cycles if they're found to be unbreakable;"
            "a depends on b, and b depends on a, with neither built is an "
@@ -244,6 +251,30 @@ def display_failures(out, sequence, first_level=True, debug=False):
         for x in xrange(3):
             out.first_prefix.pop()
 
+def plan_eclass_preloader(changes, limit=16):
+    """Return a preloader for the eclasses most inherited by the ebuilds to build.
+
+    Eclasses are ranked by the number of ebuilds in changes inheriting them
+    (per their cache entries); see
+    :obj:`pkgcore.ebuild.processor.EclassPreloader.from_consumers`.
+    """
+    consumers = {}
+    eclass_caches = []
+    for op in changes:
+        pkg = op.pkg
+        if op.desc == "remove" or pkg.built:
+            continue
+        ec = getattr(pkg.repo, 'eclass_cache', None)
+        if ec is None:
+            continue
+        if not any(ec is x for x in eclass_caches):
+            eclass_caches.append(ec)
+        for eclass in getattr(pkg, 'inherited', ()):
+            consumers.setdefault(eclass, []).append(pkg)
+    return processor.EclassPreloader.from_consumers(
+        eclass_caches, consumers.iteritems(), limit)
+
+
 def slotatom_if_slotted(repos, checkatom):
     """check repos for more than one slot of given atom"""
 
@@ -277,6 +308,8 @@ def update_worldset(world_set, pkg, remove=False):
 
 @argparser.bind_final_check
 def _validate(parser, namespace):
+    if namespace.query_cache_size is not None and namespace.query_cache_size < 0:
+        parser.error("--query-cache-size must be 0 or more")
     if namespace.unmerge:
         if namespace.set:
             parser.error("Using sets with -C probably isn't wise, aborting")
@@ -464,6 +497,8 @@ def main(options, out, err):
         extra_kwargs['resolver_cls'] = resolver.empty_tree_merge_plan
     if options.debug:
         extra_kwargs['debug'] = True
+    if options.query_cache_size is not None:
+        extra_kwargs['query_cache_size'] = options.query_cache_size
 
     # XXX: This should recurse on deep
     if options.newuse:
@@ -474,7 +509,7 @@ def main(options, out, err):
         for inst_pkg in installed_repos.itermatch(restrict):
             src_pkgs = source_repos.match(inst_pkg.versioned_atom)
             if src_pkgs:
-                src_pkg = max(src_pkgs)
+                src_pkg = max(src_pkgs, key=sort_key_getter)
                 inst_iuse = set(use.lstrip("+-") for use in inst_pkg.iuse)
                 src_iuse = set(use.lstrip("+-") for use in src_pkg.iuse)
                 inst_flags = inst_iuse.intersection(inst_pkg.use)
@@ -521,8 +556,16 @@ def main(options, out, err):
         ret = resolver_inst.add_atoms(atoms, finalize=True)
     resolve_time = time() - resolve_time
 
+    # keep the installed packages' indexes built while resolving for next
+    # time.
+    for repo in repo_utils.get_raw_repos(installed_repos.repositories):
+        repo.save_indexes()
+
     if options.debug:
         out.write(out.bold, " * ", out.reset, "resolution took %.2f seconds" % resolve_time)
+        for repo, stats in resolver_inst.iter_cache_stats():
+            out.write(out.bold, " * ", out.reset,
+                "query cache for %s: %s" % (repo, stats))
 
     if failures:
         out.write()
@@ -624,122 +667,129 @@ def main(options, out, err):
 
     change_count = len(changes)
 
+    # eclasses shared by the ebuilds being built are preloaded into the
+    # ebuild processors doing the building.
+    preloader = None
+    if not options.fetchonly:
+        preloader = plan_eclass_preloader(changes)
+
     # left in place for ease of debugging.
     cleanup = []
-    try:
-        for count, op in enumerate(changes):
-            for func in cleanup:
-                func()
-
-            cleanup = []
+    with processor.preloading_eclasses(preloader):
+        try:
+            for count, op in enumerate(changes):
+                for func in cleanup:
+                    func()
 
-            out.write("\nProcessing %i of %i: %s" % (count + 1, change_count,
-                op.pkg.cpvstr))
-            out.title("%i/%i: %s" % (count + 1, change_count, op.pkg.cpvstr))
-            if op.desc != "remove":
-                cleanup = [op.pkg.release_cached_data]
+                cleanup = []
 
-                if not options.fetchonly and options.debug:
-                    out.write("Forcing a clean of workdir")
+                out.write("\nProcessing %i of %i: %s" % (count + 1, change_count,
+                    op.pkg.cpvstr))
+                out.title("%i/%i: %s" % (count + 1, change_count, op.pkg.cpvstr))
+                if op.desc != "remove":
+                    cleanup = [op.pkg.release_cached_data]
 
-                pkg_ops = domain.pkg_operations(op.pkg, observer=build_obs)
-                out.write("\n%i files required-" % len(op.pkg.fetchables))
-                try:
-                    ret = pkg_ops.run_if_supported("fetch", or_return=True)
-                except IGNORED_EXCEPTIONS:
-                    raise
-                except Exception as e:
-                    ret = e
-                if ret is not True:
-                    if ret is False:
-                        ret = None
-                    commandline.dump_error(out, ret,
-                       "\nfetching failed for %s" % (op.pkg.cpvstr,))
-                    if not options.ignore_failures:
-                        return 1
-                    continue
-                if options.fetchonly:
-                    continue
+                    if not options.fetchonly and options.debug:
+                        out.write("Forcing a clean of workdir")
 
-                buildop = pkg_ops.run_if_supported("build", or_return=None)
-                pkg = op.pkg
-                if buildop is not None:
-                    out.write("building %s" % (op.pkg.cpvstr,))
-                    result = False
+                    pkg_ops = domain.pkg_operations(op.pkg, observer=build_obs)
+                    out.write("\n%i files required-" % len(op.pkg.fetchables))
                     try:
-                        result = buildop.finalize()
-                    except format.errors as e:
-                        out.error("caught exception building %s: % s" % (op.pkg.cpvstr, e))
-                    else:
-                        if result is False:
-                            out.error("failed building %s" % (op.pkg.cpvstr,))
-                    if result is False:
+                        ret = pkg_ops.run_if_supported("fetch", or_return=True)
+                    except IGNORED_EXCEPTIONS:
+                        raise
+                    except Exception as e:
+                        ret = e
+                    if ret is not True:
+                        if ret is False:
+                            ret = None
+                        commandline.dump_error(out, ret,
+                           "\nfetching failed for %s" % (op.pkg.cpvstr,))
                         if not options.ignore_failures:
                             return 1
                         continue
-                    pkg = result
-                    cleanup.append(pkg.release_cached_data)
-                    pkg_ops = domain.pkg_operations(pkg, observer=build_obs)
-                    cleanup.append(buildop.cleanup)
-
-                cleanup.append(partial(pkg_ops.run_if_supported, "cleanup"))
-                pkg = pkg_ops.run_if_supported("localize", or_return=pkg)
-                # wipe this to ensure we don't inadvertantly use it further down;
-                # we aren't resetting it after localizing, so could have the wrong
-                # set of ops.
-                del pkg_ops
-
-                out.write()
-                if op.desc == "replace":
-                    if op.old_pkg == pkg:
-                        out.write(">>> Reinstalling %s" % (pkg.cpvstr))
+                    if options.fetchonly:
+                        continue
+
+                    buildop = pkg_ops.run_if_supported("build", or_return=None)
+                    pkg = op.pkg
+                    if buildop is not None:
+                        out.write("building %s" % (op.pkg.cpvstr,))
+                        result = False
+                        try:
+                            result = buildop.finalize()
+                        except format.errors as e:
+                            out.error("caught exception building %s: % s" % (op.pkg.cpvstr, e))
+                        else:
+                            if result is False:
+                                out.error("failed building %s" % (op.pkg.cpvstr,))
+                        if result is False:
+                            if not options.ignore_failures:
+                                return 1
+                            continue
+                        pkg = result
+                        cleanup.append(pkg.release_cached_data)
+                        pkg_ops = domain.pkg_operations(pkg, observer=build_obs)
+                        cleanup.append(buildop.cleanup)
+
+                    cleanup.append(partial(pkg_ops.run_if_supported, "cleanup"))
+                    pkg = pkg_ops.run_if_supported("localize", or_return=pkg)
+                    # wipe this to ensure we don't inadvertantly use it further down;
+                    # we aren't resetting it after localizing, so could have the wrong
+                    # set of ops.
+                    del pkg_ops
+
+                    out.write()
+                    if op.desc == "replace":
+                        if op.old_pkg == pkg:
+                            out.write(">>> Reinstalling %s" % (pkg.cpvstr))
+                        else:
+                            out.write(">>> Replacing %s with %s" % (
+                                op.old_pkg.cpvstr, pkg.cpvstr))
+                        i = domain.replace_pkg(op.old_pkg, pkg, repo_obs)
+                        cleanup.append(op.old_pkg.release_cached_data)
                     else:
-                        out.write(">>> Replacing %s with %s" % (
-                            op.old_pkg.cpvstr, pkg.cpvstr))
-                    i = domain.replace_pkg(op.old_pkg, pkg, repo_obs)
-                    cleanup.append(op.old_pkg.release_cached_data)
+                        out.write(">>> Installing %s" % (pkg.cpvstr,))
+                        i = domain.install_pkg(pkg, repo_obs)
+
+                    # force this explicitly- can hold onto a helluva lot more
+                    # then we would like.
                 else:
-                    out.write(">>> Installing %s" % (pkg.cpvstr,))
-                    i = domain.install_pkg(pkg, repo_obs)
+                    out.write(">>> Removing %s" % op.pkg.cpvstr)
+                    i = domain.uninstall_pkg(op.pkg, repo_obs)
+                try:
+                    ret = i.finish()
+                except merge_errors.BlockModification as e:
+                    out.error("Failed to merge %s: %s" % (op.pkg, e))
+                    if not options.ignore_failures:
+                        return 1
+                    continue
 
-                # force this explicitly- can hold onto a helluva lot more
-                # then we would like.
-            else:
-                out.write(">>> Removing %s" % op.pkg.cpvstr)
-                i = domain.uninstall_pkg(op.pkg, repo_obs)
-            try:
-                ret = i.finish()
-            except merge_errors.BlockModification as e:
-                out.error("Failed to merge %s: %s" % (op.pkg, e))
-                if not options.ignore_failures:
-                    return 1
-                continue
-
-            # while this does get handled through each loop, wipe it now; we don't need
-            # that data, thus we punt it now to keep memory down.
-            # for safety sake, we let the next pass trigger a release also-
-            # mainly to protect against any code following triggering reloads
-            # basically, be protective
-
-            if world_set is not None:
-                if op.desc == "remove":
-                    out.write('>>> Removing %s from world file' % op.pkg.cpvstr)
-                    removal_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
-                    update_worldset(world_set, removal_pkg, remove=True)
-                elif not options.oneshot and any(x.match(op.pkg) for x in atoms):
-                    if not options.upgrade:
-                        out.write('>>> Adding %s to world file' % op.pkg.cpvstr)
-                        add_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
-                        update_worldset(world_set, add_pkg)
-
-
-#    again... left in place for ease of debugging.
-#    except KeyboardInterrupt:
-#        import pdb;pdb.set_trace()
-#    else:
-#        import pdb;pdb.set_trace()
-    finally:
-        pass
+                # while this does get handled through each loop, wipe it now; we don't need
+                # that data, thus we punt it now to keep memory down.
+                # for safety sake, we let the next pass trigger a release also-
+                # mainly to protect against any code following triggering reloads
+                # basically, be protective
+
+                if world_set is not None:
+                    if op.desc == "remove":
+                        out.write('>>> Removing %s from world file' % op.pkg.cpvstr)
+                        removal_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
+                        update_worldset(world_set, removal_pkg, remove=True)
+                    elif not options.oneshot and any(x.match(op.pkg) for x in atoms):
+                        if not options.upgrade:
+                            out.write('>>> Adding %s to world file' % op.pkg.cpvstr)
+                            add_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
+                            update_worldset(world_set, add_pkg)
+
+
+#        again... left in place for ease of debugging.
+#        except KeyboardInterrupt:
+#            import pdb;pdb.set_trace()
+#        else:
+#            import pdb;pdb.set_trace()
+        finally:
+            pass
 
     # the final run from the loop above doesn't invoke cleanups;
     # we could ignore it, but better to run it to ensure nothing is inadvertantly
@@ -752,5 +802,7 @@ def main(options, out, err):
     # memory.
     cleanup = []
 
+    if preloader is not None and options.debug:
+        out.write(out.bold, " * ", out.reset, "eclass preloading: %s" % (preloader,))
     out.write("finished")
     return 0
@@ -6,7 +6,7 @@
 """Extract information from repositories."""
 
 from pkgcore.restrictions import packages, values, boolean, restriction
-from pkgcore.ebuild import conditionals, atom
+from pkgcore.ebuild import conditionals, atom, restricts
 from pkgcore.util import (
     commandline, repo_utils, parserestrict, packages as pkgutils)
 from snakeoil.currying import partial
@@ -538,12 +538,7 @@ def parse_revdep(value):
         targetatom = atom.atom(value)
     except atom.MalformedAtom as e:
         raise parserestrict.ParseError(str(e))
-    val_restrict = values.FlatteningRestriction(
-        atom.atom,
-        values.AnyMatch(values.FunctionRestriction(targetatom.intersects)))
-    return packages.OrRestriction(*list(
-            packages.PackageRestriction(dep, val_restrict)
-            for dep in ('depends', 'rdepends', 'post_rdepends')))
+    return restricts.RevdepRestriction(targetatom)
 
 def _revdep_pkgs_match(pkgs, value):
     return any(value.match(pkg) for pkg in pkgs)
@@ -804,15 +799,17 @@ def main(options, out, err):
     for repo in options.repos:
         try:
             for pkgs in pkgutils.groupby_pkg(
-                repo.itermatch(options.query, sorter=sorted)):
+                repo.itermatch(options.query, sorter=pkgutils.key_sorter())):
                 pkgs = list(pkgs)
                 if options.noversion:
                     print_packages_noversion(options, out, err, pkgs)
                 elif options.min or options.max:
                     if options.min:
-                        print_package(options, out, err, min(pkgs))
+                        print_package(options, out, err,
+                            min(pkgs, key=pkgutils.sort_key_getter))
                     if options.max:
-                        print_package(options, out, err, max(pkgs))
+                        print_package(options, out, err,
+                            max(pkgs, key=pkgutils.sort_key_getter))
                 else:
                     for pkg in pkgs:
                         print_package(options, out, err, pkg)
@@ -831,3 +828,7 @@ def main(options, out, err):
             err.write('repo: %r' % (repo,))
             err.write('restrict: %r' % (options.query,))
             raise
+
+    # keep any indexes built for the query for next time.
+    for repo in repo_utils.get_raw_repos(options.repos):
+        repo.save_indexes()
@@ -128,6 +128,44 @@ class BaseTest(TestCase):
             sorted([('foon', (('mtime', 2L),)), ('spork', (('mtime', 1L),))]),
             sorted(self.cache['spork']['_eclasses_']))
 
+    def test_get_many(self):
+        self.cache = self.get_db()
+        self.cache['spork'] = {'foo': 'bar'}
+        self.cache['foon'] = {'foo': 'dar'}
+        self.assertEqual({'spork': {'foo': 'bar'}},
+            self.cache.get_many(['spork', 'missing']))
+
+    def test_validate_entries(self):
+        self.cache = self.get_db()
+        calls = []
+        class eclass_db(object):
+            def rebuild_cache_entry(self, entry_eclasses):
+                calls.append(entry_eclasses)
+                return dict(entry_eclasses)
+        foo = [('foo', (('mtime', 1L),))]
+        bar = [('bar', (('mtime', 2L),))]
+        chf_key = self.cache._chf_key
+        entries = [({chf_key: 100, '_eclasses_': list(foo)}, _chf_obj),
+                   ({chf_key: 100, '_eclasses_': list(foo)}, _chf_obj),
+                   ({chf_key: 100, '_eclasses_': list(bar)}, _chf_obj),
+                   ({chf_key: 100}, _chf_obj),
+                   ({chf_key: 1}, _chf_obj)]
+        self.assertEqual([True, True, True, True, False],
+            self.cache.validate_entries(entries, eclass_db()))
+        # each distinct _eclasses_ is only checked once.
+        self.assertEqual(sorted(calls), sorted([bar, foo]))
+        self.assertEqual(entries[0][0]['_eclasses_'], dict(foo))
+
+    def test_reconstruct_eclasses_shared(self):
+        self.cache = self.get_db()
+        eclasses = {'spork': _mk_chf_obj(mtime=1)}
+        self.cache['spork'] = {'_eclasses_': eclasses}
+        self.cache['foon'] = {'_eclasses_': eclasses}
+        spork = self.cache['spork']['_eclasses_']
+        self.assertIdentical(spork, self.cache['foon']['_eclasses_'])
+        self.assertEqual([('spork', (('mtime', 1L),))], list(spork))
+        self.assertEqual(spork.validation_key[1], 'spork\t1')
+
     def test_readonly(self):
         self.cache = self.get_db()
         self.cache['spork'] = {'foo':'bar'}
@@ -0,0 +1,115 @@
+# License: GPL2/BSD
+
+import os
+
+from pkgcore.test.cache import util, test_base
+from pkgcore.cache import binary, errors, flat_hash
+from snakeoil.chksum import LazilyHashedPath
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+
+class db(binary.database):
+
+    def __setitem__(self, cpv, data):
+        data['_chf_'] = test_base._chf_obj
+        return binary.database.__setitem__(self, cpv, data)
+
+    def __getitem__(self, cpv):
+        d = dict(binary.database.__getitem__(self, cpv).iteritems())
+        d.pop('_%s_' % self.chf_type, None)
+        return d
+
+
+class TestBinary(util.GenericCacheMixin, TempDirMixin):
+
+    def get_db(self, readonly=False):
+        return db(self.dir,
+            auxdbkeys=self.cache_keys, readonly=readonly)
+
+    def test_roundtrip(self):
+        cache = self.get_db()
+        eclasses = {'foo': test_base._mk_chf_obj(mtime=100),
+                    'bar': test_base._mk_chf_obj(mtime=2 ** 40)}
+        cache['dev-util/foo-1'] = {'SLOT': '0', 'KEYWORDS': 'x86 ~amd64',
+            'RDEPEND': '', '_eclasses_': eclasses}
+        cache['dev-util/foo-2'] = {'SLOT': '1', '_eclasses_': eclasses}
+        cache['dev-util/foo-3'] = {'SLOT': '2', '_eclasses_': {}}
+
+        cache = self.get_db()
+        entry = binary.database.__getitem__(cache, 'dev-util/foo-1')
+        self.assertEqual(entry['_mtime_'], 100)
+        self.assertEqual(entry['KEYWORDS'], 'x86 ~amd64')
+        self.assertEqual(entry['RDEPEND'], '')
+        self.assertEqual(sorted(entry['_eclasses_']),
+            [('bar', (('eclassdir', '/nonexistent'), ('mtime', 2 ** 40))),
+             ('foo', (('eclassdir', '/nonexistent'), ('mtime', 100)))])
+        # entries with the same eclasses share the decoded form.
+        self.assertIdentical(entry['_eclasses_'],
+            binary.database.__getitem__(cache, 'dev-util/foo-2')['_eclasses_'])
+        self.assertEqual(list(cache['dev-util/foo-3']['_eclasses_']), [])
+        self.assertEqual(sorted(cache.eclass_consumers('bar')),
+            ['dev-util/foo-1', 'dev-util/foo-2'])
+
+    def test_corruption(self):
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0'}
+        path = pjoin(self.dir, 'dev-util', 'foo-1')
+        with open(path) as f:
+            data = f.read()
+        for garbage in ('SLOT=0\n_mtime_=100\n', data[:-1], data + 'x'):
+            with open(path, 'w') as f:
+                f.write(garbage)
+            self.assertRaises(errors.CacheCorruption,
+                cache.__getitem__, 'dev-util/foo-1')
+
+    def test_eclass_dirs_limit(self):
+        cache = self.get_db()
+        eclasses = dict(('eclass%i' % i,
+                         LazilyHashedPath('/dir%i/eclass%i.eclass' % (i, i),
+                                          mtime=100))
+                        for i in xrange(255))
+        cache['dev-util/foo-1'] = {'SLOT': '0', '_eclasses_': eclasses}
+        self.assertEqual(len(cache['dev-util/foo-1']['_eclasses_']), 255)
+        eclasses['another'] = LazilyHashedPath('/another/another.eclass',
+                                               mtime=100)
+        self.assertRaises(errors.CacheError, cache.__setitem__,
+            'dev-util/foo-2', {'SLOT': '0', '_eclasses_': eclasses})
+        self.assertEqual(os.listdir(pjoin(self.dir, 'dev-util')), ['foo-1'])
+
+    def test_conversion(self):
+        source = flat_hash.database(pjoin(self.dir, 'flat'),
+            auxdbkeys=self.cache_keys)
+        for cpv, raw_data in self.test_data:
+            data = dict(raw_data)
+            data['_chf_'] = test_base._mk_chf_obj(mtime=data.pop('_mtime_'))
+            source[cpv] = data
+        target = binary.database(pjoin(self.dir, 'binary'),
+            auxdbkeys=self.cache_keys)
+        for cpv in source:
+            target.set_serialized_entry(cpv, source.get_serialized_entry(cpv))
+        for cpv, raw_data in self.test_data:
+            self.assertEqual(target.get_serialized_entry(cpv),
+                source.get_serialized_entry(cpv))
+            self.assertEqual(sorted(target[cpv].iteritems()),
+                sorted(source[cpv].iteritems()))
+            self.assertTrue(os.stat(pjoin(target.location, cpv)).st_size <
+                os.stat(pjoin(source.location, cpv)).st_size)
+        # and back again.
+        back = flat_hash.database(pjoin(self.dir, 'back'),
+            auxdbkeys=self.cache_keys)
+        for cpv in target:
+            back.set_serialized_entry(cpv, target.get_serialized_entry(cpv))
+        for cpv, raw_data in self.test_data:
+            self.assertEqual(back.get_serialized_entry(cpv),
+                source.get_serialized_entry(cpv))
+
+    def test_md5(self):
+        cache = binary.md5_cache(self.dir, auxdbkeys=self.cache_keys)
+        cache['dev-util/foo-1'] = {'SLOT': '0',
+            '_chf_': test_base._mk_chf_obj(md5=2 ** 127 + 1),
+            '_eclasses_': {'foo': test_base._mk_chf_obj(md5=0xabcd)}}
+        entry = cache['dev-util/foo-1']
+        self.assertEqual(entry['_md5_'], 2 ** 127 + 1)
+        self.assertEqual(list(entry['_eclasses_']),
+            [('foo', (('md5', 0xabcd),))])
@@ -1,8 +1,15 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
+import logging
+import os
+import threading
+
+from pkgcore.test import silence_logging
 from pkgcore.test.cache import util, test_base
-from pkgcore.cache import flat_hash
+from pkgcore.cache import errors, flat_hash
+from pkgcore.test.ebuild.test_eclass_cache import FakeEclassCache
+from snakeoil.osutils import pjoin
 from snakeoil.test.mixins import TempDirMixin
 
 
@@ -23,3 +30,297 @@ class TestFlatHash(util.GenericCacheMixin, TempDirMixin):
     def get_db(self, readonly=False):
         return db(self.dir,
             auxdbkeys=self.cache_keys, readonly=readonly)
+
+    def test_missing_location(self):
+        cache = db(pjoin(self.dir, 'missing'), auxdbkeys=self.cache_keys)
+        self.assertEqual(list(cache), [])
+        self.assertEqual(list(cache.iter_eclass_consumers()), [])
+
+    def test_eclass_index(self):
+        foo = test_base._mk_chf_obj(mtime=100)
+        bar = test_base._mk_chf_obj(mtime=200)
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0', '_eclasses_': {'foo': foo}}
+        cache['dev-util/foo-2'] = {'SLOT': '0',
+            '_eclasses_': {'foo': foo, 'bar': bar}}
+        cache['dev-util/bar-1'] = {'SLOT': '0', '_eclasses_': {'bar': bar}}
+        cache['dev-util/none-1'] = {'SLOT': '0'}
+        cache.commit()
+        self.assertEqual(sorted(self.get_db()),
+            ['dev-util/bar-1', 'dev-util/foo-1', 'dev-util/foo-2',
+             'dev-util/none-1'])
+
+        # force it to be read back from disk, rather than scanned.
+        cache = self.get_db()
+        cache._scan_indexes = None
+        chfs = (('eclassdir', '/nonexistent'), ('mtime', 100L))
+        self.assertEqual(cache.eclass_consumers('foo'),
+            {'dev-util/foo-1': chfs, 'dev-util/foo-2': chfs})
+        self.assertEqual(list(cache.iter_eclass_consumers()),
+            [('bar', ['dev-util/bar-1', 'dev-util/foo-2']),
+             ('foo', ['dev-util/foo-1', 'dev-util/foo-2'])])
+        self.assertEqual(cache.eclass_consumers('missing'), {})
+
+        del cache['dev-util/foo-1']
+        cache['dev-util/foo-2'] = {'SLOT': '0', '_eclasses_': {'bar': bar}}
+        self.assertEqual(cache.eclass_consumers('foo'), {})
+        # the changes are marked in the stored index till commit.
+        self.assertEqual(
+            self.get_db()._stored_eclass_index._read().get('foo'), {})
+        cache.commit()
+        cache = self.get_db()
+        cache._scan_indexes = None
+        self.assertEqual(list(cache.iter_eclass_consumers()),
+            [('bar', ['dev-util/bar-1', 'dev-util/foo-2'])])
+
+    def test_inherited(self):
+        eclass1 = test_base._mk_chf_obj(mtime=100, eclassdir='/nonexistent')
+        ec = FakeEclassCache('/nonexistent/path')
+        ec.eclasses['eclass1'] = eclass1
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0',
+            '_eclasses_': {'eclass1': eclass1}}
+        cache['dev-util/bar-1'] = {'SLOT': '0'}
+        cache.commit()
+        ebuild = test_base._mk_chf_obj(mtime=100)
+        # db hides the chf from lookups, which validation needs.
+        get_db = lambda: flat_hash.database(self.dir,
+            auxdbkeys=self.cache_keys)
+
+        for scan in (False, True):
+            cache = get_db()
+            if scan:
+                # no stored index; entries are loaded instead.
+                os.unlink(pjoin(self.dir, cache.eclass_index_name))
+            else:
+                cache._getitem = None
+            self.assertEqual(cache.inherited('dev-util/foo-1', ebuild, ec),
+                             ('eclass1',))
+            self.assertEqual(cache.inherited('dev-util/bar-1', ebuild, ec), ())
+            if scan:
+                self.assertIdentical(cache._stored_eclass_index.index, None)
+
+        cache = get_db()
+        self.assertIdentical(
+            cache.inherited('dev-util/missing-1', ebuild, ec), None)
+        # changed ebuild...
+        self.assertIdentical(cache.inherited('dev-util/foo-1',
+            test_base._mk_chf_obj(mtime=101), ec), None)
+        # ...or eclass; a reload replaces the mapping.
+        ec.eclasses = dict(ec.eclasses, eclass1=test_base._mk_chf_obj(
+            mtime=101, eclassdir='/nonexistent'))
+        self.assertIdentical(
+            cache.inherited('dev-util/foo-1', ebuild, ec), None)
+        self.assertEqual(cache.inherited('dev-util/bar-1', ebuild, ec), ())
+
+    def test_revdep_index(self):
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0',
+            'RDEPEND': 'x? ( >=dev-util/bar-1:0[x] ) || ( dev-util/baz '
+                       '!<dev-util/bar-0.5 ) =dev-util/baz-1*',
+            'PDEPEND': 'dev-util/bar'}
+        cache['dev-util/foo-2'] = {'SLOT': '0', 'RDEPEND': 'dev-util/baz'}
+        cache['dev-util/none-1'] = {'SLOT': '0', 'RDEPEND': '=invalid'}
+        cache.commit()
+        self.assertEqual(sorted(self.get_db()),
+            ['dev-util/foo-1', 'dev-util/foo-2', 'dev-util/none-1'])
+
+        # force it to be read back from disk, rather than scanned.
+        cache = self.get_db()
+        cache._scan_indexes = None
+        self.assertEqual(cache.revdeps('dev-util/bar'),
+            {'dev-util/foo-1': (('RDEPEND', '>=dev-util/bar-1:0[x]'),
+                                ('RDEPEND', '!<dev-util/bar-0.5'),
+                                ('PDEPEND', 'dev-util/bar'))})
+        self.assertEqual(sorted(cache.revdeps('dev-util/baz')),
+            ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertEqual(cache.revdeps('dev-util/missing'), {})
+        self.assertEqual(cache.revdep_indexed(),
+            set(['dev-util/foo-1', 'dev-util/foo-2', 'dev-util/none-1']))
+
+        del cache['dev-util/foo-1']
+        cache['dev-util/foo-2'] = {'SLOT': '0', 'RDEPEND': 'dev-util/bar'}
+        self.assertEqual(cache.revdeps('dev-util/baz'), {})
+        # the changes are marked in the stored index till commit.
+        self.assertEqual(
+            self.get_db()._stored_revdep_index._read().get('dev-util/baz'), {})
+        cache.commit()
+        cache = self.get_db()
+        cache._scan_indexes = None
+        self.assertEqual(cache.revdeps('dev-util/bar'),
+            {'dev-util/foo-2': (('RDEPEND', 'dev-util/bar'),)})
+        self.assertEqual(cache.revdeps('dev-util/baz'), {})
+
+        # readonly caches only scan.
+        os.unlink(pjoin(self.dir, cache.revdep_index_name))
+        cache = self.get_db(readonly=True)
+        self.assertEqual(list(cache.revdeps('dev-util/bar')),
+            ['dev-util/foo-2'])
+        cache.save_revdep_index()
+        self.assertEqual(self.get_db()._stored_revdep_index._read(), None)
+        cache = self.get_db()
+        cache.revdeps('dev-util/bar')
+        cache.save_revdep_index()
+        self.assertEqual(
+            self.get_db()._stored_revdep_index._read().get('dev-util/bar'),
+            {'dev-util/foo-2': (('RDEPEND', 'dev-util/bar'),)})
+
+    def test_uncommitted_index_changes(self):
+        foo = test_base._mk_chf_obj(mtime=100)
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0', 'RDEPEND': 'dev-util/bar',
+            '_eclasses_': {'foo': foo}}
+        cache['dev-util/bar-1'] = {'SLOT': '0'}
+        cache.commit()
+        index_path = pjoin(self.dir, cache.eclass_index_name)
+
+        # written through a fresh instance, never committed.
+        cache = self.get_db()
+        cache['dev-util/bar-1'] = {'SLOT': '0', 'RDEPEND': 'dev-util/bar',
+            '_eclasses_': {'foo': foo}}
+        del cache['dev-util/foo-1']
+        self.assertTrue(os.path.exists(index_path))
+
+        # the stored indexes are still used, rather than scanned.
+        cache = self.get_db(readonly=True)
+        cache._scan_indexes = None
+        self.assertEqual(list(cache.eclass_consumers('foo')),
+            ['dev-util/bar-1'])
+        self.assertEqual(list(cache.revdeps('dev-util/bar')),
+            ['dev-util/bar-1'])
+        self.assertEqual(cache.revdep_indexed(), set(['dev-util/bar-1']))
+
+        # once loaded, a commit writes them out afresh.
+        cache = self.get_db()
+        cache.eclass_consumers('foo')
+        cache.commit()
+        with open(index_path) as f:
+            self.assertFalse([x for x in f if x.startswith('-')])
+        cache = self.get_db()
+        cache._scan_indexes = None
+        self.assertEqual(list(cache.eclass_consumers('foo')),
+            ['dev-util/bar-1'])
+
+    def test_index_scan(self):
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0', 'RDEPEND': 'dev-util/bar',
+            '_eclasses_': {'foo': test_base._mk_chf_obj(mtime=100)}}
+        cache['dev-util/bar-1'] = {'SLOT': '0'}
+        cache = self.get_db(readonly=True)
+        loaded = []
+        getitem = cache._getitem
+        def _getitem(cpv):
+            loaded.append(cpv)
+            return getitem(cpv)
+        cache._getitem = _getitem
+        # both indexes are built by the one pass over the entries.
+        self.assertEqual(list(cache.revdeps('dev-util/bar')),
+            ['dev-util/foo-1'])
+        self.assertEqual(list(cache.eclass_consumers('foo')),
+            ['dev-util/foo-1'])
+        self.assertEqual(sorted(loaded), ['dev-util/bar-1', 'dev-util/foo-1'])
+
+    def test_lazy_entry(self):
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0', 'KEYWORDS': 'x86',
+            '_eclasses_': {'foo': test_base._mk_chf_obj(mtime=100)}}
+        cache = self.get_db()
+        calls = []
+        def reconstruct(cpv, data):
+            calls.append(cpv)
+            return flat_hash.database.reconstruct_eclasses(cache, cpv, data)
+        cache.reconstruct_eclasses = reconstruct
+
+        entry = flat_hash.database.__getitem__(cache, 'dev-util/foo-1')
+        self.assertEqual(entry['_mtime_'], 100)
+        self.assertEqual(entry.pop('KEYWORDS'), 'x86')
+        self.assertNotIn('KEYWORDS', entry)
+        self.assertIn('_eclasses_', entry)
+        self.assertNotIn('DEPEND', entry)
+        self.assertRaises(KeyError, entry.__getitem__, 'DEPEND')
+        # _eclasses_ is only converted on access.
+        self.assertEqual(calls, [])
+        self.assertEqual(list(entry['_eclasses_']),
+            [('foo', (('eclassdir', '/nonexistent'), ('mtime', 100L)))])
+        self.assertEqual(calls, ['dev-util/foo-1'])
+        entry['SLOT'] = '1'
+        self.assertEqual(sorted(entry.iteritems()),
+            [('SLOT', '1'), ('_eclasses_', entry['_eclasses_']),
+             ('_mtime_', 100)])
+
+    def test_write_behind(self):
+        cache = self.get_db()
+        cache.set_write_behind(4)
+        blocker = threading.Event()
+        write_batch = cache._write_behind._write_batch
+        def stalled_write(items):
+            blocker.wait()
+            return write_batch(items)
+        cache._write_behind._write_batch = stalled_write
+        data = {'SLOT': '0', 'KEYWORDS': 'x86'}
+        cache['dev-util/foo-1'] = data
+        data['SLOT'] = '1'
+        # queued entries are visible, and snapshotted at store time.
+        self.assertIn('dev-util/foo-1', cache)
+        self.assertEqual(cache['dev-util/foo-1'], {'SLOT': '0', 'KEYWORDS': 'x86'})
+        self.assertFalse(os.path.exists(pjoin(self.dir, 'dev-util')))
+        blocker.set()
+        cache.commit()
+        self.assertEqual(self.get_db()['dev-util/foo-1'],
+            {'SLOT': '0', 'KEYWORDS': 'x86'})
+
+        for x in xrange(20):
+            cache['dev-util/bar-%i' % x] = {'SLOT': str(x)}
+        cache.set_write_behind(0)
+        self.assertIdentical(cache._write_behind, None)
+        self.assertEqual(len(list(self.get_db())), 21)
+        self.assertEqual(self.get_db()['dev-util/bar-19'], {'SLOT': '19'})
+        # readonly caches ignore it.
+        cache = self.get_db(readonly=True)
+        cache.set_write_behind(4)
+        self.assertIdentical(cache._write_behind, None)
+
+    @silence_logging(logging.root)
+    def test_write_behind_failures(self):
+        cache = self.get_db()
+        cache.set_write_behind(4)
+        write_entry = cache._write_entry
+        def failing_write(cpv, values):
+            if cpv.startswith('dev-util/bad-'):
+                raise errors.CacheCorruption(cpv, 'write failed')
+            write_entry(cpv, values)
+        cache._write_entry = failing_write
+        cache['dev-util/foo-1'] = {'SLOT': '0'}
+        cache['dev-util/bad-1'] = {'SLOT': '0'}
+        cache['dev-util/bad-2'] = {'SLOT': '0'}
+        cache['dev-util/foo-2'] = {'SLOT': '0'}
+        # the first failure is raised; the rest are logged.
+        try:
+            cache.commit()
+        except errors.CacheCorruption as e:
+            self.assertEqual(e.key, 'dev-util/bad-1')
+        else:
+            self.fail("commit didn't raise the failed write")
+        self.assertEqual(sorted(self.get_db()),
+                         ['dev-util/foo-1', 'dev-util/foo-2'])
+        # failures are raised once.
+        cache.commit()
+
+        # including those of writes flushed by disabling write-behind.
+        cache['dev-util/bad-3'] = {'SLOT': '0'}
+        cache.set_write_behind(0)
+        self.assertRaises(errors.CacheCorruption, cache.commit)
+        cache.commit()
+
+    def test_lazy_entry_parsing(self):
+        entry = flat_hash._lazy_entry(
+            'SLOT=0\nBOGUS=1\nIUSE=foo \nSLOT=1\nKEYWORDS=x86=amd64',
+            frozenset(['SLOT', 'IUSE', 'KEYWORDS', 'DEPEND']), {})
+        self.assertEqual(entry['SLOT'], '1')
+        self.assertEqual(entry['IUSE'], 'foo')
+        self.assertEqual(entry['KEYWORDS'], 'x86=amd64')
+        self.assertNotIn('BOGUS', entry)
+        self.assertEqual(sorted(entry), ['IUSE', 'KEYWORDS', 'SLOT'])
+        del entry['IUSE']
+        self.assertRaises(KeyError, entry.__delitem__, 'IUSE')
+        self.assertEqual(sorted(entry), ['KEYWORDS', 'SLOT'])
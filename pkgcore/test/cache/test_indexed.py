@@ -0,0 +1,119 @@
+# License: GPL2/BSD
+
+import os
+
+from pkgcore.test.cache import util, test_base
+from pkgcore.cache import indexed, errors
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+
+class db(indexed.database):
+
+    def __setitem__(self, cpv, data):
+        data['_chf_'] = test_base._chf_obj
+        return indexed.database.__setitem__(self, cpv, data)
+
+    def __getitem__(self, cpv):
+        d = dict(indexed.database.__getitem__(self, cpv).iteritems())
+        d.pop('_%s_' % self.chf_type, None)
+        return d
+
+
+class TestIndexed(util.GenericCacheMixin, TempDirMixin):
+
+    def get_db(self, readonly=False):
+        return db(self.dir,
+            auxdbkeys=self.cache_keys, readonly=readonly)
+
+    def test_roundtrip(self):
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0', 'KEYWORDS': 'x86'}
+        cache['app-misc/bar-2'] = {'SLOT': '1'}
+        # pending updates are visible prior to commit...
+        self.assertEqual(cache['app-misc/bar-2'], {'SLOT': '1'})
+        # but not to other instances.
+        self.assertEqual(list(self.get_db()), [])
+        cache.commit()
+
+        cache = self.get_db()
+        self.assertEqual(sorted(cache), ['app-misc/bar-2', 'dev-util/foo-1'])
+        self.assertEqual(cache['dev-util/foo-1'],
+            {'SLOT': '0', 'KEYWORDS': 'x86'})
+        self.assertIn('app-misc/bar-2', cache)
+        self.assertNotIn('app-misc/bar-1', cache)
+        self.assertRaises(KeyError, cache.__getitem__, 'app-misc/bar-1')
+        self.assertRaises(KeyError, cache.__getitem__, 'zzz/last-1')
+
+    def test_delitem(self):
+        cache = self.get_db()
+        for x in xrange(10):
+            cache['dev-util/foo-%i' % x] = {'SLOT': str(x)}
+        cache.commit()
+        del cache['dev-util/foo-3']
+        self.assertRaises(KeyError, cache.__delitem__, 'dev-util/foo-3')
+        self.assertNotIn('dev-util/foo-3', cache)
+        cache.commit()
+        cache = self.get_db()
+        self.assertEqual(sorted(cache),
+            sorted('dev-util/foo-%i' % x for x in xrange(10) if x != 3))
+        # deletion while walking the keys must be safe.
+        for key in cache.iterkeys():
+            del cache[key]
+        cache.commit()
+        self.assertEqual(list(self.get_db()), [])
+
+    def test_compaction(self):
+        cache = self.get_db()
+        for x in xrange(5):
+            cache['dev-util/foo-1'] = {'SLOT': str(x)}
+            cache['dev-util/bar-1'] = {'SLOT': '0'}
+            cache.commit()
+        files = sorted((x for x in os.listdir(self.dir)
+                        if x.startswith('data.')),
+                       key=lambda x: int(x.split('.')[1]))
+        # the superseded generation is kept around for readers.
+        self.assertEqual(len(files), 2)
+        self.assertNotEqual(files[-1], 'data.0')
+        data_size = os.stat(pjoin(self.dir, files[-1])).st_size
+        self.assertTrue(data_size < 4 * len('SLOT=0\n_mtime_=100\n'))
+        cache = self.get_db()
+        self.assertEqual(cache['dev-util/foo-1'], {'SLOT': '4'})
+        self.assertEqual(cache['dev-util/bar-1'], {'SLOT': '0'})
+
+    def test_compaction_readers(self):
+        cache = self.get_db()
+        for x in xrange(10):
+            cache['dev-util/foo-%i' % x] = {'SLOT': str(x)}
+        cache.commit()
+        # reader has the index mapped, but not yet the data file.
+        reader = self.get_db(readonly=True)
+        self.assertIn('dev-util/foo-1', reader)
+        for x in xrange(2, 10):
+            del cache['dev-util/foo-%i' % x]
+        cache.commit()
+        self.assertTrue(os.path.exists(pjoin(self.dir, 'data.1')))
+        self.assertEqual(reader['dev-util/foo-1'], {'SLOT': '1'})
+        self.assertEqual(reader['dev-util/foo-5'], {'SLOT': '5'})
+
+        # the next compaction drops the generation the reader was using.
+        reader = self.get_db(readonly=True)
+        self.assertIn('dev-util/foo-1', reader)
+        for x in xrange(5):
+            cache['dev-util/foo-0'] = {'SLOT': str(x)}
+            cache.commit()
+        self.assertFalse(os.path.exists(pjoin(self.dir, 'data.0')))
+        self.assertEqual(reader['dev-util/foo-1'], {'SLOT': '1'})
+
+    def test_corruption(self):
+        cache = self.get_db()
+        cache['dev-util/foo-1'] = {'SLOT': '0'}
+        cache.commit()
+        with open(pjoin(self.dir, 'data.0'), 'w') as f:
+            f.write('SLOT')
+        self.assertRaises(errors.CacheCorruption,
+            self.get_db().__getitem__, 'dev-util/foo-1')
+        with open(pjoin(self.dir, 'index'), 'w') as f:
+            f.write('garbage')
+        self.assertRaises(errors.GeneralCacheCorruption,
+            self.get_db().__contains__, 'dev-util/foo-1')
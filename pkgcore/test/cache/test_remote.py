@@ -0,0 +1,126 @@
+# License: GPL2/BSD
+
+import logging
+import os
+import threading
+import time
+
+from pkgcore.test import TestCase, silence_logging
+from pkgcore.test.cache import test_base
+from pkgcore.cache import errors, flat_hash, remote
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+
+class TestRemote(TempDirMixin, TestCase):
+
+    keys = ('SLOT', 'KEYWORDS', 'RDEPEND', '_eclasses_', '_mtime_')
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.cache = flat_hash.database(pjoin(self.dir, 'cache'),
+            auxdbkeys=self.keys)
+        self.store('dev-util/foo-1', SLOT='0', KEYWORDS='x86',
+            _eclasses_={'foo': test_base._mk_chf_obj(mtime=100)})
+        self.store('dev-util/foo-2', SLOT='1', RDEPEND='>=dev-util/foo-1')
+        self.server = remote.server(self.cache, pjoin(self.dir, 'socket'),
+            check_interval=3600)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        while not os.path.exists(self.server.path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+        TempDirMixin.tearDown(self)
+
+    def store(self, cpv, **data):
+        data['_chf_'] = test_base._mk_chf_obj(mtime=200)
+        self.cache[cpv] = data
+
+    def get_db(self):
+        return remote.database(self.server.path, auxdbkeys=self.keys)
+
+    def test_lookups(self):
+        db = self.get_db()
+        self.assertEqual(db.chf_type, 'mtime')
+        self.assertEqual(db.eclass_chf_types, ('eclassdir', 'mtime'))
+        self.assertEqual(sorted(db), ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertIn('dev-util/foo-1', db)
+        self.assertNotIn('dev-util/foo-3', db)
+        self.assertRaises(KeyError, db.__getitem__, 'dev-util/foo-3')
+        entry = db['dev-util/foo-1']
+        self.assertEqual(entry['KEYWORDS'], 'x86')
+        self.assertEqual(entry['_mtime_'], 200)
+        self.assertEqual(list(entry['_eclasses_']),
+            [('foo', (('eclassdir', '/nonexistent'), ('mtime', 100L)))])
+        self.assertEqual(sorted(db.get_many(
+            ['dev-util/foo-2', 'dev-util/foo-3', 'dev-util/foo-1'])),
+            ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertEqual(db.eclass_consumers('foo'),
+            {'dev-util/foo-1': (('eclassdir', '/nonexistent'),
+                                ('mtime', 100L))})
+        self.assertEqual(db.revdeps('dev-util/foo'),
+            {'dev-util/foo-2': (('RDEPEND', '>=dev-util/foo-1'),)})
+        self.assertEqual(db.revdep_indexed(),
+            set(['dev-util/foo-1', 'dev-util/foo-2']))
+        self.assertRaises(errors.ReadOnly, db.__setitem__,
+            'dev-util/foo-3', {})
+        # dropped connections are reestablished.
+        db.close()
+        self.assertEqual(db['dev-util/foo-2']['SLOT'], '1')
+
+    def test_invalidation(self):
+        db = self.get_db()
+        self.assertEqual(db['dev-util/foo-2']['SLOT'], '1')
+        self.store('dev-util/foo-2', SLOT='2')
+        # force the directory mtime to differ.
+        os.utime(pjoin(self.cache.location, 'dev-util'), (1, 1))
+        self.assertEqual(db['dev-util/foo-2']['SLOT'], '1')
+        self.server.check()
+        self.assertEqual(db['dev-util/foo-2']['SLOT'], '2')
+
+        # the indexes too, for changes made through another cache instance.
+        self.assertEqual(list(self.get_db().revdeps('dev-util/foo')), [])
+        writer = flat_hash.database(self.cache.location, auxdbkeys=self.keys)
+        writer['dev-util/foo-2'] = {'SLOT': '2', 'RDEPEND': 'dev-util/foo',
+            '_chf_': test_base._mk_chf_obj(mtime=200)}
+        os.utime(pjoin(self.cache.location, 'dev-util'), (2, 2))
+        self.assertEqual(list(self.get_db().revdeps('dev-util/foo')), [])
+        self.server.check()
+        self.assertEqual(list(self.get_db().revdeps('dev-util/foo')),
+            ['dev-util/foo-2'])
+
+    def test_errors(self):
+        self.assertRaises(errors.InitializationError, remote.database,
+            pjoin(self.dir, 'nonexistent'))
+        self.assertTrue(
+            self.server.handle_request('frobnicate\n').startswith('error '))
+
+    @silence_logging(logging.root)
+    def test_invalid_keys(self):
+        # an entry outside the cache the server shouldn't hand out.
+        with open(pjoin(self.dir, 'secret-1'), 'w') as f:
+            f.write('SLOT=0\n')
+        for key in ('../secret-1', 'dev-util/../../secret-1',
+                    '/etc/passwd', 'dev-util//foo-1', 'dev-util/foo/foo-1',
+                    'dev-util', 'dev-util/foo', '../dev-util/foo-1'):
+            response = self.server.handle_request('get %s\n' % (key,))
+            self.assertTrue(response.startswith('error '), msg=response)
+            # valid keys in the same request don't get through either.
+            response = self.server.handle_request(
+                'get dev-util/foo-1 %s\n' % (key,))
+            self.assertTrue(response.startswith('error '), msg=response)
+        self.assertEqual(self.server._entries, {})
+        self.assertEqual(self.server._dir_mtimes, {})
+        self.assertTrue(self.server.handle_request(
+            'get dev-util/foo-1\n').startswith('ok '))
+
+        # clients treat them as missing, rather than the cache as corrupt.
+        db = self.get_db()
+        for key in ('../secret-1', 'dev-util', 'dev-util/foo/foo-1'):
+            self.assertNotIn(key, db)
+            self.assertRaises(KeyError, db.__getitem__, key)
+        self.assertEqual(list(db.get_many(['../secret-1', 'dev-util/foo-1'])),
+            ['dev-util/foo-1'])
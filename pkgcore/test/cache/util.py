@@ -63,3 +63,20 @@ class GenericCacheMixin(TestCase):
             d = dict(raw_data)
             db[key] = d
 
+
+    def test_get_many(self):
+        db = self.get_db()
+        for key, raw_data in self.test_data:
+            db[key] = dict(raw_data)
+        for key in ('dev-util/foo-1', 'dev-util/foo-2'):
+            db[key] = {'SLOT': key[-1]}
+        db.commit()
+        db = self.get_db(True)
+        keys = [key for key, raw_data in self.test_data]
+        d = db.get_many(keys + ['dev-util/foo-2', 'dev-util/foo-3',
+                                'missing/cat-1'])
+        self.assertEqual(sorted(d), sorted(keys + ['dev-util/foo-2']))
+        self.assertEqual(d['dev-util/foo-2']['SLOT'], '2')
+        for key in keys:
+            self.assertEqual(d[key]['_eclasses_'], db[key]['_eclasses_'])
+        self.assertEqual(db.get_many([]), {})
@@ -2,6 +2,7 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import random
 from random import shuffle
 
 from snakeoil.compatibility import cmp
@@ -199,6 +200,8 @@ class native_CpvTest(TestCase):
         self.assertTrue(obj1 > obj2, '%r must be > %r' % (obj1, obj2))
         # swap the ordering, so that it's no longer obj1.__cmp__, but obj2s
         self.assertTrue(obj2 < obj1, '%r must be < %r' % (obj2, obj1))
+        self.assertTrue(obj1.sort_key > obj2.sort_key,
+            'sort_key, %r must be > %r' % (obj1, obj2))
 
         if self.run_cpy_ver_cmp and obj1.fullver and obj2.fullver:
             self.assertTrue(cpv.cpy_ver_cmp(obj1.version, obj1.revision,
@@ -305,6 +308,7 @@ class native_CpvTest(TestCase):
         for thing in (uninited, broken):
             # the c version returns None, the py version does not have the attr
             getattr(thing, 'cpvstr', None)
+            getattr(thing, 'sort_key', None)
             repr(thing)
             str(thing)
             # The c version returns a constant, the py version raises
@@ -313,6 +317,48 @@ class native_CpvTest(TestCase):
             except AttributeError:
                 pass
 
+    def test_sort_key(self):
+        # random versions, built from components prone to comparison corner
+        # cases; keys must order exactly as the instances do.
+        rand = random.Random(0)
+        components = ("0", "1", "2", "9", "00", "01", "010", "0001", "10",
+            "100", "1000000000000000000001")
+        sufs = ("_alpha", "_beta", "_pre", "_rc", "_p", "_p1", "_alpha0",
+            "_rc20")
+        revs = ("", "-r0", "-r1", "-r2", "-r10")
+        vers = set()
+        while len(vers) < 150:
+            ver = "%i" % rand.randint(1, 12)
+            for x in xrange(rand.randint(0, 3)):
+                ver += "." + rand.choice(components)
+            if rand.random() < 0.2:
+                ver += rand.choice("abz")
+            for x in xrange(rand.randint(0, 2)):
+                ver += rand.choice(sufs)
+            vers.add(ver + rand.choice(revs))
+        objs = [self.vkls("da/ba-%s" % ver) for ver in vers]
+        objs += [self.vkls("da/bb-1"), self.vkls("db/ba-1"),
+            self.ukls("da/ba"), self.ukls("db/ba")]
+        for obj in objs:
+            self.assertIdentical(obj.sort_key, obj.sort_key)
+            self.assertEqual(obj.sort_key, cpv.sort_key(obj))
+            if obj.version is not None:
+                self.assertEqual(obj.sort_key,
+                    cpv.native_CPV.versioned(obj.cpvstr).sort_key)
+        for obj1 in objs:
+            for obj2 in objs:
+                if obj1.key == obj2.key and \
+                        (obj1.version is None) != (obj2.version is None):
+                    # the native class and the extension disagree here; keys
+                    # sort unversioned first, as the extension does.
+                    continue
+                self.assertEqual(cmp(obj1, obj2),
+                    cmp(obj1.sort_key, obj2.sort_key),
+                    "%r vs %r: %r, %r" % (obj1, obj2, obj1.sort_key,
+                        obj2.sort_key))
+        objs = [x for x in objs if x.version is not None]
+        self.assertEqual(sorted(objs, key=cpv.sort_key), sorted(objs))
+
     def test_r0_removal(self):
         obj = self.kls("dev-util/diffball-1.0-r0", versioned=True)
         self.assertEqual(obj.fullver, "1.0")
@@ -5,6 +5,8 @@ import os
 import tempfile
 
 from snakeoil.data_source import local_source
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
 
 from pkgcore import gpg
 from pkgcore.ebuild import digest
@@ -97,3 +99,50 @@ class TestManifest(TestCase):
 class TestManifestDataSource(TestManifest):
     convert_source = staticmethod(lambda x: local_source(x))
 
+
+
+class TestManifestIndex(TempDirMixin, TestCase):
+
+    def write_manifest(self, cat, pkg, data, mtime=1000000):
+        pkgdir = pjoin(self.dir, 'tree', cat, pkg)
+        ensure_dirs(pkgdir)
+        path = pjoin(pkgdir, 'Manifest')
+        with open(path, 'w') as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def mk_index(self):
+        return digest.ManifestIndex(pjoin(self.dir, 'tree'),
+                                    pjoin(self.dir, 'cache', 'index'))
+
+    def assertChksums(self, distfiles):
+        expected = pure_manifest2_chksums['DIST']
+        self.assertEqual(sorted(distfiles), sorted(expected))
+        for k, v in expected.iteritems():
+            self.assertEqual(sorted(v), sorted(distfiles[k].iteritems()))
+
+    def test_index(self):
+        dists = [x for x in pure_manifest2.splitlines() if x.startswith('DIST')]
+        self.write_manifest('mail-client', 'sylpheed-claws', pure_manifest2)
+        self.write_manifest('mail-client', 'other', dists[0] + '\n')
+        index = self.mk_index()
+        self.assertIdentical(index.distfiles('mail-client', 'missing'), None)
+        self.assertChksums(index.distfiles('mail-client', 'sylpheed-claws'))
+        self.assertEqual(list(index.distfiles('mail-client', 'other')),
+                         ['sylpheed-claws-1.0.5.tar.bz2'])
+        index.save()
+
+        # entries are read back from the index while the Manifest's mtime
+        # and size are unchanged...
+        changed = dists[0].replace('2164b', '2164c') + '\n'
+        self.write_manifest('mail-client', 'other', changed)
+        index = self.mk_index()
+        self.assertChksums(index.distfiles('mail-client', 'sylpheed-claws'))
+        self.assertEqual(
+            index.distfiles('mail-client', 'other')['sylpheed-claws-1.0.5.tar.bz2']['sha1'],
+            0xd351d7043eef7a875df18a8c4b9464be49e2164bL)
+        # ...and reparsed once either changes.
+        self.write_manifest('mail-client', 'other', changed, 1000001)
+        self.assertEqual(
+            index.distfiles('mail-client', 'other')['sylpheed-claws-1.0.5.tar.bz2']['sha1'],
+            0xd351d7043eef7a875df18a8c4b9464be49e2164cL)
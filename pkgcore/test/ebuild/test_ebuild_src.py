@@ -424,6 +424,75 @@ class test_package_factory(TestCase):
         self.assertEqual(cache2[pkg.cpvstr],
             {'_eclasses_':{'eclass1':(None, 100)}, 'marker':2, '_mtime_':200})
 
+    def test_prefetch(self):
+        ec = FakeEclassCache('/nonexistent/path')
+        pkgs = [malleable_obj(cpvstr='dev-util/diffball-%i' % x,
+                              path='bollocks') for x in (1, 2, 3)]
+
+        class fake_cache(dict):
+            readonly = False
+            requested = []
+            def get_many(self, cpvs):
+                cpvs = sorted(cpvs)
+                self.requested.append(cpvs)
+                return dict((k, dict(self[k])) for k in cpvs if k in self)
+            def validate_entries(self, entries, eclass_db):
+                return [data['valid'] for data, ebuild_hash in entries]
+            def validate_entry(self, data, *args):
+                return data['valid']
+
+        cache = fake_cache({
+            'dev-util/diffball-1': {'valid': True, 'marker': 1},
+            'dev-util/diffball-2': {'valid': False},
+        })
+        pf = self.mkinst(cache=(cache,), eclasses=ec,
+            _update_metadata=lambda pkg, ebp=None: 'regen')
+        pf.prefetch(pkgs)
+        # nothing is read till metadata is actually needed...
+        self.assertEqual(cache.requested, [])
+        self.assertEqual(pf._get_metadata(pkgs[0]), {'valid': True, 'marker': 1})
+        # at which point the whole batch is pulled.
+        self.assertEqual(cache.requested, [[x.cpvstr for x in pkgs]])
+        # invalid entries go through the normal path, pruning them.
+        self.assertEqual(pf._get_metadata(pkgs[1]), 'regen')
+        self.assertNotIn('dev-util/diffball-2', cache)
+        self.assertEqual(pf._get_metadata(pkgs[2]), 'regen')
+        self.assertEqual(len(cache.requested), 1)
+
+    def test_source_metadata_many(self):
+        ec = FakeEclassCache('/nonexistent/path')
+        pkgs = [malleable_obj(cpvstr='dev-util/diffball-%i' % x,
+                              eapi_obj=malleable_obj(is_supported=x != 3))
+                for x in (1, 2, 3, 4)]
+
+        class fake_processor(object):
+            requested = []
+            def get_keys_many(self, pkgs, eclass_cache):
+                self.requested.append([x.cpvstr for x in pkgs])
+                # the second package failed sourcing.
+                return [{'marker': x.cpvstr} if i != 1 else None
+                        for i, x in enumerate(pkgs)]
+
+        ebp = fake_processor()
+        pf = self.mkinst(eclasses=ec,
+            _finalize_sourced_metadata=lambda pkg, data: data['marker'])
+        results = pf._source_metadata_many(iter(pkgs), ebp=ebp)
+        # results are in the order of the packages passed in.
+        self.assertEqual([x[0] for x in results], pkgs)
+        results = dict((pkg.cpvstr, (data, error))
+                       for pkg, data, error in results)
+        # one request, unsupported eapis left out.
+        self.assertEqual(ebp.requested, [['dev-util/diffball-1',
+            'dev-util/diffball-2', 'dev-util/diffball-4']])
+        self.assertEqual(results['dev-util/diffball-1'],
+                         ('dev-util/diffball-1', None))
+        self.assertEqual(results['dev-util/diffball-3'], (None, None))
+        self.assertEqual(results['dev-util/diffball-4'],
+                         ('dev-util/diffball-4', None))
+        data, error = results['dev-util/diffball-2']
+        self.assertIdentical(data, None)
+        self.assertIsInstance(error, errors.MetadataException)
+
     def test_required_use(self):
         pass
 
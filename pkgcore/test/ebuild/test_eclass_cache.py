@@ -73,6 +73,21 @@ class TestEclassCache(TempDirMixin, TestBase):
         self.assertEqual(None, self.ec.get_eclass("foon"))
         self.assertEqual(None, self.ec.get_eclass("foon-eclass"))
 
+    def test_rebuild_cache_entry_memoized(self):
+        entry = [('eclass1', (('mtime', 100L),))]
+        key = 'eclass1\t100'
+        data = self.ec.rebuild_cache_entry(entry, key=key)
+        self.assertEqual(sorted(data), ['eclass1'])
+        self.assertIdentical(data, self.ec.rebuild_cache_entry(entry, key=key))
+        # the result stands till the eclasses are reloaded.
+        path = pjoin(self.ec_locs['eclass1'], 'eclass1.eclass')
+        os.utime(path, (200, 200))
+        self.assertIdentical(data, self.ec.rebuild_cache_entry(entry, key=key))
+        self.ec.reload()
+        self.assertEqual(None, self.ec.rebuild_cache_entry(entry, key=key))
+        self.assertTrue(self.ec.rebuild_cache_entry(
+            [('eclass1', (('mtime', 200L),))], key='eclass1\t200'))
+
 
 class TestStackedCaches(TestEclassCache):
 
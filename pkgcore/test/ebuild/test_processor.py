@@ -0,0 +1,363 @@
+# License: GPL2/BSD
+
+import os
+import threading
+import time
+
+from snakeoil.chksum import LazilyHashedPath
+from snakeoil.osutils import pjoin, ensure_dirs
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.ebuild import processor, repository, eclass_cache
+from pkgcore.restrictions import packages
+from pkgcore.test import TestCase, SkipTest
+from pkgcore.test.ebuild.test_eclass_cache import FakeEclassCache
+
+
+class TestEclassPreloader(TestCase):
+
+    def setUp(self):
+        self.ec = FakeEclassCache('/nonexistent/path')
+        self.ec.eclasses["eclass3"] = LazilyHashedPath('/nonexistent/path',
+                                                       mtime=300)
+
+    def test_from_consumers(self):
+        consumers = {
+            'eclass1': ['dev-util/a-1', 'dev-util/b-1'],
+            'eclass2': ['dev-util/a-1', 'dev-util/b-1', 'dev-util/c-1'],
+            'eclass3': ['dev-util/a-1'],
+            'unknown': ['dev-util/a-1', 'dev-util/b-1'],
+        }
+        p = processor.EclassPreloader.from_consumers(
+            [self.ec], consumers.iteritems(), 10)
+        # ranked by consumers; single consumer and unknown eclasses are
+        # left out.
+        self.assertEqual(p.eclasses, ('eclass2', 'eclass1'))
+        self.assertIdentical(p.eclass_cache, self.ec)
+        p = processor.EclassPreloader.from_consumers(
+            [self.ec], consumers.iteritems(), 1)
+        self.assertEqual(p.eclasses, ('eclass2',))
+        p = processor.EclassPreloader.from_consumers(
+            [self.ec], consumers.iteritems(), 10, minimum=1)
+        self.assertEqual(p.eclasses, ('eclass2', 'eclass1', 'eclass3'))
+
+        self.assertIdentical(None, processor.EclassPreloader.from_consumers(
+            [self.ec], consumers.iteritems(), 0))
+        self.assertIdentical(None, processor.EclassPreloader.from_consumers(
+            [], consumers.iteritems(), 10))
+        self.assertIdentical(None, processor.EclassPreloader.from_consumers(
+            [self.ec], [('eclass3', ['dev-util/a-1'])], 10))
+
+        # eclasses must resolve to the same file for every eclass cache.
+        other = FakeEclassCache('/nonexistent/other')
+        other.eclasses['eclass2'] = self.ec.eclasses['eclass2']
+        p = processor.EclassPreloader.from_consumers(
+            [self.ec, other], consumers.iteritems(), 10)
+        self.assertEqual(p.eclasses, ('eclass2',))
+
+    def test_warm_and_counts(self):
+        p = processor.EclassPreloader(self.ec, ['eclass1'])
+        self.assertIdentical(p.hit_rate, None)
+        self.assertEqual(str(p),
+            "1 eclasses preloaded, 0 of 0 inherits served from them")
+
+        preloaded = []
+        class fake_processor(processor.EbuildProcessor):
+            def __init__(self):
+                self._preloader = None
+            def preload_eclasses(self, cache, async=False, limited_to=None):
+                preloaded.append((cache, async, limited_to))
+
+        ebp = fake_processor()
+        p.warm(ebp)
+        self.assertEqual(preloaded, [(self.ec, True, ('eclass1',))])
+        ebp._count_inherits(hits=3)
+        ebp._count_inherits(misses=1)
+        self.assertEqual((p.hits, p.misses), (3, 1))
+        self.assertEqual(p.hit_rate, 0.75)
+        self.assertEqual(str(p),
+            "1 eclasses preloaded, 3 of 4 inherits served from them (75.0%)")
+        p.reset()
+        self.assertEqual((p.hits, p.misses), (0, 0))
+
+
+class TestTemplateProcessor(TestCase):
+
+    def test_fork_daemon(self):
+        written = []
+        class fake_template(processor.EbuildProcessor):
+            def __init__(self, response):
+                self._outstanding_expects = []
+                self.response = response
+            def write(self, string, **kwds):
+                written.append(string)
+            def read(self, lines=1, ignore_killed=False):
+                return self.response
+
+        ebp = fake_template("forked 1234\n")
+        # the path goes after its size, so may hold whitespace.
+        self.assertEqual(ebp._fork_daemon('/tmp dir/ebd'), 1234)
+        self.assertEqual(written, ['fork_daemon 12\n/tmp dir/ebd'])
+        self.assertRaises(processor.InitializationError,
+            fake_template("died\n")._fork_daemon, '/tmp')
+
+    def test_incompatible_template(self):
+        class fake_template(processor.EbuildProcessor):
+            def __init__(self, userpriv=False, sandbox=False):
+                self.pid = None
+                self._EbuildProcessor__userpriv = userpriv
+                self._EbuildProcessor__sandbox = sandbox
+                self._EbuildProcessor__fakeroot = False
+
+        for template, args in (
+                (fake_template(), (False, True, False)),
+                (fake_template(), (True, False, False)),
+                (fake_template(userpriv=True), (False, False, False)),
+                (fake_template(sandbox=True), (False, False, False))):
+            self.assertRaises(processor.InitializationError,
+                processor.EbuildProcessor, *args, save_file=None,
+                template=template)
+
+
+class fake_processor(object):
+
+    def __init__(self, userpriv, sandbox, fakeroot, save_file):
+        self.userpriv, self.sandbox, self.fakeroot = userpriv, sandbox, fakeroot
+        self.is_alive = True
+        self.locked = False
+        self._preloader = None
+
+    def userprived(self):
+        return self.userpriv
+
+    def sandboxed(self):
+        return self.sandbox
+
+    def onetime(self):
+        return self.fakeroot
+
+    def shutdown_processor(self, ignore_keyboard_interrupt=False):
+        self.is_alive = False
+
+
+class TestProcessorPool(TestCase):
+
+    def setUp(self):
+        self.spawned = []
+        def spawn(*args):
+            self.spawned.append(fake_processor(*args))
+            return self.spawned[-1]
+        self._orig_spawn = processor._spawn_ebuild_processor
+        processor._spawn_ebuild_processor = spawn
+        self.pool = processor.ProcessorPool()
+
+    def tearDown(self):
+        processor._spawn_ebuild_processor = self._orig_spawn
+
+    def test_reuse(self):
+        pool = self.pool
+        ebp = pool.request(False, False, False, None)
+        self.assertEqual(self.spawned, [ebp])
+        self.assertTrue(pool.release(ebp))
+        # not known as active anymore.
+        self.assertFalse(pool.release(ebp))
+        self.assertFalse(pool.release(fake_processor(False, False, False, None)))
+        self.assertIdentical(pool.request(False, False, False, None), ebp)
+        # other kinds aren't interchangeable...
+        other = pool.request(True, False, False, None)
+        self.assertNotIdentical(other, ebp)
+        sandboxed = pool.request(False, True, False, None)
+        self.assertEqual(len(self.spawned), 3)
+        self.assertEqual(len(pool), 3)
+        for x in (ebp, other, sandboxed):
+            pool.release(x)
+        # ...except sandboxed processors serving unsandboxed requests.
+        l = [pool.request(False, False, False, None) for x in range(2)]
+        self.assertEqual(sorted(map(id, l)), sorted(map(id, [ebp, sandboxed])))
+        pool.release(l[0])
+
+        # idle processors are claimed by whoever finds them, including
+        # other threads.
+        got = []
+        t = threading.Thread(
+            target=lambda: got.append(pool.request(False, False, False, None)))
+        t.start()
+        t.join()
+        self.assertEqual(got, [l[0]])
+        self.assertEqual(len(self.spawned), 3)
+
+    def test_discard(self):
+        pool = self.pool
+        ebp = pool.request(False, False, True, None)
+        # fakeroot processors are never reused.
+        pool.release(ebp)
+        self.assertFalse(ebp.is_alive)
+        self.assertEqual(len(pool), 0)
+
+        ebp = pool.request(False, False, False, None)
+        pool.release(ebp)
+        ebp.is_alive = False
+        other = pool.request(False, False, False, None)
+        self.assertNotIdentical(ebp, other)
+        self.assertEqual(len(pool), 1)
+
+        pool.shutdown()
+        self.assertFalse(other.is_alive)
+        self.assertEqual(len(pool), 0)
+
+    def test_iter_idle(self):
+        pool = self.pool
+        l = [pool.request(False, False, False, None) for x in range(3)]
+        pool.release(l[0])
+        pool.release(l[1])
+        self.assertEqual(sorted(map(id, pool.iter_idle())),
+                         sorted(map(id, l[:2])))
+        # still available afterwards.
+        self.assertIn(pool.request(False, False, False, None), l[:2])
+        self.assertIn(pool.request(False, False, False, None), l[:2])
+
+    def test_max_size(self):
+        pool = self.pool
+        pool.max_size = 1
+        ebp = pool.request(False, False, False, None)
+        got = []
+        t = threading.Thread(
+            target=lambda: got.append(pool.request(True, False, False, None)))
+        t.start()
+        t.join(0.1)
+        # blocked till a processor is released.
+        self.assertTrue(t.is_alive())
+        self.assertEqual(got, [])
+        pool.release(ebp)
+        # the idle processor is of the wrong kind, so it's dropped to make
+        # room for a new one.
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        self.assertFalse(ebp.is_alive)
+        self.assertEqual(len(got), 1)
+        self.assertTrue(got[0].userprived())
+
+    def test_threaded(self):
+        pool = self.pool
+        pool.max_size = 4
+        in_use = set()
+        lock = threading.Lock()
+        errors = []
+        def worker():
+            for x in xrange(200):
+                ebp = pool.request(False, x % 3 == 0, False, None)
+                with lock:
+                    if ebp in in_use:
+                        # handed out twice.
+                        errors.append(ebp)
+                    in_use.add(ebp)
+                time.sleep(0)
+                with lock:
+                    in_use.discard(ebp)
+                pool.release(ebp)
+        threads = [threading.Thread(target=worker) for x in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(len([x for x in self.spawned if x.is_alive]) <= 4)
+
+
+class TestGetKeysMany(TempDirMixin, TestCase):
+
+    ebuilds = {
+        'pkg-1': 'DESCRIPTION="one"\nSLOT=0\n',
+        'pkg-2': 'DESCRIPTION="two"\nSLOT=0\ndie "broken"\n',
+        'pkg-3': 'DESCRIPTION="three"\nSLOT=3\n',
+    }
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        ensure_dirs(pjoin(self.dir, 'profiles'))
+        ensure_dirs(pjoin(self.dir, 'eclass'))
+        ensure_dirs(pjoin(self.dir, 'cat', 'pkg'))
+        with open(pjoin(self.dir, 'profiles', 'repo_name'), 'w') as f:
+            f.write('test\n')
+        for name, data in self.ebuilds.iteritems():
+            with open(pjoin(self.dir, 'cat', 'pkg', name + '.ebuild'), 'w') as f:
+                f.write('EAPI=0\n' + data)
+        self.ec = eclass_cache.cache(pjoin(self.dir, 'eclass'))
+        repo = repository._UnconfiguredTree(self.dir, self.ec)
+        self.pkgs = sorted(repo.itermatch(packages.AlwaysTrue))
+
+    def test_get_keys_many(self):
+        try:
+            ebp = processor.request_ebuild_processor()
+        except Exception as e:
+            raise SkipTest("ebuild processor unavailable: %s" % (e,))
+        try:
+            try:
+                expected = ebp.get_keys(self.pkgs[0], self.ec)
+            except Exception as e:
+                raise SkipTest("ebuild processor can't source metadata: %s"
+                               % (e,))
+            results = ebp.get_keys_many(self.pkgs, self.ec)
+            # the failure doesn't affect the rest of the batch...
+            self.assertEqual(results[0], expected)
+            self.assertEqual(expected['DESCRIPTION'], 'one')
+            self.assertIdentical(results[1], None)
+            self.assertEqual(
+                [results[2]['DESCRIPTION'], results[2]['SLOT']],
+                ['three', '3'])
+            # ...nor the processor's later requests.
+            self.assertEqual(ebp.get_keys_many(self.pkgs[2:], self.ec),
+                             results[2:])
+            self.assertEqual(ebp.get_keys_many([], self.ec), [])
+        finally:
+            processor.release_ebuild_processor(ebp)
+
+    def test_template_fork(self):
+        try:
+            template = processor.EbuildProcessor(False, False, False, None)
+        except Exception as e:
+            raise SkipTest("ebuild processor unavailable: %s" % (e,))
+        try:
+            pids = []
+            for attempt in xrange(2):
+                ebp = processor.EbuildProcessor(False, False, False, None,
+                                                template=template)
+                try:
+                    pids.append(ebp.pid)
+                    try:
+                        keys = ebp.get_keys(self.pkgs[0], self.ec)
+                    except Exception as e:
+                        raise SkipTest("ebuild processor can't source "
+                                       "metadata: %s" % (e,))
+                    self.assertEqual(keys['DESCRIPTION'], 'one')
+                    self.assertEqual(ebp.get_keys_many(self.pkgs, self.ec)[1],
+                                     None)
+                finally:
+                    ebp.shutdown_processor()
+            self.assertNotIn(template.pid, pids)
+            self.assertNotEqual(pids[0], pids[1])
+            # the forks exit with their processor, while the template
+            # carries on.
+            for pid in pids:
+                for x in xrange(100):
+                    if not _running(pid):
+                        break
+                    time.sleep(0.05)
+                else:
+                    self.fail("forked processor %i didn't exit" % (pid,))
+            self.assertTrue(template.is_alive)
+        finally:
+            template.shutdown_processor()
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        with open('/proc/%i/status' % (pid,)) as f:
+            # exited, but not yet reaped by init.
+            return 'State:\tZ' not in f.read()
+    except EnvironmentError:
+        return True
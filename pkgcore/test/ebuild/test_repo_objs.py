@@ -1,7 +1,11 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
+import os
+
 from snakeoil.data_source import data_source
+from snakeoil.osutils import pjoin, ensure_dirs
+from snakeoil.test.mixins import TempDirMixin
 
 from pkgcore.test import TestCase
 from pkgcore.ebuild import repo_objs
@@ -9,7 +13,8 @@ from pkgcore.ebuild import repo_objs
 class TestMetadataXml(TestCase):
 
     @staticmethod
-    def get_metadata_xml(herds=(), maintainers=(), longdescription=None):
+    def get_metadata_xml(herds=(), maintainers=(), longdescription=None,
+                         local_use=""):
         hs, ms, ls = "", "", ""
         if herds:
             hs = "<herd>%s</herd>\n" % "</herd><herd>".join(herds)
@@ -27,7 +32,7 @@ class TestMetadataXml(TestCase):
 """<?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE pkgmetadata SYSTEM "http://www.gentoo.org/dtd/metadata.dtd">
 <pkgmetadata>
-%s%s%s</pkgmetadata>""" % (hs, ms, ls)
+%s%s%s%s</pkgmetadata>""" % (hs, ms, ls, local_use)
         return repo_objs.MetadataXml(data_source(s.encode('utf-8')))
 
     def test_maintainers(self):
@@ -75,3 +80,134 @@ Blake-light tragedy among the scholars of war.
 
         self.assertEqual(" ".join(s.split()),
             self.get_metadata_xml(longdescription=s).longdescription)
+
+    def test_local_use(self):
+        # empty...
+        self.assertEqual({}, dict(self.get_metadata_xml().local_use))
+
+        mx = self.get_metadata_xml(local_use="""
+<use>
+  <flag name="foo">enable
+    <pkg>dev-util/foo</pkg> support</flag>
+  <flag name="bar">bar</flag>
+</use>
+<use lang="de"><flag name="foo">nein</flag></use>""")
+        self.assertEqual({"foo": "enable dev-util/foo support", "bar": "bar"},
+                         dict(mx.local_use))
+
+
+class TestMetadataXmlIndex(TempDirMixin, TestCase):
+
+    xml = u"""<?xml version="1.0" encoding="UTF-8"?>
+<pkgmetadata>
+<herd>video</herd>
+<maintainer><email>foo@gentoo.org</email><name>Foo \N{SNOWMAN}</name></maintainer>
+<maintainer><email>bar@gentoo.org</email><description>tabs\tand
+newlines</description></maintainer>
+<use><flag name="foo">foo support</flag></use>
+<longdescription>%s</longdescription>
+</pkgmetadata>"""
+
+    def write_xml(self, pkg, longdesc, mtime=1000000):
+        path = pjoin(self.dir, 'tree', 'cat', pkg, 'metadata.xml')
+        ensure_dirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write((self.xml % longdesc).encode('utf-8'))
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def mk_index(self):
+        return repo_objs.MetadataXmlIndex(pjoin(self.dir, 'tree'),
+            pjoin(self.dir, 'cache', '.metadata_xml_index'))
+
+    def mk_xml(self, index, pkg):
+        return repo_objs.IndexedMetadataXml(
+            pjoin(self.dir, 'tree', 'cat', pkg, 'metadata.xml'), index,
+            ('cat', pkg))
+
+    def assertParsed(self, mx, longdesc):
+        self.assertEqual(mx.herds, ('video',))
+        self.assertEqual([(m.email, m.name, m.description)
+                          for m in mx.maintainers],
+            [('foo@gentoo.org', u'Foo \N{SNOWMAN}', None),
+             ('bar@gentoo.org', None, 'tabs\tand\nnewlines')])
+        self.assertEqual(dict(mx.local_use), {'foo': 'foo support'})
+        self.assertEqual(mx.longdescription, longdesc)
+
+    def test_index(self):
+        self.write_xml('pkg', 'long')
+        index = self.mk_index()
+        self.assertParsed(self.mk_xml(index, 'pkg'), 'long')
+        # missing files aren't indexed.
+        self.assertEqual(self.mk_xml(index, 'missing').maintainers, ())
+        index.save()
+
+        index = self.mk_index()
+        self.assertEqual(index._entries.keys(), [('cat', 'pkg')])
+        # served from the index while mtime and size are unchanged...
+        self.write_xml('pkg', 'lang')
+        self.assertParsed(self.mk_xml(index, 'pkg'), 'long')
+        self.assertFalse(index._dirty)
+        # ...and reparsed once either changes.
+        self.write_xml('pkg', 'lang', 1000001)
+        self.assertParsed(self.mk_xml(index, 'pkg'), 'lang')
+        self.write_xml('pkg', 'longer', 1000001)
+        self.assertParsed(self.mk_xml(index, 'pkg'), 'longer')
+
+        # recently modified files aren't stored; they may change again
+        # without their mtime doing so.
+        path = self.write_xml('pkg', 'new')
+        os.utime(path, None)
+        self.mk_xml(index, 'pkg').herds
+        index.save()
+        self.assertEqual(self.mk_index()._entries, {})
+
+        # readonly indexes are never written.
+        index = repo_objs.MetadataXmlIndex(pjoin(self.dir, 'tree'),
+            pjoin(self.dir, 'ro', 'index'), readonly=True)
+        self.write_xml('pkg', 'long')
+        self.mk_xml(index, 'pkg').herds
+        index.save()
+        self.assertFalse(os.path.exists(pjoin(self.dir, 'ro')))
+
+
+class TestListingIndex(TempDirMixin, TestCase):
+
+    def test_malformed(self):
+        ensure_dirs(pjoin(self.dir, 'cat'))
+        os.utime(pjoin(self.dir, 'cat'), (1000, 1000))
+        path = pjoin(self.dir, 'index')
+        index = repo_objs.ListingIndex(path, 'settings')
+        index.update('cat', 1000.0, ['pkg'])
+        index.save()
+        with open(path) as f:
+            lines = f.readlines()
+        with open(path, 'w') as f:
+            f.write(lines[0])
+            f.write('missing fields\n')
+            f.write('other\tnot-a-mtime\tpkg\n')
+            f.writelines(lines[1:])
+
+        # malformed lines are misses; the rest is still used.
+        index = repo_objs.ListingIndex(path, 'settings')
+        self.assertEqual(index.lookup('cat', pjoin(self.dir, 'cat')),
+                         (1000.0, ('pkg',)))
+        self.assertEqual(sorted(index._entries), ['cat'])
+        # as is everything, under different settings.
+        index = repo_objs.ListingIndex(path, 'changed')
+        self.assertEqual(index.lookup('cat', pjoin(self.dir, 'cat')),
+                         (1000.0, None))
+
+    def test_load(self):
+        ensure_dirs(pjoin(self.dir, 'cat'))
+        os.utime(pjoin(self.dir, 'cat'), (1000, 1000))
+        path = pjoin(self.dir, 'index')
+        index = repo_objs.ListingIndex(path, 'settings')
+        index.update('cat', 1000.0, ['pkg'])
+        index.save()
+        index = repo_objs.ListingIndex(path, 'settings')
+        index.load()
+        # read up front; the file isn't needed after.
+        os.unlink(path)
+        self.assertEqual(index.lookup('cat', pjoin(self.dir, 'cat')),
+                         (1000.0, ('pkg',)))
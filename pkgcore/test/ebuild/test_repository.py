@@ -2,17 +2,23 @@
 # Copyright: 2007 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import logging
 import os
 from textwrap import dedent
 
+from snakeoil.chksum import LazilyHashedPath
 from snakeoil.osutils import ensure_dirs, pjoin
 from snakeoil.test.mixins import TempDirMixin
 
+from pkgcore.cache import flat_hash
 from pkgcore.ebuild import errors as ebuild_errors
-from pkgcore.ebuild import repository, eclass_cache
+from pkgcore.ebuild import repository, eclass_cache, restricts
 from pkgcore.ebuild.atom import atom
+from pkgcore.operations import observer
 from pkgcore.repository import errors
+from pkgcore.restrictions import packages, values
 from pkgcore.test import silence_logging
+from pkgcore.test.cache import test_base
 
 class UnconfiguredTreeTest(TempDirMixin):
 
@@ -106,6 +112,83 @@ class UnconfiguredTreeTest(TempDirMixin):
                     repo.itermatch(atom('cat/pkg'))), ['cat/pkg-3'])
                 os.unlink(fp)
 
+    @silence_logging(logging.root)
+    def test_listing_index(self):
+        cache_dir = pjoin(self.dir, 'cache')
+        tree = pjoin(self.dir, 'tree')
+        pkg_dir = pjoin(tree, 'cat', 'pkg')
+        ensure_dirs(pkg_dir)
+        ensure_dirs(pjoin(tree, 'cat', 'other'))
+        open(pjoin(pkg_dir, 'pkg-1.ebuild'), 'w').close()
+        def age(*paths):
+            for path in paths:
+                os.utime(path, (1000000, 1000000))
+        dirs = (tree, pjoin(tree, 'cat'), pkg_dir, pjoin(tree, 'cat', 'other'))
+        age(*dirs)
+        def mk_repo(readonly=False):
+            cache = flat_hash.database(cache_dir, readonly=readonly)
+            return self.mk_tree(tree, cache=(cache,))
+
+        repo = mk_repo()
+        self.assertEqual(repo.versions[('cat', 'pkg')], ('1',))
+        repo.save_listing_index()
+        self.assertTrue(os.path.exists(pjoin(cache_dir, '.listing_index')))
+        # the index isn't mistaken for a cache entry.
+        self.assertEqual(list(repo.cache[0]), [])
+
+        # listings are served from the index while the dir mtimes match...
+        open(pjoin(pkg_dir, 'pkg-2.ebuild'), 'w').close()
+        os.mkdir(pjoin(tree, 'cat', 'new'))
+        age(*dirs)
+        repo = mk_repo(readonly=True)
+        self.assertEqual(repo.versions[('cat', 'pkg')], ('1',))
+        self.assertEqual(sorted(repo.packages['cat']), ['other', 'pkg'])
+        self.assertEqual(list(repo.categories), ['cat'])
+        # ...and rescanned once they change.
+        os.utime(pkg_dir, None)
+        repo = mk_repo()
+        self.assertEqual(sorted(repo.versions[('cat', 'pkg')]), ['1', '2'])
+        self.assertEqual(sorted(repo.packages['cat']), ['other', 'pkg'])
+
+        # recently modified dirs aren't stored, as they may change again
+        # within the mtime granularity.
+        repo.save_listing_index()
+        os.unlink(pjoin(pkg_dir, 'pkg-1.ebuild'))
+        repo = mk_repo()
+        self.assertEqual(repo.versions[('cat', 'pkg')], ('2',))
+
+    @silence_logging(logging.root)
+    def test_prefetch_listings(self):
+        for cat in ('cat1', 'cat2'):
+            for pkg in ('a', 'b', 'c'):
+                ensure_dirs(pjoin(self.dir, cat, pkg))
+                for ver in ('1', '2'):
+                    open(pjoin(self.dir, cat, pkg, '%s-%s.ebuild' % (pkg, ver)),
+                         'w').close()
+        open(pjoin(self.dir, 'cat2', 'c', 'c-scm.ebuild'), 'w').close()
+        expected = self.mk_tree(self.dir)
+        cpvs = sorted(x.cpvstr for x in expected.itermatch(atom('cat1/a')))
+
+        repo = self.mk_tree(self.dir, listing_threads=4)
+        repo.prefetch_listings()
+        self.assertEqual(list(repo.packages.uncached(repo.categories)), [])
+        # failed listings are left to the lazy lookup.
+        self.assertEqual(list(repo.versions.uncached(repo.versions.iterkeys())),
+                         [('cat2', 'c')])
+        self.assertEqual(dict(repo.packages), dict(expected.packages))
+        self.assertEqual(repo.versions[('cat1', 'b')],
+                         expected.versions[('cat1', 'b')])
+        self.assertRaises(ebuild_errors.InvalidCPV,
+                          repo.versions.__getitem__, ('cat2', 'c'))
+
+        # full walks prefetch.
+        repo = self.mk_tree(self.dir, listing_threads=4,
+                            ignore_paludis_versioning=True)
+        self.assertEqual(len(list(repo.itermatch(packages.AlwaysTrue))), 12)
+        self.assertEqual(list(repo.versions.uncached(repo.versions.iterkeys())),
+                         [])
+        self.assertEqual(cpvs, ['cat1/a-1', 'cat1/a-2'])
+
     @silence_logging
     def test_package_mask(self):
         with open(pjoin(self.pdir, 'package.mask'), 'w') as f:
@@ -119,6 +202,206 @@ class UnconfiguredTreeTest(TempDirMixin):
             atom('<just/newer-than-42')]),
             sorted(repo.default_visibility_limiters))
 
+    @silence_logging(logging.root)
+    def test_regen_changed_pkgs(self):
+        ensure_dirs(pjoin(self.dir, 'cat', 'pkg'))
+        ensure_dirs(pjoin(self.dir, 'cat', 'other'))
+        for fp in ('pkg/pkg-1', 'pkg/pkg-2', 'other/other-1'):
+            open(pjoin(self.dir, 'cat', fp + '.ebuild'), 'w').close()
+
+        class fake_cache(dict):
+            readonly = False
+
+            def eclass_consumers(self, eclass):
+                return dict((cpv, data['_eclasses_'][eclass])
+                            for cpv, data in self.iteritems()
+                            if eclass in data.get('_eclasses_', ()))
+
+        cache = fake_cache({
+            'cat/pkg-1': {'_eclasses_': {'foo': ('/', 1)}},
+            'cat/pkg-2': {'_eclasses_': {'bar': ('/', 1)}},
+            'cat/other-1': {},
+            'cat/gone-1': {'_eclasses_': {'foo': ('/', 1)}},
+        })
+        repo = self.mk_tree(self.dir, cache=(cache,))
+        snapshot = repo.mtime_snapshot()
+        self.assertEqual(sorted(snapshot),
+            sorted(pjoin(self.dir, 'cat', fp + '.ebuild') for fp in
+                   ('pkg/pkg-1', 'pkg/pkg-2', 'other/other-1')))
+
+        def changed(*paths):
+            return [x.cpvstr for x in repo._regen_changed_pkgs(paths)]
+
+        self.assertEqual(changed(), [])
+        self.assertEqual(changed('metadata/layout.conf'), [])
+        self.assertEqual(changed('cat/other/other-1.ebuild',
+            pjoin(self.dir, 'cat', 'pkg', 'pkg-2.ebuild')),
+            ['cat/other-1', 'cat/pkg-2'])
+        self.assertEqual(changed('./cat/pkg/pkg-1.ebuild',
+            'cat//other/./other-1.ebuild'), ['cat/other-1', 'cat/pkg-1'])
+        self.assertEqual(changed('eclass/foo.eclass'), ['cat/pkg-1'])
+        self.assertEqual(changed('eclass/bar.eclass', 'eclass/foo.eclass'),
+            ['cat/pkg-1', 'cat/pkg-2'])
+        self.assertIn('cat/gone-1', cache)
+        self.assertEqual(changed('cat/gone/gone-1.ebuild'), [])
+        self.assertNotIn('cat/gone-1', cache)
+
+    @silence_logging(logging.root)
+    def test_eclasses_inherited(self):
+        epath = pjoin(self.dir, 'eclass')
+        ensure_dirs(epath)
+        open(pjoin(epath, 'foo.eclass'), 'w').close()
+        for fp in ('pkg/pkg-1', 'pkg/pkg-2', 'other/other-1'):
+            ensure_dirs(pjoin(self.dir, 'cat', os.path.dirname(fp)))
+            open(pjoin(self.dir, 'cat', fp + '.ebuild'), 'w').close()
+        cache_dir = pjoin(self.dir, 'cache')
+        cache = flat_hash.database(cache_dir,
+            auxdbkeys=flat_hash.database.default_keys, readonly=False)
+        foo = eclass_cache.cache(epath).eclasses['foo']
+        ebuild = lambda fp: LazilyHashedPath(
+            pjoin(self.dir, 'cat', fp + '.ebuild'))
+        cache['cat/pkg-1'] = {'_chf_': ebuild('pkg/pkg-1'),
+                              '_eclasses_': {'foo': foo}}
+        # generated from an older ebuild.
+        cache['cat/pkg-2'] = {'_chf_': LazilyHashedPath('/', mtime=1),
+                              '_eclasses_': {'foo': foo}}
+        cache.commit()
+
+        class fake_pkg(object):
+            # inherited stands in for the sourced metadata.
+            inherited = ('sourced',)
+
+            def __init__(self, fp):
+                self.cpvstr = 'cat/' + os.path.basename(fp)
+                self.path = ebuild(fp).path
+
+        def inherited(fp):
+            repo = self.mk_tree(self.dir, eclass_cache=eclass_cache.cache(epath),
+                cache=(flat_hash.database(cache_dir,
+                    auxdbkeys=flat_hash.database.default_keys),))
+            return repo.eclasses_inherited(fake_pkg(fp))
+
+        self.assertEqual(inherited('pkg/pkg-1'), ('foo',))
+        # stale and uncached entries fall back to the package.
+        self.assertEqual(inherited('pkg/pkg-2'), ('sourced',))
+        self.assertEqual(inherited('other/other-1'), ('sourced',))
+        # nor is the index trusted for changed eclasses.
+        os.utime(pjoin(epath, 'foo.eclass'), (1, 1))
+        self.assertEqual(inherited('pkg/pkg-1'), ('sourced',))
+
+    @silence_logging(logging.root)
+    def test_regen_processes(self):
+        ebuilds = {
+            'cat/pkg/pkg-1': 'SLOT=1\nDESCRIPTION=one\n',
+            'cat/pkg/pkg-2': 'SLOT=2\nDESCRIPTION=two\n',
+            'cat/other/other-1': 'SLOT=0\nDESCRIPTION=other\n',
+            'cat/broken/broken-1': 'die\n',
+        }
+        for fp, data in ebuilds.iteritems():
+            ensure_dirs(pjoin(self.dir, os.path.dirname(fp)))
+            with open(pjoin(self.dir, fp + '.ebuild'), 'w') as f:
+                f.write(data)
+        cache = flat_hash.database(pjoin(self.dir, 'cache'),
+            auxdbkeys=('SLOT', 'DESCRIPTION'))
+        repo = self.mk_tree(self.dir, cache=(cache,))
+
+        class helper(repository._RegenOpHelper):
+            # stands in for the ebuild processor; sourcing is a plain parse
+            # of the ebuild, done in the worker processes.
+            def generate_many(self, pkgs):
+                results = []
+                for pkg in pkgs:
+                    with open(pkg.path) as f:
+                        lines = f.read().split()
+                    if 'die' in lines:
+                        results.append((pkg, None, Exception('died')))
+                        continue
+                    data = dict(x.split('=', 1) for x in lines)
+                    results.append((pkg, (data, ''), None))
+                return results
+        repo._regen_operation_helper = lambda **kwds: helper(repo, **kwds)
+
+        class obs(observer.null_output):
+            errors = []
+            def error(self, msg, *args, **kwds):
+                self.errors.append(msg)
+
+        repo.operations.regen_cache(processes=2, observer=obs())
+        self.assertEqual(len(obs.errors), 1)
+        self.assertIn('cat/broken-1', obs.errors[0])
+        # stored by the parent, so visible without reloading the cache.
+        self.assertEqual(sorted(cache),
+            ['cat/other-1', 'cat/pkg-1', 'cat/pkg-2'])
+        self.assertEqual(
+            dict((cpv, (cache[cpv]['SLOT'], cache[cpv]['DESCRIPTION']))
+                 for cpv in cache),
+            {'cat/other-1': ('0', 'other'), 'cat/pkg-1': ('1', 'one'),
+             'cat/pkg-2': ('2', 'two')})
+
+    @silence_logging(logging.root)
+    def test_revdep_candidates(self):
+        ebuilds = ('pkg/pkg-1', 'pkg/pkg-2', 'other/other-1', 'dep/dep-1',
+                   'new/new-1', 'stale/stale-1')
+        for fp in ebuilds:
+            ensure_dirs(pjoin(self.dir, 'cat', fp.split('/')[0]))
+            open(pjoin(self.dir, 'cat', fp + '.ebuild'), 'w').close()
+        def mk_cache():
+            return flat_hash.database(
+                pjoin(self.dir, 'metadata', 'md5-cache'),
+                auxdbkeys=('DEPEND', 'RDEPEND', 'PDEPEND', '_mtime_'))
+        cache = mk_cache()
+        entries = {
+            'cat/pkg-1': {'RDEPEND': '>=cat/dep-2'},
+            'cat/pkg-2': {'DEPEND': 'x? ( cat/dep )'},
+            'cat/other-1': {'PDEPEND': 'cat/pkg'},
+            'cat/dep-1': {},
+            'cat/stale-1': {},
+            'cat/gone-1': {'RDEPEND': 'cat/dep'},
+        }
+        for cpv, data in entries.iteritems():
+            data['_chf_'] = test_base._mk_chf_obj(mtime=100)
+            cache[cpv] = data
+        # entries are validated against the ebuilds.
+        for fp in ebuilds:
+            os.utime(pjoin(self.dir, 'cat', fp + '.ebuild'), (100, 100))
+        # generated from an older ebuild; for all we know, it now depends on
+        # cat/dep.
+        cache['cat/stale-1'] = {
+            '_chf_': LazilyHashedPath('/', mtime=1)}
+        cache.commit()
+        os.unlink(pjoin(cache.location, cache.revdep_index_name))
+        cache = mk_cache()
+        repo = self.mk_tree(self.dir, cache=(cache,))
+
+        def candidates(*restricts):
+            return list(repo._identify_candidates(
+                packages.AndRestriction(*restricts), sorted))
+
+        dep = restricts.RevdepRestriction(atom('<cat/dep-2'))
+        # cat/new lacks a cache entry and cat/stale a valid one, so neither
+        # can be ruled out.
+        self.assertEqual(candidates(dep),
+            [('cat', 'new'), ('cat', 'pkg'), ('cat', 'stale')])
+        self.assertEqual(candidates(dep, packages.PackageRestriction(
+            'package', values.StrExactMatch('pkg'))), [('cat', 'pkg')])
+        self.assertEqual(candidates(packages.OrRestriction(dep,
+            restricts.RevdepRestriction(atom('cat/pkg')))),
+            [('cat', 'new'), ('cat', 'other'), ('cat', 'pkg'),
+             ('cat', 'stale')])
+        # anything else isn't narrowed down.
+        self.assertEqual(len(candidates(packages.OrRestriction(dep,
+            packages.AlwaysTrue))), 5)
+        self.assertEqual(len(candidates(
+            restricts.RevdepRestriction(atom('cat/dep'), negate=True))), 5)
+
+        # the scan is kept for the next instance.
+        self.assertIdentical(cache._stored_revdep_index._read(), None)
+        repo.save_indexes()
+        self.assertEqual(cache._stored_revdep_index._read().get('cat/dep'),
+            {'cat/pkg-1': (('RDEPEND', '>=cat/dep-2'),),
+             'cat/pkg-2': (('DEPEND', 'cat/dep'),),
+             'cat/gone-1': (('RDEPEND', 'cat/dep'),)})
+
 
 class SlavedTreeTest(UnconfiguredTreeTest):
 
@@ -0,0 +1,71 @@
+# License: GPL2/BSD
+
+from pkgcore.test import TestCase
+from pkgcore.ebuild.atom import atom
+from pkgcore.repository.misc import caching_repo
+from pkgcore.repository.util import SimpleTree
+
+
+class TestCachingRepo(TestCase):
+
+    def setUp(self):
+        self.queries = []
+        class counting_tree(SimpleTree):
+            def itermatch(s, restrict, **kwds):
+                self.queries.append(restrict)
+                return SimpleTree.itermatch(s, restrict, **kwds)
+        self.raw = counting_tree({
+            "dev-util": {"diffball": ["1.0", "0.7"], "bsdiff": ["0.4.1"]},
+            "dev-lib": {"fake": ["1.0"]}})
+        self.atoms = [atom("dev-util/diffball"), atom("dev-util/bsdiff"),
+                      atom("dev-lib/fake")]
+
+    def test_unbounded(self):
+        repo = caching_repo(self.raw, sorted)
+        a = self.atoms[0]
+        self.assertEqual([x.cpvstr for x in repo.match(a)],
+                         ["dev-util/diffball-0.7", "dev-util/diffball-1.0"])
+        self.assertIdentical(repo.match(a), repo.match(a))
+        self.assertEqual(self.queries, [a])
+        self.assertEqual((repo.hits, repo.misses, repo.evictions), (2, 1, 0))
+        repo.clear()
+        repo.match(a)
+        self.assertEqual(self.queries, [a, a])
+
+    def test_lru(self):
+        repo = caching_repo(self.raw, sorted, max_size=2)
+        a, b, c = self.atoms
+        repo.match(a)
+        repo.match(b)
+        # a is now the most recently used, so b is dropped for c.
+        repo.match(a)
+        repo.match(c)
+        self.assertEqual(repo.evictions, 1)
+        repo.match(a)
+        self.assertEqual(self.queries, [a, b, c])
+        repo.match(b)
+        self.assertEqual(self.queries, [a, b, c, b])
+        self.assertEqual((repo.hits, repo.misses, repo.evictions), (2, 4, 2))
+        self.assertEqual(repo.format_stats(),
+            "6 lookups, 2 hits (0 from weakrefs), 4 misses, 2 evictions; "
+            "33.3% hit rate")
+
+    def test_weak(self):
+        repo = caching_repo(self.raw, sorted, max_size=1, weak=True)
+        a, b, c = self.atoms
+        # fully pulled results stay available while referenced elsewhere...
+        held = repo.match(a)
+        list(held)
+        repo.match(b)
+        self.assertIdentical(repo.match(a), held)
+        self.assertEqual(self.queries, [a, b])
+        self.assertEqual((repo.hits, repo.weak_hits), (1, 1))
+        # ...but not once they're unreferenced, or were only partially pulled.
+        list(repo.match(b))
+        self.assertEqual(self.queries, [a, b, b])
+        del held
+        repo.match(c)
+        partial = repo.match(b)
+        repo.match(a)
+        self.assertEqual(self.queries, [a, b, b, c, b, a])
+        self.assertNotIdentical(repo.match(b), partial)
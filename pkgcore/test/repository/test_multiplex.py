@@ -8,6 +8,7 @@ from snakeoil.currying import partial
 from pkgcore.repository.multiplex import tree
 from pkgcore.restrictions import packages, values
 from pkgcore.repository.util import SimpleTree
+from pkgcore.util.packages import key_sorter
 
 rev_sorted = partial(sorted, reverse=True)
 
@@ -62,6 +63,15 @@ class TestMultiplex(TestCase):
             self.ctree.itermatch(packages.AlwaysTrue, sorter=rev_sorted)),
             rev_sorted(self.tree1_list + self.tree2_list))
 
+    def test_merge_sorting(self):
+        sorter = key_sorter(reverse=True)
+        self.assertEqual(list(x.cpvstr for x in
+            self.ctree.itermatch(packages.AlwaysTrue, sorter=sorter)),
+            ["dev-util/diffball-1.1", "dev-util/diffball-1.0",
+             "dev-util/diffball-1.0", "dev-util/diffball-0.7",
+             "dev-lib/fake-1.0-r1", "dev-lib/fake-1.0",
+             "dev-lib/bsdiff-2.0", "dev-lib/bsdiff-1.0"])
+
     def test_install(self):
         raise Exception()
     test_install.todo = "need to implement tests for multiplexing down repo_ops"
@@ -7,6 +7,7 @@ from pkgcore.ebuild.cpv import versioned_CPV
 from pkgcore.test.repository.test_prototype import SimpleTree
 from pkgcore.repository.visibility import filterTree
 from pkgcore.restrictions import packages, values
+from pkgcore.restrictions.delegated import delegate
 
 class TestVisibility(TestCase):
 
@@ -51,3 +52,34 @@ class TestVisibility(TestCase):
                     *[values.StrExactMatch(x) for x in ("diffball", "fake")])))
         self.assertEqual(
             sorted(vrepo), sorted(repo.itermatch(atom("dev-util/bsdiff"))))
+
+    def test_cost_ordering(self):
+        checked = []
+        def expensive(pkg, mode):
+            checked.append(pkg.cpvstr)
+            return pkg.fullver != "0.4.1"
+        repo = self.setup_repos()[0]
+        vrepo = filterTree(repo, packages.AndRestriction(
+            delegate(expensive),
+            packages.PackageRestriction("package",
+                values.StrExactMatch("diffball"), negate=True)),
+            sentinel_val=True)
+        # costly filter terms only run for packages the cheap terms of both
+        # the filter and the query accept.
+        self.assertEqual(
+            sorted(x.cpvstr for x in vrepo.itermatch(atom(">=dev-util/bsdiff-0.4.2"))),
+            ["dev-util/bsdiff-0.4.2"])
+        self.assertEqual(checked, ["dev-util/bsdiff-0.4.2"])
+        del checked[:]
+        self.assertEqual(
+            sorted(x.cpvstr for x in vrepo),
+            ["dev-lib/fake-1.0", "dev-lib/fake-1.0-r1",
+             "dev-util/bsdiff-0.4.2"])
+        self.assertEqual(len(checked), 4)
+
+        # filters hiding what they match are matched as a whole.
+        vrepo = filterTree(repo, packages.AndRestriction(delegate(expensive),
+            atom("dev-util/bsdiff")))
+        self.assertEqual(
+            sorted(x.cpvstr for x in vrepo.itermatch(atom("dev-util/bsdiff"))),
+            ["dev-util/bsdiff-0.4.1"])
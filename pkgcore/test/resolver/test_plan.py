@@ -4,7 +4,9 @@
 from snakeoil.currying import post_curry
 from pkgcore.test import TestCase
 from pkgcore.resolver import plan
-from pkgcore.test.misc import FakePkg
+from pkgcore.repository.misc import multiplex_sorting_repo
+from pkgcore.restrictions import packages
+from pkgcore.test.misc import FakePkg, FakeRepo
 
 class TestPkgSorting(TestCase):
 
@@ -28,3 +30,27 @@ class TestPkgSorting(TestCase):
 
     test_pkg_sort_lowest = post_curry(check_it, plan.pkg_sort_lowest,
         [11,9,1,6], [1,6,9,11])
+
+    def test_iter_sorters(self):
+        livefs = FakeRepo(livefs=True)
+        repos = [
+            FakeRepo([FakePkg("d-b/a-%s" % x, repo=FakeRepo(livefs=False))
+                      for x in (1, 3, 4)]),
+            FakeRepo([FakePkg("d-b/a-%s" % x, repo=livefs) for x in (2, 3)]),
+            FakeRepo([]),
+        ]
+        def check(sorter, repo_sorter, expected):
+            repo = multiplex_sorting_repo(sorter, *repos)
+            for r in repos:
+                r.itermatch = lambda restrict, r=r: FakeRepo.itermatch(
+                    r, restrict, sorter=repo_sorter)
+            self.assertEqual(
+                [(x.fullver, x.repo.livefs)
+                 for x in repo.itermatch(packages.AlwaysTrue)], expected)
+        # livefs pkgs win ties in both directions.
+        check(plan.highest_iter_sorter, plan.pkg_sort_highest.sort_pkgs,
+              [("4", False), ("3", True), ("3", False), ("2", True),
+               ("1", False)])
+        check(plan.lowest_iter_sorter, plan.pkg_sort_lowest.sort_pkgs,
+              [("1", False), ("2", True), ("3", True), ("3", False),
+               ("4", False)])
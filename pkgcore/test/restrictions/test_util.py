@@ -2,7 +2,9 @@
 # License: GPL2/BSD
 
 from pkgcore.test import TestCase
+from pkgcore.ebuild.atom import atom
 from pkgcore.restrictions import util, packages, values
+from pkgcore.restrictions.delegated import delegate
 
 class Test_collect_package_restrictions(TestCase):
 
@@ -31,3 +33,47 @@ class Test_collect_package_restrictions(TestCase):
             self.assertEqual(
                 list(util.collect_package_restrictions(r, attrs=[k])),
                 [v] * 2)
+
+
+class Test_restriction_cost(TestCase):
+
+    def test_cost(self):
+        def pr(attr):
+            return packages.PackageRestriction(attr, values.AlwaysTrue)
+        for r, cost in (
+                (packages.AlwaysTrue, util.CPV_COST),
+                (pr("category"), util.CPV_COST),
+                (pr("repo.repo_id"), util.CPV_COST),
+                (atom("=dev-util/foo-1"), util.CPV_COST),
+                (pr("keywords"), util.METADATA_COST),
+                (atom("dev-util/foo:1"), util.METADATA_COST),
+                (pr("depends"), util.DEPSET_COST),
+                (delegate(lambda pkg, mode: True), util.DEPSET_COST),
+                (packages.PackageRestrictionMulti(("category", "iuse"),
+                    values.AlwaysTrue), util.METADATA_COST),
+                (packages.OrRestriction(pr("package"), pr("license")),
+                    util.DEPSET_COST),
+                (packages.AndRestriction(pr("package"), negate=True),
+                    util.CPV_COST)):
+            self.assertEqual(util.restriction_cost(r), cost, r)
+
+        # large restrictions are costed once.
+        r = packages.OrRestriction(*[atom("=dev-util/foo-%i" % x)
+                                     for x in range(20)])
+        self.assertEqual(util.restriction_cost(r), util.CPV_COST)
+        self.assertEqual(util._cost_cache[id(r)], (r, util.CPV_COST))
+
+    def test_split_by_cost(self):
+        keywords = packages.PackageRestriction("keywords", values.AlwaysTrue)
+        license = delegate(lambda pkg, mode: True)
+        a = atom("=dev-util/foo-1:2")
+        nand = packages.AndRestriction(a, negate=True)
+        self.assertEqual(util.split_by_cost(
+            packages.AndRestriction(license, keywords, a, nand)),
+            [(util.CPV_COST, x) for x in a.restrictions[:3]] +
+            [(util.METADATA_COST, keywords),
+             (util.METADATA_COST, a.restrictions[3]),
+             (util.METADATA_COST, nand),
+             (util.DEPSET_COST, license)])
+        self.assertEqual(util.split_by_cost(nand),
+                         [(util.METADATA_COST, nand)])
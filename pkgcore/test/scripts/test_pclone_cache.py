@@ -1,8 +1,14 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import os
+
+from snakeoil.osutils import pjoin, ensure_dirs
+from snakeoil.test.mixins import TempDirMixin
+
 from pkgcore.test import TestCase
 
+from pkgcore.cache import flat_hash, metadata
 from pkgcore.scripts import pclone_cache
 from pkgcore.test.scripts import helpers
 from pkgcore.config import basics, ConfigHint
@@ -36,3 +42,45 @@ class CommandlineTest(TestCase, helpers.ArgParseMixin):
             'spork', 'spork2',
             spork=basics.HardCodedConfigSection({'class': Cache,}),
             spork2=basics.HardCodedConfigSection({'class': Cache,}))
+
+
+class CloneTest(TempDirMixin, TestCase, helpers.ArgParseMixin):
+
+    _argparser = pclone_cache.argparser
+
+    def test_convert_eclass_chfs(self):
+        repo, target = pjoin(self.dir, 'repo'), pjoin(self.dir, 'target')
+        eclass_dir = pjoin(repo, 'eclass')
+        ensure_dirs(eclass_dir)
+        for eclass, mtime in (('foo', 100), ('bar', 200)):
+            path = pjoin(eclass_dir, eclass + '.eclass')
+            open(path, 'w').close()
+            os.utime(path, (mtime, mtime))
+        ensure_dirs(pjoin(repo, 'metadata', 'cache', 'cat'))
+        for cpv, inherited in (('cat/pkg-1', 'foo'),
+                               ('cat/pkg-2', 'foo bar'),
+                               ('cat/pkg-3', 'missing'),
+                               ('cat/pkg-4', '')):
+            # the old flat_list format; INHERITED is the tenth line.
+            path = pjoin(repo, 'metadata', 'cache', cpv)
+            with open(path, 'w') as f:
+                f.write('\n\n0\n' + '\n' * 6 + inherited + '\n' * 13)
+            os.utime(path, (100, 100))
+
+        self.assertOut(["*** skipping cat/pkg-3; eclass 'missing' "
+                        "wasn't found"], 'source', 'target',
+            source=basics.HardCodedConfigSection({
+                'class': metadata.database, 'location': repo}),
+            target=basics.HardCodedConfigSection({
+                'class': flat_hash.database, 'location': target}))
+
+        target = flat_hash.database(target)
+        self.assertEqual(sorted(target.iterkeys()),
+                         ['cat/pkg-1', 'cat/pkg-2', 'cat/pkg-4'])
+        entry = target['cat/pkg-2']
+        self.assertEqual(entry['SLOT'], '0')
+        self.assertEqual(entry['_mtime_'], 100)
+        self.assertEqual(sorted(entry['_eclasses_']),
+            [('bar', (('eclassdir', eclass_dir), ('mtime', 200))),
+             ('foo', (('eclassdir', eclass_dir), ('mtime', 100)))])
+        self.assertEqual(list(target['cat/pkg-4'].get('_eclasses_', ())), [])
@@ -4,6 +4,8 @@
 
 from pkgcore.test import TestCase
 from snakeoil import compatibility
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
 from snakeoil.formatters import PlainTextFormatter
 from snakeoil.currying import partial
 from snakeoil.mappings import AttrAccessible
@@ -14,6 +16,8 @@ from pkgcore.config import basics, ConfigHint, configurable
 from pkgcore.repository import util, syncable
 from pkgcore.sync import base
 from pkgcore.ebuild.cpv import CPV
+from pkgcore import operations as operations_mod
+from pkgcore.operations.regen import read_mtime_snapshot
 from pkgcore.operations.repo import (install,
     uninstall, replace, operations)
 
@@ -235,3 +239,85 @@ class TestRegen(TestCase, helpers.ArgParseMixin):
         self.assertEqual(
             [options.repo.__class__, options.threads],
             [TestSimpleTree, 2])
+        options = self.parse(
+            'spork', '--processes', '4', spork=basics.HardCodedConfigSection(
+                {'class': fake_repo}))
+        self.assertEqual(options.processes, 4)
+        options = self.parse(
+            'spork', '--mtime-snapshot', '/tmp/snapshot',
+            spork=basics.HardCodedConfigSection({'class': fake_repo}))
+        self.assertEqual(options.mtime_snapshot, '/tmp/snapshot')
+        self.assertEqual(options.changed_paths, None)
+
+
+class RegenOperations(operations):
+
+    @operations_mod.is_standalone
+    def _cmd_api_regen_cache(self, observer=None, **options):
+        self.repo.regens.append(options['changes'])
+        for error in self.repo.errors:
+            observer.error(error)
+
+
+class RegenRepo(util.SimpleTree):
+
+    operations_kls = RegenOperations
+
+    def __init__(self, errors=()):
+        util.SimpleTree.__init__(self, {})
+        self.errors = list(errors)
+        self.regens = []
+        self.snapshot = {}
+
+    def mtime_snapshot(self):
+        return dict(self.snapshot)
+
+
+class TestRegenMain(TempDirMixin, TestCase, helpers.ArgParseMixin):
+
+    _argparser = pmaint.regen
+
+    def test_mtime_snapshot(self):
+        snapshot = pjoin(self.dir, 'snapshot')
+        repo = RegenRepo()
+        section = basics.HardCodedConfigSection({'class': configurable(
+            typename='repo')(lambda: repo)})
+        args = ('spork', '--mtime-snapshot', snapshot)
+
+        repo.snapshot = {'/r/cat/pkg/pkg-1.ebuild': 1}
+        self.assertOut([], *args, spork=section)
+        self.assertEqual(repo.regens, [None])
+        self.assertEqual(read_mtime_snapshot(snapshot), repo.snapshot)
+
+        # failed packages have to be retried, so the snapshot is left alone.
+        repo.snapshot = {'/r/cat/pkg/pkg-1.ebuild': 2}
+        repo.errors = ['failed cat/pkg-1']
+        self.assertOutAndErr(['!!! failed cat/pkg-1'],
+            ["regen of %s had 1 errors, not updating mtime snapshot %s"
+             % (repo, snapshot)], *args, spork=section)
+        self.assertEqual(read_mtime_snapshot(snapshot),
+                         {'/r/cat/pkg/pkg-1.ebuild': 1})
+
+        repo.errors = []
+        self.assertOut([], *args, spork=section)
+        self.assertEqual(repo.regens[-1], ['/r/cat/pkg/pkg-1.ebuild'])
+        self.assertEqual(read_mtime_snapshot(snapshot), repo.snapshot)
+
+
+class TestCacheServer(TestCase, helpers.ArgParseMixin):
+
+    _argparser = pmaint.cache_server
+
+    def test_parser(self):
+
+        @configurable(typename='repo')
+        def fake_repo():
+            return util.SimpleTree({})
+
+        self.assertError('argument --socket is required',
+            'spork', spork=basics.HardCodedConfigSection({'class': fake_repo}))
+        options = self.parse(
+            'spork', '--socket', '/tmp/sock', '--check-interval', '2',
+            spork=basics.HardCodedConfigSection({'class': fake_repo}))
+        self.assertEqual(
+            [options.socket, options.check_interval], ['/tmp/sock', 2.0])
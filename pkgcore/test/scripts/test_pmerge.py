@@ -6,7 +6,9 @@ from pkgcore.test import TestCase
 from pkgcore.scripts import pmerge
 from pkgcore.repository import util
 from pkgcore.ebuild import formatter
-from pkgcore.config import basics
+from pkgcore.config import basics, configurable
+from pkgcore.test.scripts import helpers
+from pkgcore.test.scripts.test_pquery import domain_config
 from pkgcore.util.parserestrict import parse_match
 
 
@@ -49,3 +51,22 @@ class AtomParsingTest(TestCase):
         a = pmerge.parse_atom(parse_match("bar"), repo, livefs_repos)
         self.assertEqual(a.key, 'foo/bar')
         self.assertTrue(isinstance(a.key, str))
+
+
+@configurable(typename='pkgset')
+def fake_world():
+    return frozenset()
+
+
+class CommandlineTest(TestCase, helpers.ArgParseMixin):
+
+    _argparser = pmerge.argparser
+
+    def test_query_cache_size(self):
+        sections = dict(domain=domain_config, formatter=default_formatter,
+            world=basics.HardCodedConfigSection({'class': fake_world}))
+        self.assertError("--query-cache-size must be 0 or more",
+            '--query-cache-size=-1', 'dev-util/foo', **sections)
+        options = self.parse('--query-cache-size', '0', 'dev-util/foo',
+            **sections)
+        self.assertEqual(options.query_cache_size, 0)
@@ -0,0 +1,137 @@
+# License: GPL2/BSD
+
+import os
+import shutil
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.fs import contents, fs
+from pkgcore.restrictions import packages, values
+from pkgcore.test import TestCase
+from pkgcore.vdb import ondisk
+from pkgcore.vdb.contents import OwnerIndex
+
+
+class TestOwnerIndex(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.vdb = pjoin(self.dir, 'vdb')
+        self.index_path = pjoin(self.dir, 'cache', 'owners.index')
+        self.mk_pkg('cat/pkg-1', 'dir /usr', 'dir /usr/bin',
+            'obj /usr/bin/foo d41d8cd98f00b204e9800998ecf8427e 100',
+            'sym /usr/bin/bar -> foo 100')
+        self.mk_pkg('cat/other-2', 'dir /usr',
+            'obj /usr/lib/libx.so d41d8cd98f00b204e9800998ecf8427e 100')
+        self.mk_pkg('cat/empty-1')
+        # in progress merges aren't packages yet.
+        ensure_dirs(pjoin(self.vdb, 'cat', '.tmp.pkg-2'))
+
+    def mk_pkg(self, cpv, *lines):
+        path = pjoin(self.vdb, cpv)
+        ensure_dirs(path)
+        if lines:
+            with open(pjoin(path, 'CONTENTS'), 'w') as f:
+                f.write(''.join('%s\n' % x for x in lines))
+        # force the mtime to differ from anything indexed before.
+        mtime = getattr(self, '_mtime', 1000) + 1
+        self._mtime = mtime
+        os.utime(path, (mtime, mtime))
+
+    def mk_index(self):
+        return OwnerIndex(self.vdb, self.index_path)
+
+    def test_lookups(self):
+        index = self.mk_index()
+        self.assertEqual(index.owners('/usr'), ('cat/other-2', 'cat/pkg-1'))
+        self.assertEqual(index.owners('/usr/bin/bar'), ('cat/pkg-1',))
+        self.assertEqual(index.owners('/usr/bin/ba'), ())
+        self.assertEqual(index.owners('/zzz'), ())
+        expected = [('/usr', ('cat/other-2', 'cat/pkg-1')),
+            ('/usr/bin', ('cat/pkg-1',)), ('/usr/bin/bar', ('cat/pkg-1',)),
+            ('/usr/bin/foo', ('cat/pkg-1',)),
+            ('/usr/lib/libx.so', ('cat/other-2',))]
+        self.assertEqual(list(index.iteritems()), expected)
+        index.save()
+
+        # served from the file, without reading any CONTENTS.
+        index = self.mk_index()
+        index._read_contents = None
+        for path, owners in expected:
+            self.assertEqual(index.owners(path), owners)
+        for path in ('/', '/usr/bin/ba', '/usr/bin/fooo', '/zzz'):
+            self.assertEqual(index.owners(path), ())
+        self.assertEqual(list(index.iteritems()), expected)
+
+    def test_refresh(self):
+        # nothing is built till it's needed.
+        self.mk_index().refresh()
+        self.assertFalse(os.path.exists(self.index_path))
+        self.mk_index().save()
+        self.assertFalse(os.path.exists(self.index_path))
+
+        index = self.mk_index()
+        index.owners('/usr')
+        index.save()
+        shutil.rmtree(pjoin(self.vdb, 'cat', 'pkg-1'))
+        self.mk_pkg('cat/new-1', 'dir /usr', 'dir /usr/bin',
+            'obj /usr/bin/foo d41d8cd98f00b204e9800998ecf8427e 100')
+        self.mk_pkg('cat/other-2', 'dir /usr')
+        index.refresh()
+        self.assertEqual(index.owners('/usr'), ('cat/new-1', 'cat/other-2'))
+
+        # only what changed is read.
+        read = []
+        index = self.mk_index()
+        orig = index._read_contents
+        def _read_contents(cpv):
+            read.append(cpv)
+            return orig(cpv)
+        index._read_contents = _read_contents
+        self.assertEqual(index.owners('/usr/bin/foo'), ('cat/new-1',))
+        self.assertEqual(read, [])
+        self.assertEqual(index.owners('/usr/lib/libx.so'), ())
+        self.mk_pkg('cat/empty-1', 'obj /usr/lib/libx.so '
+            'd41d8cd98f00b204e9800998ecf8427e 100')
+        index.refresh()
+        self.assertEqual(read, ['cat/empty-1'])
+        self.assertEqual(list(index.iteritems()),
+            [('/usr', ('cat/new-1', 'cat/other-2')),
+             ('/usr/bin', ('cat/new-1',)), ('/usr/bin/foo', ('cat/new-1',)),
+             ('/usr/lib/libx.so', ('cat/empty-1',))])
+        index = self.mk_index()
+        index._read_contents = None
+        self.assertEqual(index.owners('/usr/lib/libx.so'), ('cat/empty-1',))
+
+    def test_vdb(self):
+        vdb = ondisk.tree(self.vdb, cache_location=pjoin(self.dir, 'cache'))
+        self.assertEqual(vdb.owner_index.path, self.index_path)
+        self.assertEqual([x.cpvstr for x in vdb.owners(['/usr/bin/foo'])],
+            ['cat/pkg-1'])
+        self.assertEqual([x.cpvstr for x in vdb.owners(['/usr', '/zzz'])],
+            ['cat/other-2', 'cat/pkg-1'])
+        vdb.save_indexes()
+        self.assertTrue(os.path.exists(self.index_path))
+
+        def candidates(restrict):
+            return list(vdb._identify_candidates(restrict, sorted))
+
+        owns = packages.PackageRestriction('contents',
+            values.ContainmentMatch2(contents.contentsSet(
+                [fs.fsBase('/usr/lib/libx.so', strict=False)])))
+        self.assertEqual(candidates(owns), [('cat', 'other')])
+        owns_re = packages.PackageRestriction('contents',
+            values.AnyMatch(values.GetAttrRestriction('location',
+                values.StrRegex('^/usr/bin/'))))
+        self.assertEqual(candidates(packages.AndRestriction(owns_re,
+            packages.AlwaysTrue)), [('cat', 'pkg')])
+        self.assertEqual(candidates(packages.OrRestriction(owns, owns_re)),
+            [('cat', 'other'), ('cat', 'pkg')])
+        self.assertEqual(len(candidates(packages.OrRestriction(owns,
+            packages.AlwaysTrue))), 3)
+
+        disabled = ondisk.tree(self.vdb, disable_cache=True)
+        self.assertIdentical(disabled.owner_index.path, None)
+        self.assertEqual([x.cpvstr for x in disabled.owners(['/usr/bin/foo'])],
+            ['cat/pkg-1'])
@@ -0,0 +1,90 @@
+# License: GPL2/BSD
+
+import os
+import shutil
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.test import TestCase
+from pkgcore.vdb import ondisk, repo_ops
+
+
+class TestMetadataIndex(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.vdb = pjoin(self.dir, 'vdb')
+        self.cache = pjoin(self.dir, 'cache')
+        self.mk_pkg('cat/pkg-1', SLOT='0\n', USE='x y\n',
+                    RDEPEND='x? ( cat/dep )\n', repository='gentoo\n')
+        self.mk_pkg('cat/pkg-2', SLOT='1\n', DESCRIPTION='tab\there\n')
+
+    def mk_pkg(self, cpv, mtime=1000, **files):
+        path = pjoin(self.vdb, cpv)
+        ensure_dirs(path)
+        for name, data in files.iteritems():
+            with open(pjoin(path, name), 'w') as f:
+                f.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def mk_vdb(self, **kwds):
+        return ondisk.tree(self.vdb, cache_location=self.cache, **kwds)
+
+    def test_index(self):
+        vdb = self.mk_vdb()
+        pkg1, pkg2 = sorted(vdb)
+        self.assertEqual(pkg1.data['SLOT'], '0\n')
+        self.assertEqual(pkg1.data['repo'], 'gentoo\n')
+        self.assertRaises(KeyError, pkg1.data.__getitem__, 'DEPEND')
+        self.assertEqual(pkg2.data['DESCRIPTION'], 'tab\there\n')
+        vdb.save_metadata_index()
+        index_path = pjoin(self.cache, 'metadata.index')
+        self.assertTrue(os.path.exists(index_path))
+
+        # indexed keys are served without touching the package's files.
+        vdb = self.mk_vdb()
+        vdb._internal_load_key = None
+        pkg1, pkg2 = sorted(vdb)
+        self.assertEqual(pkg1.data['USE'], 'x y\n')
+        self.assertEqual(pkg1.data['RDEPEND'], 'x? ( cat/dep )\n')
+        self.assertEqual(pkg1.source_repository, 'gentoo')
+        self.assertEqual(pkg1.data['repo'], 'gentoo\n')
+        self.assertRaises(KeyError, pkg1.data.__getitem__, 'DEPEND')
+        self.assertEqual(pkg2.data['SLOT'], '1\n')
+        self.assertRaises(KeyError, pkg2.data.__getitem__,
+                          'source_repository')
+
+        # changed packages are reread, and removed ones dropped.
+        self.mk_pkg('cat/pkg-1', mtime=2000, SLOT='2\n')
+        shutil.rmtree(pjoin(self.vdb, 'cat', 'pkg-2'))
+        vdb = self.mk_vdb()
+        pkg1, = vdb
+        self.assertEqual(pkg1.data['SLOT'], '2\n')
+        vdb.save_metadata_index()
+        with open(index_path) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('cat/pkg-1\t2000'))
+
+        # nothing stored without a cache location.
+        vdb = ondisk.tree(self.vdb, disable_cache=True)
+        self.assertIdentical(vdb.metadata_index, None)
+        pkg1, = vdb
+        self.assertEqual(pkg1.data['SLOT'], '2\n')
+        vdb.save_metadata_index()
+
+    def test_replace(self):
+        vdb = self.mk_vdb()
+        pkg1, pkg2 = sorted(vdb)
+        self.assertEqual(pkg1.data['SLOT'], '0\n')
+        # a same version replace, landing with the same directory mtime.
+        self.mk_pkg('cat/.tmp.pkg-1', SLOT='3\n')
+        op = repo_ops.replace(vdb, pkg1, pkg1, None)
+        self.assertTrue(op.finalize_data(ignore_deps=True))
+        self.assertEqual(vdb._get_metadata(pkg1)['SLOT'], '3\n')
+        vdb.save_metadata_index()
+        vdb = self.mk_vdb()
+        vdb._internal_load_key = None
+        pkg1, pkg2 = sorted(vdb)
+        self.assertEqual(pkg1.data['SLOT'], '3\n')
@@ -0,0 +1,133 @@
+# License: GPL2/BSD
+
+"""
+base for on disk indexes of data read from the filesystem
+"""
+
+__all__ = ("FileIndex",)
+
+import errno
+import os
+import time
+
+from snakeoil import klass
+from snakeoil.fileutils import AtomicWriteFile
+from snakeoil.osutils import ensure_dirs
+from snakeoil.demandload import demandload
+demandload(globals(), 'pkgcore.log:logger')
+
+
+class FileIndex(object):
+
+    """
+    on disk index of data read from files or directories
+
+    Entries are stored along with the stat data (mtime, and whatever else
+    is cheap to check) of what they were read from, and only used while
+    that's unchanged.  The file is a header line followed by the entries;
+    an index with a different header (format, or anything the entries depend
+    on) is ignored, as is one that fails to parse.
+
+    Derived classes supply the (de)serialization of the entries, a dict,
+    via :obj:`_read_entries` and :obj:`_write_entries`, and set ``_dirty``
+    when they change them.
+
+    :ivar path: location of the index file; if None, it's kept in memory
+    :ivar readonly: if True, the index is never written
+    :cvar magic: names the format; the first word of the header
+    :cvar description: what the index is of, for log messages
+    """
+
+    magic = None
+    description = 'index'
+    # files modified this close to the index being written may change
+    # again without their mtime changing, so aren't stored.
+    racy_window = 1
+
+    def __init__(self, path=None, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._dirty = False
+
+    @property
+    def header(self):
+        return self.magic
+
+    @klass.jit_attr
+    def _entries(self):
+        entries = self._read()
+        if entries is None:
+            return {}
+        return entries
+
+    def load(self):
+        """read the stored entries now, rather than on first use"""
+        self._entries
+
+    def _read(self):
+        """
+        :return: the stored entries, or None if there's no usable index
+        """
+        if self.path is None:
+            return None
+        try:
+            f = open(self.path, 'r')
+        except EnvironmentError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                raise
+            return None
+        with f:
+            if f.readline().rstrip('\n') != self.header:
+                return None
+            try:
+                return self._read_entries(f)
+            except (ValueError, IndexError):
+                # corrupt; everything is read afresh.
+                return None
+
+    def _read_entries(self, f):
+        """
+        :param f: the index file, positioned after the header
+        :return: dict of the entries
+        """
+        raise NotImplementedError(self, '_read_entries')
+
+    def _write_entries(self, f, cutoff):
+        """
+        write the entries to f, after the header
+
+        :param cutoff: entries read from anything modified after this time
+            must be left out, per :obj:`racy_window`
+        """
+        raise NotImplementedError(self, '_write_entries')
+
+    def save(self):
+        """write the index out if it's changed since it was read"""
+        if self.readonly or self.path is None or not self._dirty:
+            return
+        self._write()
+        self._dirty = False
+
+    def _write(self):
+        ensure_dirs(os.path.dirname(self.path), mode=0775, minimal=True)
+        f = AtomicWriteFile(self.path)
+        try:
+            f.write(self.header + '\n')
+            self._write_entries(f, time.time() - self.racy_window)
+        except:
+            f.discard()
+            raise
+        f.close()
+
+    def try_save(self):
+        """:obj:`save`, logging failures rather than raising them"""
+        try:
+            self.save()
+        except EnvironmentError as e:
+            if e.errno in (errno.EACCES, errno.EPERM, errno.EROFS):
+                # queries are commonly run without access to the cache.
+                logger.debug("not writing %s %s: %s", self.description,
+                             self.path, e)
+            else:
+                logger.warning("failed writing %s %s: %s", self.description,
+                               self.path, e)
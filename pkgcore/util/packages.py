@@ -1,7 +1,7 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
-__all__ = ("get_raw_pkg", "groupby_pkg")
+__all__ = ("get_raw_pkg", "groupby_pkg", "merge_sorted", "key_sorter")
 
 import itertools, operator
 
@@ -15,3 +15,78 @@ groupby_key_getter = operator.attrgetter("key")
 def groupby_pkg(iterable):
     for key, pkgs in itertools.groupby(iterable, groupby_key_getter):
         yield pkgs
+
+
+def merge_sorted(iterables, key, reverse=False):
+    """Lazily merge iterables each already sorted by key.
+
+    :param iterables: iterables to merge, each sorted by key (descending
+        if reverse)
+    :param key: callable returning the sort key of an item; it's invoked
+        once per item
+    :param reverse: if True, the iterables are sorted from highest to lowest
+    :return: iterator over the items of all iterables in key order; items of
+        equal key come in the order of the iterables passed in
+
+    The number of iterables is expected to be small (repositories in a
+    stack), so picking the next item is a C level min/max over the current
+    heads rather than heap upkeep.
+    """
+    heads = []
+    for idx, iterable in enumerate(iterables):
+        iterable = iter(iterable)
+        for item in iterable:
+            # idx breaks ties, so items themselves are never compared.
+            heads.append([key(item), -idx if reverse else idx, item,
+                          iterable])
+            break
+    pick = max if reverse else min
+    while len(heads) > 1:
+        head = pick(heads)
+        yield head[2]
+        for item in head[3]:
+            head[0] = key(item)
+            head[2] = item
+            break
+        else:
+            heads.remove(head)
+    if heads:
+        yield heads[0][2]
+        for item in heads[0][3]:
+            yield item
+
+
+sort_key_getter = operator.attrgetter("sort_key")
+
+
+class key_sorter(object):
+
+    """
+    repository sorting strategy ordering packages by a key
+
+    Called, it sorts like sorted does (repositories sort categories and
+    package names through it as well); packages are sorted via sort_pkgs,
+    and results of multiple repositories combined via merge_pkgs, both of
+    which compute the key once per package rather than comparing packages
+    pairwise.
+    """
+
+    __slots__ = ("key", "reverse")
+
+    def __init__(self, key=sort_key_getter, reverse=False):
+        """
+        :param key: callable returning the sort key of a package; defaults
+            to its cpv's, see :obj:`pkgcore.ebuild.cpv.sort_key`
+        :param reverse: if True, sort from highest to lowest
+        """
+        self.key = key
+        self.reverse = reverse
+
+    def __call__(self, iterable):
+        return sorted(iterable, reverse=self.reverse)
+
+    def sort_pkgs(self, pkgs):
+        return sorted(pkgs, key=self.key, reverse=self.reverse)
+
+    def merge_pkgs(self, *iterables):
+        return merge_sorted(iterables, self.key, reverse=self.reverse)
@@ -1,18 +1,21 @@
 # Copyright: 2005-2010 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
-__all__ = ("LookupFsDev", "ContentsFile")
+__all__ = ("LookupFsDev", "ContentsFile", "OwnerIndex")
 
 from pkgcore.fs.contents import contentsSet
 from pkgcore.fs import fs
 from snakeoil import data_source
 
 from snakeoil.fileutils import AtomicWriteFile
+from snakeoil.osutils import listdir_dirs, pjoin
+from pkgcore.util.file_index import FileIndex
 from snakeoil.demandload import demandload
 demandload(globals(),
     'os',
     'stat',
     'errno',
+    'mmap',
     'snakeoil.chksum:get_handler',
     'snakeoil.fileutils:readlines_ascii',
     'pkgcore:os_data',
@@ -155,3 +158,211 @@ class ContentsFile(contentsSet):
         finally:
             # if atomic, it forces the update to be wiped.
             del outfile
+
+
+class OwnerIndex(FileIndex):
+
+    """
+    on disk index of the paths owned by the packages of a vdb
+
+    Each package is indexed along with the mtime of its vdb directory, and
+    reindexed from its CONTENTS whenever that changes; packages are merged
+    by renaming a fully written directory into place, so this catches
+    anything merged, unmerged or replaced since, by pkgcore or otherwise.
+    The format is::
+
+        category/pf<tab>mtime
+        ...
+        <empty line>
+        path<tab>category/pf category/pf...
+        ...
+
+    the path lines being sorted, so while the index is current, owners are
+    found by a binary search of the file rather than reading all of it.
+
+    Packages are merged by renaming their directory into place whole, so
+    racy modifications aren't a concern, unlike for other indexes.
+
+    :ivar location: location of the vdb
+    """
+
+    magic = 'pkgcore-vdb-owner-index-1'
+    description = 'vdb owner index'
+
+    def __init__(self, location, path=None, readonly=False):
+        FileIndex.__init__(self, path, readonly)
+        self.location = location
+        # path -> set of cpvs; only loaded once the index needs changes.
+        self._owners = None
+        # the index file (or None), and the offset of its path lines.
+        self._data = None
+        self._offset = 0
+        self._checked = False
+
+    @property
+    def header(self):
+        return '%s %s' % (self.magic, self.location)
+
+    def _read_entries(self, f):
+        # cpv -> mtime of its vdb directory when indexed.
+        mtimes = {}
+        # readline rather than iteration, so tell() is accurate.
+        for line in iter(f.readline, ''):
+            line = line.rstrip('\n')
+            if not line:
+                break
+            cpv, mtime = line.split('\t')
+            mtimes[cpv] = float(mtime)
+        else:
+            # truncated.
+            return {}
+        self._offset = f.tell()
+        if os.fstat(f.fileno()).st_size > self._offset:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mtimes
+
+    def _scan(self):
+        """:return: dict mapping the cpvs in the vdb to their mtimes"""
+        found = {}
+        try:
+            categories = listdir_dirs(self.location)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return found
+        for category in categories:
+            if category.startswith('.'):
+                continue
+            cpath = pjoin(self.location, category)
+            try:
+                names = os.listdir(cpath)
+            except EnvironmentError as e:
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                continue
+            for name in names:
+                if name.startswith(('.', '-MERGING-')) or \
+                        name.endswith('.lockfile'):
+                    continue
+                try:
+                    st = os.stat(pjoin(cpath, name))
+                except EnvironmentError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    found['%s/%s' % (category, name)] = st.st_mtime
+        return found
+
+    def _iter_lines(self):
+        data = self._data
+        if data is None:
+            return iter(())
+        return iter(data[self._offset:].splitlines())
+
+    def _load_owners(self):
+        owners = {}
+        for line in self._iter_lines():
+            path, cpvs = line.rsplit('\t', 1)
+            owners[path] = set(cpvs.split())
+        self._owners = owners
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+    def _read_contents(self, cpv):
+        try:
+            return ContentsFile(pjoin(self.location, cpv, 'CONTENTS'))
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return ()
+
+    def _check(self):
+        mtimes = self._entries
+        current = self._scan()
+        stale = [cpv for cpv, mtime in current.iteritems()
+                 if mtimes.get(cpv) != mtime]
+        removed = set(mtimes).difference(current)
+        self._checked = True
+        if not stale and not removed:
+            return
+        if self._owners is None:
+            self._load_owners()
+        owners = self._owners
+        dropped = removed.union(x for x in stale if x in mtimes)
+        if dropped:
+            for path, cpvs in owners.items():
+                cpvs.difference_update(dropped)
+                if not cpvs:
+                    del owners[path]
+        for cpv in removed:
+            del mtimes[cpv]
+        for cpv in stale:
+            for obj in self._read_contents(cpv):
+                owners.setdefault(obj.location, set()).add(cpv)
+            mtimes[cpv] = current[cpv]
+        self._dirty = True
+
+    def _bisect(self, path):
+        data, lo = self._data, self._offset
+        if data is None:
+            return ()
+        hi = len(data)
+        # lo and hi always sit at the start of a line.
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = data.rfind('\n', lo, mid) + 1 or lo
+            end = data.find('\n', start)
+            sep = data.rfind('\t', start, end)
+            line_path = data[start:sep]
+            if line_path < path:
+                lo = end + 1
+            elif line_path > path:
+                hi = start
+            else:
+                return tuple(data[sep + 1:end].split())
+        return ()
+
+    def owners(self, path):
+        """
+        :return: sorted tuple of the cpvs owning path, which must be
+            normalized as :obj:`pkgcore.fs.fs.fsBase` locations are
+        """
+        if not self._checked:
+            self._check()
+        if self._owners is None:
+            return self._bisect(path)
+        return tuple(sorted(self._owners.get(path, ())))
+
+    def iteritems(self):
+        """yield (path, cpvs) for every owned path, sorted by path"""
+        if not self._checked:
+            self._check()
+        if self._owners is None:
+            for line in self._iter_lines():
+                path, cpvs = line.rsplit('\t', 1)
+                yield path, tuple(cpvs.split())
+            return
+        for path, cpvs in sorted(self._owners.iteritems()):
+            yield path, tuple(sorted(cpvs))
+
+    def refresh(self):
+        """
+        bring the index up to date after the vdb was modified, and save it
+
+        An index that was neither used nor written yet is left alone; it's
+        built when it's first needed.
+        """
+        if not self._checked and (self.path is None or
+                                  not os.path.exists(self.path)):
+            return
+        self._check()
+        self.save()
+
+    def _write_entries(self, f, cutoff):
+        for cpv, mtime in sorted(self._entries.iteritems()):
+            f.write('%s\t%r\n' % (cpv, mtime))
+        f.write('\n')
+        for path, cpvs in sorted(self._owners.iteritems()):
+            f.write('%s\t%s\n' % (path, ' '.join(sorted(cpvs))))
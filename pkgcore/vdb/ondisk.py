@@ -1,11 +1,12 @@
 # Copyright: 2005-2011 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
-__all__ = ("tree", "ConfiguredTree")
+__all__ = ("tree", "ConfiguredTree", "MetadataIndex")
 
 import os, stat, errno
 
 from pkgcore.repository import prototype, errors
+from pkgcore.restrictions import boolean, packages, values
 from pkgcore.vdb import virtuals
 from pkgcore.plugin import get_plugin
 from snakeoil import data_source
@@ -15,6 +16,7 @@ from pkgcore.config import ConfigHint
 from pkgcore.ebuild.cpv import versioned_CPV
 from pkgcore.ebuild import ebuild_built
 from pkgcore.ebuild.errors import InvalidCPV
+from pkgcore.util.file_index import FileIndex
 
 from snakeoil.osutils import pjoin
 from snakeoil.mappings import IndeterminantDict
@@ -25,11 +27,142 @@ from snakeoil import klass, compatibility
 from snakeoil.demandload import demandload
 demandload(globals(),
     'pkgcore.vdb:repo_ops',
-    'pkgcore.vdb.contents:ContentsFile',
+    'pkgcore.vdb.contents:ContentsFile,OwnerIndex',
     'pkgcore.log:logger',
 )
 
 
+class MetadataIndex(FileIndex):
+
+    """
+    on disk index of the commonly used metadata of a vdb's packages
+
+    Each package's values are stored along with the mtime of its vdb
+    directory, and used only while that's unchanged; loading the state of
+    every installed package then costs a stat per package, rather than an
+    open per package and key.  The format is::
+
+        category/pf<tab>mtime<tab>value<tab>value...
+
+    values being in the order of :obj:`keys`, escaped, and prefixed with
+    '=' (a missing file being an empty field).
+
+    :ivar location: location of the vdb
+    """
+
+    magic = 'pkgcore-vdb-metadata-index-1'
+    description = 'vdb metadata index'
+    keys = ('SLOT', 'USE', 'IUSE', 'KEYWORDS', 'DEPEND', 'RDEPEND',
+            'PDEPEND', 'repository', 'EAPI')
+
+    def __init__(self, location, path, readonly=False):
+        FileIndex.__init__(self, path, readonly)
+        self.location = location
+        # cpvs whose entries were checked against their vdb directory.
+        self._checked = set()
+
+    @property
+    def header(self):
+        return '%s %s %s' % (self.magic, self.location, ' '.join(self.keys))
+
+    def _read_entries(self, f):
+        entries = {}
+        count = len(self.keys)
+        for line in f:
+            chunks = line.rstrip('\n').split('\t')
+            if len(chunks) != count + 2:
+                # corrupt; it's reread from the vdb.
+                continue
+            entries[chunks[0]] = (float(chunks[1]), tuple(
+                x[1:].decode('string_escape') if x else None
+                for x in chunks[2:]))
+        return entries
+
+    def lookup(self, cpv):
+        """
+        :return: (mtime, values) for cpv; mtime is that of its vdb
+            directory, or None if it's missing, and values the stored
+            values (None for missing files) if they're current, else None
+        """
+        stored = self._entries.get(cpv)
+        if cpv in self._checked:
+            # already checked (or stored) by this instance.
+            return stored
+        try:
+            mtime = os.stat(pjoin(self.location, cpv)).st_mtime
+        except EnvironmentError:
+            return None, None
+        if stored is not None and stored[0] == mtime:
+            self._checked.add(cpv)
+            return stored
+        return mtime, None
+
+    def invalidate(self, cpv):
+        """forget cpv's entry, since its vdb directory was replaced"""
+        if self._entries.pop(cpv, None) is not None:
+            self._dirty = True
+        self._checked.discard(cpv)
+
+    def update(self, cpv, mtime, values):
+        """store the values read for cpv while its directory had mtime"""
+        self._entries[cpv] = (mtime, tuple(values))
+        self._checked.add(cpv)
+        self._dirty = True
+
+    def _write_entries(self, f, cutoff):
+        entries = self._entries
+        # drop what was since unmerged.
+        for cpv in [x for x in entries if x not in self._checked]:
+            if not os.path.isdir(pjoin(self.location, cpv)):
+                del entries[cpv]
+        for cpv, (mtime, values) in sorted(entries.iteritems()):
+            if mtime >= cutoff:
+                continue
+            f.write('%s\t%r\t%s\n' % (cpv, mtime, '\t'.join(
+                '' if x is None else '=' + x.encode('string_escape')
+                for x in values)))
+
+
+def _owner_filters(restrict):
+    """Return what a restriction requires packages to own, or None.
+
+    A restriction only matches packages owning a path satisfying one of the
+    filters returned; each is either a frozenset of paths, or a callable
+    testing a path.  None means it isn't limited to owners.
+    """
+    if getattr(restrict, 'negate', True):
+        return None
+    if isinstance(restrict, packages.PackageRestriction):
+        if restrict.attr != 'contents':
+            return None
+        r = restrict.restriction
+        if isinstance(r, values.ContainmentMatch2):
+            if r.negate or r.all:
+                return None
+            return [frozenset(x.location for x in r.vals)]
+        if isinstance(r, values.AnyMatch) and not r.negate:
+            r = r.restriction
+            if isinstance(r, values.GetAttrRestriction) and \
+                    r.attr == 'location' and not r.negate:
+                return [r.restriction.match]
+        return None
+    if isinstance(restrict, boolean.OrRestriction):
+        filters = []
+        for x in restrict.restrictions:
+            l = _owner_filters(x)
+            if l is None:
+                # one branch matches regardless of contents.
+                return None
+            filters.extend(l)
+        return filters or None
+    if isinstance(restrict, boolean.AndRestriction):
+        for x in restrict.restrictions:
+            l = _owner_filters(x)
+            if l is not None:
+                return l
+    return None
+
+
 class tree(prototype.tree):
     livefs = True
     configured = False
@@ -138,13 +271,58 @@ class tree(prototype.tree):
     _metadata_rewrites = {
         "depends":"DEPEND", "rdepends":"RDEPEND", "post_rdepends":"PDEPEND",
         "use":"USE", "eapi":"EAPI", "CONTENTS":"contents", "provides":"PROVIDE",
-        "source_repository":"repository", "fullslot":"SLOT"
+        "source_repository":"repository", "repo":"repository",
+        "fullslot":"SLOT"
     }
 
+    @klass.jit_attr
+    def metadata_index(self):
+        """
+        :obj:`MetadataIndex` of the installed packages' commonly used
+        metadata, or None if there's no cache_location to store it in.
+        """
+        if self.cache_location is None:
+            return None
+        return MetadataIndex(self.location,
+            pjoin(self.cache_location, 'metadata.index'))
+
+    def save_metadata_index(self):
+        """
+        Write out the metadata read so far to the on disk metadata index.
+        """
+        index = self.metadata_index
+        if index is not None:
+            index.try_save()
+
     def _get_metadata(self, pkg):
-        return IndeterminantDict(partial(self._internal_load_key,
-            pjoin(self.location, pkg.category,
-                "%s-%s" % (pkg.package, pkg.fullver))))
+        dirname = "%s-%s" % (pkg.package, pkg.fullver)
+        path = pjoin(self.location, pkg.category, dirname)
+        if self.metadata_index is None:
+            return IndeterminantDict(partial(self._internal_load_key, path))
+        return IndeterminantDict(partial(self._indexed_load_key, path,
+            "%s/%s" % (pkg.category, dirname)))
+
+    def _indexed_load_key(self, path, cpv, key):
+        index = self.metadata_index
+        key = self._metadata_rewrites.get(key, key)
+        try:
+            pos = index.keys.index(key)
+        except ValueError:
+            return self._internal_load_key(path, key)
+        mtime, values = index.lookup(cpv)
+        if values is None:
+            values = []
+            for x in index.keys:
+                try:
+                    values.append(self._internal_load_key(path, x))
+                except KeyError:
+                    values.append(None)
+            if mtime is not None:
+                index.update(cpv, mtime, values)
+        value = values[pos]
+        if value is None:
+            raise KeyError((path, key))
+        return value
 
     def _internal_load_key(self, path, key):
         key = self._metadata_rewrites.get(key, key)
@@ -163,7 +341,7 @@ class tree(prototype.tree):
             fp = pjoin(path,
                 os.path.basename(path.rstrip(os.path.sep))+".ebuild")
             data = data_source.local_source(fp)
-        elif key == 'repo':
+        elif key == 'repository':
             # try both, for portage/paludis compatibility.
             data = readfile(pjoin(path, 'repository'), True)
             if data is None:
@@ -176,6 +354,89 @@ class tree(prototype.tree):
                 raise KeyError((path, key))
         return data
 
+    @klass.jit_attr
+    def owner_index(self):
+        """
+        :obj:`pkgcore.vdb.contents.OwnerIndex` of the paths installed
+        packages own; stored in cache_location, if there is one.
+        """
+        path = None
+        if self.cache_location is not None:
+            path = pjoin(self.cache_location, 'owners.index')
+        return OwnerIndex(self.location, path)
+
+    def _owning_cpvs(self, filters):
+        index = self.owner_index
+        cpvs = set()
+        for f in filters:
+            if isinstance(f, frozenset):
+                for path in f:
+                    cpvs.update(index.owners(path))
+            else:
+                for path, owners in index.iteritems():
+                    if f(path):
+                        cpvs.update(owners)
+        return cpvs
+
+    def owners(self, paths):
+        """Return the installed packages owning any of the given paths.
+
+        This uses the owner index rather than reading the CONTENTS of every
+        installed package.
+
+        :param paths: normalized paths, as :obj:`pkgcore.fs.fs.fsBase`
+            locations are
+        :return: sorted list of packages
+        """
+        pkgs = []
+        for cpvstr in sorted(self._owning_cpvs([frozenset(paths)])):
+            try:
+                cpv = versioned_CPV(cpvstr)
+                pkgs.append(self[(cpv.category, cpv.package, cpv.fullver)])
+            except (InvalidCPV, KeyError):
+                continue
+        return pkgs
+
+    def save_owner_index(self):
+        """
+        Write out the owner index if it was built or brought up to date.
+        """
+        self.owner_index.try_save()
+
+    def save_indexes(self):
+        self.save_metadata_index()
+        self.save_owner_index()
+
+    def _update_metadata_index(self, *pkgs):
+        index = self.metadata_index
+        if index is not None:
+            for pkg in pkgs:
+                index.invalidate(
+                    "%s/%s-%s" % (pkg.category, pkg.package, pkg.fullver))
+
+    def _update_owner_index(self):
+        index = self.owner_index
+        try:
+            index.refresh()
+        except EnvironmentError as e:
+            # it's caught up with on the next lookup.
+            logger.warning("failed updating vdb owner index %s: %s",
+                           index.path, e)
+
+    def _identify_candidates(self, restrict, sorter):
+        candidates = super(tree, self)._identify_candidates(restrict, sorter)
+        filters = _owner_filters(restrict)
+        if filters is None:
+            return candidates
+        owners = set()
+        for cpvstr in self._owning_cpvs(filters):
+            try:
+                cpv = versioned_CPV(cpvstr)
+            except InvalidCPV:
+                continue
+            owners.add((cpv.category, cpv.package))
+        return [cp for cp in candidates if cp in owners]
+
     def notify_remove_package(self, pkg):
         remove_it = len(self.packages[pkg.category]) == 1
         prototype.tree.notify_remove_package(self, pkg)
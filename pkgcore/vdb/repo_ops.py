@@ -119,9 +119,14 @@ class install(repo_ops.install):
             f.write("pkgcore-%s\n" % VERSION)
         return True
 
-    def finalize_data(self):
+    def _move_into_place(self):
         os.rename(self.tmp_write_path, self.install_path)
         update_mtime(self.repo.location)
+
+    def finalize_data(self):
+        self._move_into_place()
+        self.repo._update_metadata_index(self.new_pkg)
+        self.repo._update_owner_index()
         return True
 
 
@@ -135,10 +140,15 @@ class uninstall(repo_ops.uninstall):
     def remove_data(self):
         return True
 
-    def finalize_data(self):
+    def _remove_from_place(self):
         update_mtime(self.repo.location)
         shutil.rmtree(self.remove_path)
         update_mtime(self.repo.location)
+
+    def finalize_data(self):
+        self._remove_from_place()
+        self.repo._update_metadata_index(self.old_pkg)
+        self.repo._update_owner_index()
         return True
 
 
@@ -160,8 +170,10 @@ class replace(repo_ops.replace, install, uninstall):
         # literal same fullver replacements), then wipe the unmerge
         # that minimizes the window for races, and gets the data in place
         # should unmerge somehow die.
-        uninstall.finalize_data(self)
-        install.finalize_data(self)
+        self._remove_from_place()
+        self._move_into_place()
+        self.repo._update_metadata_index(self.old_pkg, self.new_pkg)
+        self.repo._update_owner_index()
         return True
 
 
@@ -62,6 +62,7 @@ typedef struct {
 	PyObject *revision;
 	Py_ssize_t *suffixes;
 	long hash_val;
+	PyObject *sort_key;
 } pkgcore_cpv;
 
 static PyObject *pkgcore_InvalidCPV_Exc = NULL;
@@ -92,8 +93,125 @@ pkgcore_cpv_get_cpvstr(pkgcore_cpv *self, void *closure)
 }
 
 
+static char *
+pkgcore_cpv_pack_num(char *out, const char *digits, Py_ssize_t len)
+{
+	*out++ = (len >> 8) & 0xff;
+	*out++ = len & 0xff;
+	memcpy(out, digits, len);
+	return out + len;
+}
+
+/*
+ * builds the same key pkgcore.ebuild.cpv.sort_key does; see ver_key there
+ * for the layout.  suffixes are stored as offsets into
+ * pkgcore_ebuild_suffixes, which are ver_key's suffix values + 4.
+ */
+static PyObject *
+pkgcore_cpv_build_sort_key(pkgcore_cpv *self)
+{
+	PyObject *key = NULL, *rev = NULL;
+	char *cat, *pkg, *ver = NULL, *out, *p;
+	char num[32];
+	Py_ssize_t cat_len, pkg_len, ver_len = 0, rev_len = 0, suffix_count = 0;
+	Py_ssize_t size, x;
+
+	if(PyString_AsStringAndSize(self->category, &cat, &cat_len) ||
+		PyString_AsStringAndSize(self->package, &pkg, &pkg_len))
+		return NULL;
+	size = cat_len + pkg_len + 2;
+	if(self->version) {
+		if(PyString_AsStringAndSize(self->version, &ver, &ver_len))
+			return NULL;
+		// the default suffix terminates the list, and is included in the key.
+		while(PKGCORE_EBUILD_SUFFIX_DEFAULT_SUF !=
+			self->suffixes[suffix_count * 2])
+			suffix_count++;
+		suffix_count++;
+		if(self->revision) {
+			if(!(rev = PyObject_Str(self->revision)))
+				return NULL;
+			rev_len = PyString_GET_SIZE(rev);
+		}
+		// components take at most 3 bytes beyond their digits; suffix
+		// numbers are at most 19 digits.
+		size += ver_len * 4 + 2 + suffix_count * 22 + 2 + rev_len;
+	}
+	if(!(key = PyString_FromStringAndSize(NULL, size)))
+		goto cleanup;
+	out = PyString_AS_STRING(key);
+	memcpy(out, cat, cat_len);
+	out += cat_len;
+	*out++ = '\0';
+	memcpy(out, pkg, pkg_len);
+	out += pkg_len;
+	*out++ = '\0';
+
+	if(ver) {
+		char letter = '\0';
+		p = ver;
+		for(;;) {
+			char *c_start = p;
+			while(isdigit(*p))
+				p++;
+			if('0' == *c_start) {
+				// float comparison rules; trailing zeros are insignificant.
+				char *c_end = p;
+				while(c_end != c_start && '0' == c_end[-1])
+					c_end--;
+				*out++ = '\x01';
+				memcpy(out, c_start, c_end - c_start);
+				out += c_end - c_start;
+				*out++ = '\0';
+			} else {
+				*out++ = '\x02';
+				out = pkgcore_cpv_pack_num(out, c_start, p - c_start);
+			}
+			if(isalpha(*p)) {
+				letter = *p;
+				p++;
+			}
+			if('.' != *p)
+				break;
+			p++;
+		}
+		*out++ = '\0';
+		*out++ = letter;
+		for(x = 0; x < suffix_count; x++) {
+			Py_ssize_t val = self->suffixes[x * 2 + 1];
+			*out++ = self->suffixes[x * 2] + 1;
+			out = pkgcore_cpv_pack_num(out, num,
+				val ? snprintf(num, sizeof(num), "%zd", val) : 0);
+		}
+		out = pkgcore_cpv_pack_num(out, rev ? PyString_AS_STRING(rev) : "",
+			rev_len);
+	}
+	_PyString_Resize(&key, out - PyString_AS_STRING(key));
+
+cleanup:
+	Py_XDECREF(rev);
+	return key;
+}
+
+static PyObject *
+pkgcore_cpv_get_sort_key(pkgcore_cpv *self, void *closure)
+{
+	if(!self->sort_key) {
+		if (!self->category || !self->package) {
+			PyErr_SetString(PyExc_AttributeError, "sort_key");
+			return NULL;
+		}
+		if(!(self->sort_key = pkgcore_cpv_build_sort_key(self)))
+			return NULL;
+	}
+	Py_INCREF(self->sort_key);
+	return self->sort_key;
+}
+
+
 static PyGetSetDef pkgcore_cpv_getsetters[] = {
 snakeoil_GETSET(pkgcore_cpv, "cpvstr", cpvstr),
+	{"sort_key", (getter)pkgcore_cpv_get_sort_key, NULL, NULL},
 	{NULL}
 };
 
@@ -612,6 +730,7 @@ pkgcore_cpv_init(pkgcore_cpv *self, PyObject *args, PyObject *kwds)
 	}
 
 	self->hash_val = -1;
+	Py_CLEAR(self->sort_key);
 
 	if(package) {
 		if(!fullver || !PyString_CheckExact(category) ||
@@ -696,6 +815,7 @@ cleanup:
 	Py_CLEAR(self->version);
 	Py_CLEAR(self->revision);
 	Py_CLEAR(self->fullver);
+	Py_CLEAR(self->sort_key);
 
 	if(NULL != self->suffixes) {
 		// if we're not using the communal val...
@@ -717,6 +837,7 @@ pkgcore_cpv_dealloc(pkgcore_cpv *self)
 	Py_CLEAR(self->version);
 	Py_CLEAR(self->revision);
 	Py_CLEAR(self->fullver);
+	Py_CLEAR(self->sort_key);
 
 	if(NULL != self->suffixes) {
 		if(PKGCORE_EBUILD_SUFFIX_DEFAULT_SUF != self->suffixes[0]) {
@@ -998,6 +1119,7 @@ pkgcore_cpv_heapytraverse(NyHeapTraverse* traverse)
 	VISIT(cpv->fullver);
 	VISIT(cpv->version);
 	VISIT(cpv->revision);
+	VISIT(cpv->sort_key);
 	return 0;
 }
 
@@ -1011,6 +1133,7 @@ pkgcore_cpv_heapyrelate(NyHeapRelate *r)
 	ATTR(fullver);
 	ATTR(version);
 	ATTR(revision);
+	ATTR(sort_key);
 	return 0;
 }
 